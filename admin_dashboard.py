@@ -17,8 +17,10 @@ except KeyError:
     st.stop()
 
 # Xây dựng các endpoint Admin
-ADMIN_DEVICES_URL = f"{API_BASE_URL}/admin/devices"
-# Các URL (vị trí, cảnh báo) sẽ được xây dựng động sau khi chọn thiết bị
+# Snapshot hạm đội: danh sách thiết bị + vị trí cuối + số cảnh báo chưa đọc trong MỘT request
+ADMIN_FLEET_SNAPSHOT_URL = f"{API_BASE_URL}/admin/fleet/snapshot"
+FLEET_PAGE_SIZE = 5000
+# URL cảnh báo chi tiết sẽ được xây dựng động sau khi chọn thiết bị
 
 # --- CÁC HÀM GỌI API (v3.0) ---
 
@@ -28,59 +30,57 @@ def get_admin_headers():
         "X-Admin-Api-Key": ADMIN_API_KEY
     }
 
-@st.cache_data(ttl=60) # Cache danh sách thiết bị trong 60s
-def get_fleet_list():
+@st.cache_data(ttl=15) # Cache snapshot hạm đội trong 15s
+def get_fleet_snapshot():
     """
-    (BƯỚC A) Tải Hạm đội: Gọi GET /admin/devices
+    (BƯỚC A) Tải Hạm đội: Gọi GET /admin/fleet/snapshot
+    Một request cho tới FLEET_PAGE_SIZE thiết bị; hạm đội lớn hơn thì tải thêm từng trang.
+    Trả về dict {device_id: snapshot}.
     """
+    fleet = {}
+    offset = 0
     try:
-        response = requests.get(ADMIN_DEVICES_URL, headers=get_admin_headers(), timeout=10)
-        if response.status_code == 200:
-            devices = response.json()
-            # Trả về danh sách các (tên hiển thị, id)
-            return [(f"{d['id']} ({d.get('vehicle_model', 'N/A')})", d['id']) for d in devices]
-        else:
-            st.error(f"Lỗi tải Hạm đội (API {response.status_code}): {response.text}")
-            return []
+        while True:
+            response = requests.get(ADMIN_FLEET_SNAPSHOT_URL, headers=get_admin_headers(),
+                                    params={"limit": FLEET_PAGE_SIZE, "offset": offset}, timeout=30)
+            if response.status_code != 200:
+                st.error(f"Lỗi tải Hạm đội (API {response.status_code}): {response.text}")
+                return fleet
+            data = response.json()
+            for d in data["devices"]:
+                fleet[d["id"]] = d
+            offset += len(data["devices"])
+            if not data["devices"] or offset >= data["total"]:
+                return fleet
     except Exception as e:
         st.error(f"Lỗi kết nối khi tải Hạm đội: {e}")
-        return []
+        return fleet
 
-@st.cache_data(ttl=15) # Cache dữ liệu thiết bị trong 15s
-def get_device_data(device_id: str):
+@st.cache_data(ttl=15) # Cache cảnh báo của thiết bị trong 15s
+def get_device_alerts(device_id: str):
     """
-    (BƯỚC C) Tải Dữ liệu Động cho thiết bị đã chọn.
+    (BƯỚC C) Tải danh sách Cảnh báo chưa đọc cho thiết bị đã chọn.
     """
     if not device_id:
-        return None, []
+        return []
         
-    location_url = f"{API_BASE_URL}/admin/devices/{device_id}/location"
     alerts_url = f"{API_BASE_URL}/admin/devices/{device_id}/alerts"
     
-    location_data = None
-    alerts_data = []
-    
     try:
-        # Lấy Vị trí
-        response_loc = requests.get(location_url, headers=get_admin_headers(), timeout=10)
-        if response_loc.status_code == 200:
-            location_data = response_loc.json()
-        elif response_loc.status_code == 404:
-             st.warning(f"Thiết bị '{device_id}' chưa có dữ liệu vị trí.")
-        else:
-            st.error(f"Lỗi tải Vị trí (API {response_loc.status_code}): {response_loc.text}")
-
-        # Lấy Cảnh báo
         response_alerts = requests.get(alerts_url, headers=get_admin_headers(), timeout=10)
         if response_alerts.status_code == 200:
-            alerts_data = sorted(response_alerts.json(), key=lambda x: x['timestamp'], reverse=True)
-        else:
-            st.error(f"Lỗi tải Cảnh báo (API {response_alerts.status_code}): {response_alerts.text}")
-            
+            return sorted(response_alerts.json(), key=lambda x: x['timestamp'], reverse=True)
+        st.error(f"Lỗi tải Cảnh báo (API {response_alerts.status_code}): {response_alerts.text}")
     except Exception as e:
-        st.error(f"Lỗi kết nối API khi tải dữ liệu thiết bị: {e}")
+        st.error(f"Lỗi kết nối API khi tải cảnh báo thiết bị: {e}")
         
-    return location_data, alerts_data
+    return []
+
+def get_device_location(snapshot: dict):
+    """Vị trí cuối của thiết bị lấy từ snapshot (None nếu chưa có)."""
+    if not snapshot or snapshot.get('last_seen') is None:
+        return None
+    return {"last_lat": snapshot['last_lat'], "last_lon": snapshot['last_lon'], "last_seen": snapshot['last_seen']}
 
 def mark_alert_as_read(alert_id: str):
     """
@@ -102,13 +102,37 @@ def mark_alert_as_read(alert_id: str):
     except Exception as e:
         st.error(f"Lỗi kết nối khi đánh dấu đã đọc: {e}")
 
+def mark_all_alerts_as_read(device_id: str):
+    """
+    Gọi API 'PUT /admin/alerts/read' để đánh dấu MỌI cảnh báo chưa đọc của thiết bị trong một request
+    """
+    mark_url = f"{API_BASE_URL}/admin/alerts/read"
+    
+    try:
+        response = requests.put(mark_url, headers=get_admin_headers(), json={"device_id": device_id}, timeout=30)
+        
+        if response.status_code == 200:
+            st.success(f"Đã đánh dấu {response.json()['updated']} cảnh báo là đã đọc!")
+            st.cache_data.clear()
+            st.rerun()
+        else:
+            st.error(f"Lỗi {response.status_code} khi đánh dấu đã đọc: {response.text}")
+            
+    except Exception as e:
+        st.error(f"Lỗi kết nối khi đánh dấu đã đọc: {e}")
+
 # --- XÂY DỰNG GIAO DIỆN (UI v3.0) ---
 
 st.set_page_config(layout="wide")
 st.title("🛰️ Bảng điều khiển Quản lý Hạm đội BOLT")
 
 # --- (BƯỚC A & B) Tải Hạm đội & Selectbox ---
-fleet_list = get_fleet_list()
+fleet = get_fleet_snapshot()
+# Danh sách các (tên hiển thị, id); kèm số cảnh báo chưa đọc nếu có
+fleet_list = [
+    (f"{d['id']} ({d.get('vehicle_model') or 'N/A'})" + (f" - 🔔 {d['unread_alert_count']}" if d['unread_alert_count'] else ""), d['id'])
+    for d in fleet.values()
+]
 
 if not fleet_list:
     st.error("Không thể tải danh sách Hạm đội từ API. Vui lòng kiểm tra ADMIN_API_KEY và API Server.")
@@ -132,7 +156,10 @@ if st.button("Tải lại Dữ liệu (Refresh)"):
     st.rerun()
 
 # --- (BƯỚC C) Tải Dữ liệu Động ---
-location, alerts = get_device_data(selected_device_id)
+selected_snapshot = fleet.get(selected_device_id)
+location = get_device_location(selected_snapshot)
+# Chỉ gọi API cảnh báo khi snapshot báo thiết bị có cảnh báo chưa đọc
+alerts = get_device_alerts(selected_device_id) if selected_snapshot and selected_snapshot['unread_alert_count'] else []
 
 col1, col2 = st.columns([2, 3])
 
@@ -160,9 +187,16 @@ with col1:
 
 # --- CỘT 2: DANH SÁCH CẢNH BÁO (TƯƠNG TÁC) ---
 with col2:
-    st.header(f"🔔 Cảnh báo Chưa đọc ({len(alerts)})")
+    # Danh sách cảnh báo chỉ là trang đầu (mới nhất); tổng số lấy từ snapshot
+    unread_count = selected_snapshot['unread_alert_count'] if selected_snapshot else len(alerts)
+    st.header(f"🔔 Cảnh báo Chưa đọc ({unread_count})")
+    if unread_count > len(alerts):
+        st.caption(f"Đang hiển thị {len(alerts)} cảnh báo mới nhất.")
 
     if alerts:
+        if st.button(f"Đọc tất cả ({unread_count})", help=f"Đánh dấu mọi cảnh báo của {selected_device_id} là đã đọc"):
+            mark_all_alerts_as_read(selected_device_id)
+
         hdr_cols = st.columns([0.25, 0.15, 0.45, 0.15])
         hdr_cols[0].markdown("**Thời gian**")
         hdr_cols[1].markdown("**Loại**")
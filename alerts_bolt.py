@@ -0,0 +1,80 @@
+# === alerts_bolt.py (Nhóm worker xét cảnh báo chạy nền) ===
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AlertWorkerPool:
+    """
+    Nhóm `concurrency` worker asyncio cùng gọi `process_batch()` cho tới khi hết việc.
+    `process_batch` tự nhận (claim) việc từ hàng đợi bền vững và trả về số việc đã xử lý;
+    khi trả về 0, worker ngủ tới lần `notify()` kế tiếp hoặc tối đa `poll_interval` giây.
+    Hàng đợi nằm ngoài lớp này nên có thể thay backend (bảng outbox, Redis, ...) mà không đổi worker.
+    """
+
+    def __init__(self, process_batch: Callable[[], Awaitable[int]], concurrency: int = 2, poll_interval: float = 5.0):
+        self.process_batch = process_batch
+        self.concurrency = max(1, int(concurrency))
+        self.poll_interval = float(poll_interval)
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        # Số liệu thống kê
+        self.processed = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_batch_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return any(not t.done() for t in self._tasks)
+
+    def start(self) -> None:
+        if self.running: return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def notify(self) -> None:
+        """Báo có việc mới (VD: ngay sau khi transaction ghi heartbeat đã commit)."""
+        if self._wake: self._wake.set()
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            # Xoá cờ TRƯỚC khi nhận việc: notify() đến trong lúc xử lý sẽ không bị mất
+            self._wake.clear()
+            bat_dau = time.perf_counter()
+            try:
+                so_viec = await self.process_batch()
+            except Exception as e:
+                self.errors += 1
+                logger.error("Lỗi worker cảnh báo: %s", e)
+                so_viec = 0
+            if so_viec:
+                self.processed += so_viec
+                self.batches += 1
+                self.last_batch_ms = (time.perf_counter() - bat_dau) * 1000
+                continue
+            if self._stopping: break
+            try: await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError: pass
+
+    async def stop(self) -> None:
+        """Dừng sau khi các lô đang xử lý hoàn tất; việc còn lại vẫn nằm trong hàng đợi bền vững."""
+        self._stopping = True
+        self.notify()
+        if self._tasks: await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "processed": self.processed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "last_batch_ms": round(self.last_batch_ms, 3),
+        }
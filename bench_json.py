@@ -0,0 +1,81 @@
+# === bench_json.py (So sánh đường serialize cũ và mới cho response danh sách lớn) ===
+# Cách dùng: python bench_json.py
+# Không cần CSDL: dựng app FastAPI nhỏ với hai route trả cùng dữ liệu,
+#   - "cũ": trả list dict, FastAPI validate theo response_model rồi jsonable_encoder + json chuẩn
+#   - "mới": trả tra_json(...) (bỏ validate lại, encode bằng orjson)
+# và đo thời gian mỗi request qua TestClient (gồm cả chi phí routing/HTTP trong tiến trình).
+import datetime
+import json
+import os
+import random
+import time
+import uuid
+from typing import List
+
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")  # Chỉ để import model, không kết nối
+os.environ.setdefault("ADMIN_API_KEY", "bench")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import json_bolt
+from main import DiemDichVuResponseModel, UserAlertResponse
+from json_bolt import tra_json
+
+SO_LAN_LAP = 20
+
+
+def tao_canh_bao(n: int) -> List[dict]:
+    goc = datetime.datetime(2025, 1, 1, 8, 0, 0)
+    return [{"alert_id": uuid.uuid4(), "device_id": "BOLT-TEST-001", "timestamp": goc + datetime.timedelta(seconds=i, microseconds=i),
+             "alert_type": random.choice(["LOW_FUEL", "ERROR_CODE"]), "message": f"Phát hiện Mã lỗi (P0{i % 1000:03d})! Gara gần nhất: Garage Auto A+ (cách 3.6 km).",
+             "is_read": False, "occurrence_count": 1 + i % 5, "last_seen": goc + datetime.timedelta(seconds=i + 30)} for i in range(n)]
+
+
+def tao_diem(n: int) -> List[dict]:
+    return [{"id": f"GAS{i:06d}", "ten": f"Cây xăng số {i}", "loai": "xang_dau", "dia_chi": None if i % 3 else f"{i} Đường ABC",
+             "vi_do": 10.7 + random.random() / 10, "kinh_do": 106.6 + random.random() / 10, "khoang_cach_km": round(random.random() * 5, 2)} for i in range(n)]
+
+
+def dung_app(du_lieu: dict) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/cu/canh-bao", response_model=List[UserAlertResponse])
+    def cu_canh_bao(): return du_lieu["canh_bao"]
+
+    @app.get("/moi/canh-bao", response_model=List[UserAlertResponse])
+    def moi_canh_bao(): return tra_json(du_lieu["canh_bao"])
+
+    @app.get("/cu/diem", response_model=List[DiemDichVuResponseModel])
+    def cu_diem(): return du_lieu["diem"]
+
+    @app.get("/moi/diem", response_model=List[DiemDichVuResponseModel])
+    def moi_diem(): return tra_json(du_lieu["diem"])
+
+    return app
+
+
+def do(client: TestClient, url: str) -> tuple:
+    body = client.get(url).content  # Làm nóng
+    bat_dau = time.perf_counter()
+    for _ in range(SO_LAN_LAP): client.get(url)
+    return (time.perf_counter() - bat_dau) / SO_LAN_LAP * 1000, body
+
+
+def main():
+    random.seed(1)
+    print(f"Encoder: {'orjson ' + json_bolt.orjson.__version__ if json_bolt.orjson else 'json chuẩn (chưa cài orjson)'}")
+    print(f"{'Response':<12}{'Số dòng':>9}{'Cũ (ms)':>11}{'Mới (ms)':>11}{'Nhanh hơn':>11}")
+    for so_dong in (1000, 10000):
+        du_lieu = {"canh_bao": tao_canh_bao(so_dong), "diem": tao_diem(so_dong)}
+        client = TestClient(dung_app(du_lieu))
+        for ten in ("canh-bao", "diem"):
+            ms_cu, body_cu = do(client, f"/cu/{ten}")
+            ms_moi, body_moi = do(client, f"/moi/{ten}")
+            # Hai đường phải cho cùng một tài liệu JSON
+            assert json.loads(body_cu) == json.loads(body_moi), f"Kết quả /{ten} khác nhau!"
+            print(f"{ten:<12}{so_dong:>9}{ms_cu:>11.1f}{ms_moi:>11.1f}{ms_cu / ms_moi:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
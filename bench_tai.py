@@ -0,0 +1,220 @@
+# === bench_tai.py (Bộ tạo tải cỡ hạm đội: heartbeat đồng thời + truy vấn đọc hỗn hợp) ===
+# Chạy trên một máy với Postgres cục bộ và máy chủ uvicorn đang chạy:
+#   DATABASE_URL=postgresql://... ADMIN_API_KEY=... python bench_tai.py --devices 500 --duration 60
+#   python bench_tai.py --devices 2000 --interval 5 --map-clients 50 --json ket_qua.json --cleanup
+# Các bước:
+#   1. Seed N thiết bị ảo (BENCH-00001...) thẳng vào CSDL, dùng chung MỘT bcrypt hash (băm N lần rất chậm).
+#      --seed-points M: thêm M điểm dịch vụ quanh TP.HCM qua POST /admin/diem-dich-vu/import (máy chủ nạp lại chỉ mục).
+#   2. Mỗi thiết bị gửi heartbeat mỗi --interval giây (lệch pha ngẫu nhiên), di chuyển dần; một phần là
+#      nhiên liệu thấp / có mã lỗi (DTC) để kích hoạt cảnh báo. Sau mỗi heartbeat, với xác suất --read-share,
+#      thiết bị đọc cảnh báo hoặc vị trí cuối của mình.
+#   3. --map-clients client bản đồ gọi liên tục /cac-diem-xung-quanh và /tim-diem-gan-nhat.
+#   4. Báo cáo thông lượng và độ trễ p50/p95/p99 theo từng endpoint (bỏ qua --warmup giây đầu).
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+from passlib.context import CryptContext
+
+try:
+    import httpx
+except ImportError:
+    sys.exit("Cần httpx cho bộ tạo tải: pip install httpx")
+
+# Vùng mô phỏng: nội thành TP.HCM
+LAT_MIN, LAT_MAX, LON_MIN, LON_MAX = 10.70, 10.88, 106.60, 106.80
+API_KEY_BENCH = "bench_secret_key"
+
+
+class ThongKe:
+    """Độ trễ (giây) và số lỗi theo tên endpoint; chỉ ghi nhận sau thời điểm `bat_dau_do`."""
+
+    def __init__(self, bat_dau_do: float):
+        self.bat_dau_do = bat_dau_do
+        self.do_tre: dict = {}
+        self.loi: dict = {}
+        self.ma_loi: dict = {}
+
+    def ghi(self, ten: str, bat_dau: float, ma: int) -> None:
+        if bat_dau < self.bat_dau_do: return
+        self.do_tre.setdefault(ten, []).append(time.perf_counter() - bat_dau)
+        if ma >= 400 or ma == 0:
+            self.loi[ten] = self.loi.get(ten, 0) + 1
+            self.ma_loi.setdefault(ten, {}).setdefault(ma, 0)
+            self.ma_loi[ten][ma] += 1
+
+
+def phan_vi(mau: list, p: float) -> float:
+    """Phân vị kiểu nearest-rank trên danh sách ĐÃ sắp xếp."""
+    if not mau: return float("nan")
+    return mau[min(len(mau) - 1, max(0, int(round(p / 100 * len(mau) + 0.5)) - 1))]
+
+
+def seed_thiet_bi(database_url: str, so_thiet_bi: int, tien_to: str) -> list:
+    cac_id = [f"{tien_to}{i:05d}" for i in range(1, so_thiet_bi + 1)]
+    api_key_hash = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(API_KEY_BENCH)
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        conn.execute(text("""
+        INSERT INTO devices (id, api_key_hash, vehicle_make, vehicle_model) VALUES (:id, :hash, 'Bench', 'Virtual')
+        ON CONFLICT (id) DO UPDATE SET api_key_hash = EXCLUDED.api_key_hash
+        """), [{"id": device_id, "hash": api_key_hash} for device_id in cac_id])
+    engine.dispose()
+    return cac_id
+
+
+def don_dep(database_url: str, tien_to: str) -> None:
+    """Xoá thiết bị ảo và mọi dữ liệu của chúng (điểm dịch vụ BENCH-P... được giữ lại)."""
+    engine = create_engine(database_url)
+    mau = tien_to.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    with engine.begin() as conn:
+        for bang, cot in (("alert_jobs", "device_id"), ("user_alerts", "device_id"), ("obd_logs", "device_id"),
+                          ("device_locations", "device_id"), ("devices", "id")):
+            so_dong = conn.execute(text(f"DELETE FROM {bang} WHERE {cot} LIKE :mau ESCAPE '\\'"), {"mau": mau}).rowcount
+            print(f"  Đã xoá {so_dong} dòng trong {bang}")
+    engine.dispose()
+
+
+async def seed_diem(client: httpx.AsyncClient, admin_key: str, so_diem: int) -> None:
+    rng = random.Random(42)
+    dong = [json.dumps({"id": f"BENCH-P{i:06d}", "ten": f"Điểm bench {i}", "loai": rng.choice(["xang_dau", "tram_sac", "sua_chua"]),
+                        "vi_do": rng.uniform(LAT_MIN, LAT_MAX), "kinh_do": rng.uniform(LON_MIN, LON_MAX)}, ensure_ascii=False)
+            for i in range(so_diem)]
+    r = await client.post("/admin/diem-dich-vu/import", params={"format": "ndjson"}, content="\n".join(dong).encode("utf-8"),
+                          headers={"X-Admin-Api-Key": admin_key, "Content-Type": "application/x-ndjson"}, timeout=600)
+    r.raise_for_status()
+    print(f"  Điểm dịch vụ: {r.json()}")
+
+
+async def goi(client: httpx.AsyncClient, thong_ke: ThongKe, ten: str, method: str, url: str, **kwargs) -> None:
+    bat_dau = time.perf_counter()
+    try: ma = (await client.request(method, url, **kwargs)).status_code
+    except httpx.HTTPError: ma = 0  # Lỗi kết nối/hết thời gian chờ
+    thong_ke.ghi(ten, bat_dau, ma)
+
+
+async def thiet_bi_ao(client: httpx.AsyncClient, thong_ke: ThongKe, device_id: str, args, het_gio: float, rng: random.Random) -> None:
+    headers = {"X-Device-ID": device_id, "X-API-Key": API_KEY_BENCH}
+    lat, lon = rng.uniform(LAT_MIN, LAT_MAX), rng.uniform(LON_MIN, LON_MAX)
+    fuel = rng.uniform(30, 100)
+    # Lệch pha để N thiết bị không gửi cùng một lúc
+    tiep_theo = time.perf_counter() + rng.uniform(0, args.interval)
+    while tiep_theo < het_gio:
+        await asyncio.sleep(max(0.0, tiep_theo - time.perf_counter()))
+        tiep_theo += args.interval
+        lat = min(LAT_MAX, max(LAT_MIN, lat + rng.gauss(0, 0.0005)))
+        lon = min(LON_MAX, max(LON_MIN, lon + rng.gauss(0, 0.0005)))
+        fuel = max(0.0, fuel - rng.uniform(0, 0.05))
+        xang_thap = rng.random() < args.low_fuel_share
+        payload = {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "location": {"lat": lat, "lon": lon},
+            "obd_data": {"fuel_level": round(rng.uniform(2, 19), 1) if xang_thap else round(fuel, 1), "engine_status": "ON",
+                         "rpm": rng.randint(700, 3500), "speed": rng.randint(0, 80),
+                         "error_codes": [rng.choice(["P0420", "P0300", "P0171", "P0128"])] if rng.random() < args.dtc_share else []},
+        }
+        await goi(client, thong_ke, "POST /device/heartbeat", "POST", "/device/heartbeat", json=payload, headers=headers)
+        if rng.random() < args.read_share:
+            if rng.random() < 0.5: await goi(client, thong_ke, "GET /device/alerts", "GET", "/device/alerts", headers=headers)
+            else: await goi(client, thong_ke, "GET /device/location/last", "GET", "/device/location/last", headers=headers)
+
+
+async def client_ban_do(client: httpx.AsyncClient, thong_ke: ThongKe, args, het_gio: float, rng: random.Random) -> None:
+    while time.perf_counter() < het_gio:
+        params = {"vi_do": rng.uniform(LAT_MIN, LAT_MAX), "kinh_do": rng.uniform(LON_MIN, LON_MAX)}
+        if rng.random() < 0.7:
+            params.update(ban_kinh_km=rng.choice([1, 2, 5]), **({"loai_diem": rng.choice(["xang_dau", "tram_sac"])} if rng.random() < 0.5 else {}))
+            await goi(client, thong_ke, "GET /cac-diem-xung-quanh", "GET", "/cac-diem-xung-quanh", params=params)
+        else:
+            params["loai_diem"] = rng.choice(["xang_dau", "tram_sac", "sua_chua"])
+            await goi(client, thong_ke, "GET /tim-diem-gan-nhat", "GET", "/tim-diem-gan-nhat", params=params)
+        await asyncio.sleep(args.map_think)
+
+
+def bao_cao(thong_ke: ThongKe, thoi_gian_do: float) -> dict:
+    ket_qua = {}
+    print(f"\n{'Endpoint':<30}{'Số req':>9}{'Lỗi':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for ten in sorted(thong_ke.do_tre):
+        mau = sorted(thong_ke.do_tre[ten])
+        dong = {"count": len(mau), "errors": thong_ke.loi.get(ten, 0), "error_codes": thong_ke.ma_loi.get(ten, {}),
+                "rps": len(mau) / thoi_gian_do, **{f"p{p}_ms": phan_vi(mau, p) * 1000 for p in (50, 95, 99)}, "max_ms": mau[-1] * 1000}
+        ket_qua[ten] = dong
+        print(f"{ten:<30}{dong['count']:>9}{dong['errors']:>7}{dong['rps']:>9.1f}{dong['p50_ms']:>9.1f}{dong['p95_ms']:>9.1f}{dong['p99_ms']:>9.1f}{dong['max_ms']:>9.1f}")
+    tong = sum(d["count"] for d in ket_qua.values())
+    print(f"{'TỔNG':<30}{tong:>9}{sum(d['errors'] for d in ket_qua.values()):>7}{tong / thoi_gian_do:>9.1f}")
+    for ten, cac_ma in thong_ke.ma_loi.items(): print(f"  Mã lỗi {ten}: {cac_ma} (0 = lỗi kết nối/timeout)")
+    return ket_qua
+
+
+async def chay(args) -> dict:
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.api_url.rstrip("/"), limits=limits, timeout=args.timeout) as client:
+        if args.seed_points:
+            if not args.admin_key: sys.exit("--seed-points cần admin key (--admin-key hoặc ADMIN_API_KEY).")
+            await seed_diem(client, args.admin_key, args.seed_points)
+        cac_id = seed_thiet_bi(args.database_url, args.devices, args.prefix)
+        print(f"  Đã seed {len(cac_id)} thiết bị ảo ({cac_id[0]} ... {cac_id[-1]})")
+        rng = random.Random(args.seed)
+        bat_dau = time.perf_counter()
+        thong_ke = ThongKe(bat_dau + args.warmup)
+        het_gio = bat_dau + args.warmup + args.duration
+        print(f"Đang chạy: {args.devices} thiết bị (mỗi {args.interval}s), {args.map_clients} client bản đồ, "
+              f"{args.warmup}s khởi động + {args.duration}s đo...")
+        tac_vu = [thiet_bi_ao(client, thong_ke, device_id, args, het_gio, random.Random(rng.random())) for device_id in cac_id]
+        tac_vu += [client_ban_do(client, thong_ke, args, het_gio, random.Random(rng.random())) for _ in range(args.map_clients)]
+        await asyncio.gather(*tac_vu)
+        # Thời gian đo thực tế: request cuối có thể kết thúc sau het_gio
+        ket_qua = bao_cao(thong_ke, max(args.duration, time.perf_counter() - thong_ke.bat_dau_do))
+        try:
+            r = await client.get("/admin/ingest/stats", headers={"X-Admin-Api-Key": args.admin_key or ""})
+            if r.status_code == 200: print(f"\nBộ đệm ingest phía máy chủ: {r.json()}")
+        except httpx.HTTPError: pass
+    return ket_qua
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bộ tạo tải hạm đội cho BOLT Network API.")
+    parser.add_argument("--api-url", default=os.environ.get("API_BASE_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--admin-key", default=os.environ.get("ADMIN_API_KEY"))
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"), help="CSDL của máy chủ, để seed thiết bị ảo")
+    parser.add_argument("--devices", type=int, default=200, help="Số thiết bị ảo")
+    parser.add_argument("--interval", type=float, default=1.0, help="Giây giữa hai heartbeat của một thiết bị")
+    parser.add_argument("--low-fuel-share", type=float, default=0.05, help="Tỉ lệ heartbeat nhiên liệu thấp")
+    parser.add_argument("--dtc-share", type=float, default=0.02, help="Tỉ lệ heartbeat có mã lỗi động cơ")
+    parser.add_argument("--read-share", type=float, default=0.3, help="Xác suất thiết bị đọc cảnh báo/vị trí sau mỗi heartbeat")
+    parser.add_argument("--map-clients", type=int, default=10, help="Số client bản đồ gọi tìm kiếm điểm dịch vụ liên tục")
+    parser.add_argument("--map-think", type=float, default=0.1, help="Giây nghỉ giữa hai lần tìm của một client bản đồ")
+    parser.add_argument("--seed-points", type=int, default=0, help="Thêm số điểm dịch vụ ngẫu nhiên trước khi chạy")
+    parser.add_argument("--duration", type=float, default=30.0, help="Giây đo")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Giây khởi động (không tính vào kết quả)")
+    parser.add_argument("--connections", type=int, default=200, help="Số kết nối HTTP đồng thời tối đa")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--prefix", default="BENCH-", help="Tiền tố id thiết bị ảo")
+    parser.add_argument("--seed", type=int, default=1, help="Hạt giống ngẫu nhiên (tải lặp lại được)")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--cleanup", action="store_true", help="Xoá thiết bị ảo và dữ liệu của chúng sau khi chạy")
+    args = parser.parse_args()
+    if not args.database_url: sys.exit("Thiếu --database-url (hoặc biến môi trường DATABASE_URL) để seed thiết bị ảo.")
+
+    try:
+        ket_qua = asyncio.run(chay(args))
+    except httpx.ConnectError:
+        sys.exit("--- LỖI KẾT NỐI --- Không thể kết nối tới API. Hãy đảm bảo máy chủ 'uvicorn' đang chạy.")
+    finally:
+        if args.cleanup:
+            print("\nĐang dọn dữ liệu bench...")
+            don_dep(args.database_url, args.prefix)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k not in ("admin_key", "database_url")}, "endpoints": ket_qua}, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi kết quả vào {args.json}")
+
+
+if __name__ == "__main__":
+    main()
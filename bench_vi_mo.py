@@ -0,0 +1,195 @@
+# === bench_vi_mo.py (Micro-benchmark các hot path, chạy app trong tiến trình + kiểm tra hồi quy độ trễ) ===
+# Cần CSDL (DATABASE_URL) như khi chạy máy chủ; KHÔNG cần uvicorn: app chạy qua ASGI trong cùng tiến trình.
+# DATABASE_URL=sqlite:// chạy khép kín với SQLite trong bộ nhớ (baseline ghi kèm loại CSDL, không so chéo Postgres/SQLite).
+#   python bench_vi_mo.py                  # Đo và so với bench_baseline.json, thoát mã 1 nếu có ca chậm hơn ngưỡng
+#   python bench_vi_mo.py --luu            # Đo và ghi (cập nhật) baseline
+#   python bench_vi_mo.py --chi auth,diem  # Chỉ chạy các ca có tên bắt đầu bằng các tiền tố này
+# Mỗi ca chạy VONG vòng x N lần gọi; thời gian một lần gọi = TRUNG VỊ của các vòng (ít nhiễu hơn trung bình).
+# Baseline phụ thuộc máy: ghi lại bằng --luu sau khi đổi máy/CSDL, so sánh chỉ có nghĩa trên cùng một máy.
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")  # Log INFO lúc khởi động không lẫn vào bảng kết quả
+
+import httpx
+
+import main
+import logic_bolt
+from bench_json import tao_canh_bao
+from json_bolt import tra_json
+
+VONG = 5
+FILE_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+# Ngưỡng mặc định: ca thuần CPU ổn định hơn ca có truy vấn CSDL/bcrypt
+NGUONG_CPU, NGUONG_CSDL = 0.25, 0.50
+API_KEY_TEST = "bolt_secret_key_for_testing"
+# Điểm đo: trung tâm Quận 1, gần các điểm dịch vụ mẫu
+VI_DO, KINH_DO = 10.7798, 106.7020
+
+
+class CaDo:
+    def __init__(self, ten: str, ham, so_lan: int, nguong: float, mo_ta: str):
+        self.ten = ten
+        self.ham = ham
+        self.so_lan = so_lan
+        self.nguong = nguong
+        self.mo_ta = mo_ta
+
+
+async def do_ca(ca: CaDo, he_so: float) -> float:
+    """Thời gian (micro giây) một lần gọi: trung vị của VONG vòng, sau một vòng làm nóng ngắn."""
+    so_lan = max(1, int(ca.so_lan * he_so))
+    la_async = asyncio.iscoroutinefunction(ca.ham)
+
+    async def mot_vong(n: int) -> float:
+        bat_dau = time.perf_counter()
+        if la_async:
+            for _ in range(n): await ca.ham()
+        else:
+            for _ in range(n): ca.ham()
+        return (time.perf_counter() - bat_dau) / n
+
+    await mot_vong(max(1, so_lan // 10))
+    return statistics.median([await mot_vong(so_lan) for _ in range(VONG)]) * 1e6
+
+
+def tao_cac_ca(client: httpx.AsyncClient, db_async, db: "main.Session") -> list:
+    headers = {"X-Device-ID": main.TEST_DEVICE_ID, "X-API-Key": API_KEY_TEST}
+    rng = random.Random(7)
+    diem_1k = [{"id": f"P{i}", "ten": f"Điểm {i}", "loai": rng.choice(["xang_dau", "tram_sac", "sua_chua"]),
+                "vi_do": rng.uniform(10.70, 10.88), "kinh_do": rng.uniform(106.60, 106.80)} for i in range(1000)]
+    canh_bao_1k = tao_canh_bao(1000)
+    payload = main.DeviceHeartbeatModel(**{
+        "timestamp": datetime.datetime(2025, 1, 1, 8, 0, 0).isoformat(), "location": {"lat": VI_DO, "lon": KINH_DO},
+        "obd_data": {"fuel_level": 8.0, "rpm": 900, "speed": 10, "error_codes": ["P0420", "P0300"]}})
+
+    async def auth_cache():
+        await main.get_current_device(main.TEST_DEVICE_ID, API_KEY_TEST, db_async)
+
+    async def auth_bcrypt():
+        main.invalidate_device_credentials(main.TEST_DEVICE_ID)
+        await main.get_current_device(main.TEST_DEVICE_ID, API_KEY_TEST, db_async)
+
+    def gan_nhat_sql():
+        # Tắt chỉ mục tạm thời để đo đường truy vấn dự phòng (hộp mở rộng + HAVERSINE_SQL)
+        main.diem_dich_vu_index.ready = False
+        try: main._tim_diem_gan_nhat_logic(db, VI_DO, KINH_DO, "xang_dau")
+        finally:
+            main.diem_dich_vu_index.ready = True
+            # Không giữ transaction đọc giữa các lần gọi (SQLite: khoá đọc chặn các ca ghi)
+            db.rollback()
+
+    def trigger():
+        # Đường cảnh báo MỚI (chưa bị chặn lặp); rollback để CSDL không đổi giữa các lần gọi
+        main.alert_suppression.invalidate_where(lambda khoa: khoa[0] == main.TEST_DEVICE_ID)
+        try: main._trigger_proactive_alerts(db, main.TEST_DEVICE_ID, payload)
+        finally: db.rollback()
+
+    async def asgi_canh_bao():
+        (await client.get("/device/alerts", headers=headers)).raise_for_status()
+
+    async def asgi_gan_nhat():
+        (await client.get("/tim-diem-gan-nhat", params={"vi_do": VI_DO, "kinh_do": KINH_DO, "loai_diem": "xang_dau"})).raise_for_status()
+
+    return [
+        CaDo("logic.tinh_khoang_cach", lambda: logic_bolt.tinh_khoang_cach(VI_DO, KINH_DO, 10.7714, 106.6682), 20000, NGUONG_CPU,
+             "Haversine một cặp điểm"),
+        CaDo("logic.tim_diem_gan_nhat_1k", lambda: logic_bolt.tim_diem_gan_nhat(VI_DO, KINH_DO, diem_1k, "xang_dau"), 200, NGUONG_CPU,
+             "Quét tuyến tính 1000 điểm"),
+        CaDo("auth.get_current_device_cache", auth_cache, 5000, NGUONG_CPU, "Xác thực thiết bị, trúng cache"),
+        CaDo("auth.get_current_device_bcrypt", auth_bcrypt, 10, NGUONG_CSDL, "Xác thực thiết bị, trượt cache (CSDL + bcrypt)"),
+        CaDo("diem.gan_nhat_chi_muc", lambda: main._tim_diem_gan_nhat_logic(db, VI_DO, KINH_DO, "xang_dau"), 2000, NGUONG_CPU,
+             "_tim_diem_gan_nhat_logic qua chỉ mục không gian"),
+        CaDo("diem.gan_nhat_sql", gan_nhat_sql, 200, NGUONG_CSDL, "_tim_diem_gan_nhat_logic qua SQL"),
+        CaDo("canh_bao.trigger", trigger, 100, NGUONG_CSDL, "_trigger_proactive_alerts: nhiên liệu thấp + 2 mã lỗi"),
+        CaDo("json.canh_bao_1k", lambda: tra_json(canh_bao_1k), 100, NGUONG_CPU, "Serialize 1000 cảnh báo (tra_json)"),
+        CaDo("asgi.get_device_alerts", asgi_canh_bao, 200, NGUONG_CSDL, "GET /device/alerts qua ASGI"),
+        CaDo("asgi.tim_diem_gan_nhat", asgi_gan_nhat, 500, NGUONG_CPU, "GET /tim-diem-gan-nhat qua ASGI"),
+    ]
+
+
+def doc_baseline() -> dict:
+    if not os.path.exists(FILE_BASELINE): return {}
+    with open(FILE_BASELINE, encoding="utf-8") as f: return json.load(f)
+
+
+def ghi_baseline(cu: dict, ket_qua: dict, cac_ca: list) -> None:
+    ca_theo_ten = {ca.ten: ca for ca in cac_ca}
+    moi = {**cu.get("cac_ca", {}), **{ten: {"us": round(us, 3), "nguong": ca_theo_ten[ten].nguong} for ten, us in ket_qua.items()}}
+    noi_dung = {
+        "may": {"python": platform.python_version(), "he_dieu_hanh": platform.platform(), "cpu": os.cpu_count(), "csdl": main.engine.dialect.name},
+        "cap_nhat": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "cac_ca": dict(sorted(moi.items())),
+    }
+    with open(FILE_BASELINE, "w", encoding="utf-8") as f:
+        json.dump(noi_dung, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+async def chay(args) -> int:
+    cac_tien_to = [x for x in (args.chi or "").split(",") if x]
+    async with main.app.router.lifespan_context(main.app):
+        if not main.diem_dich_vu_index.ready: sys.exit("Chỉ mục không gian chưa nạp được: kiểm tra DATABASE_URL/CSDL.")
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client, main.AsyncSessionLocal() as db_async:
+            with main.SessionLocal() as db:
+                cac_ca = [ca for ca in tao_cac_ca(client, db_async, db) if not cac_tien_to or ca.ten.startswith(tuple(cac_tien_to))]
+                ket_qua = {}
+                for ca in cac_ca:
+                    ket_qua[ca.ten] = await do_ca(ca, args.he_so)
+                    print(f"  {ca.ten:<34}{ket_qua[ca.ten]:>12.1f} µs   {ca.mo_ta}", flush=True)
+
+    baseline = doc_baseline()
+    if args.luu:
+        ghi_baseline(baseline, ket_qua, cac_ca)
+        print(f"\nĐã ghi baseline {len(ket_qua)} ca vào {FILE_BASELINE}")
+        return 0
+    if not baseline:
+        print(f"\nChưa có baseline ({FILE_BASELINE}): chạy lại với --luu để tạo.")
+        return 0
+    may = baseline.get("may", {})
+    if may.get("csdl", "postgresql") != main.engine.dialect.name:
+        print(f"\nBaseline được đo với {may.get('csdl', 'postgresql')}, đang chạy với {main.engine.dialect.name}: bỏ qua so sánh (dùng --luu để ghi baseline riêng).")
+        return 0
+    if may.get("cpu") != os.cpu_count() or may.get("python") != platform.python_version():
+        print(f"\nCẢNH BÁO: baseline được đo trên máy khác ({may}), so sánh có thể không chính xác.")
+
+    print(f"\n{'Ca đo':<34}{'Baseline µs':>13}{'Hiện tại µs':>13}{'Tỉ lệ':>8}{'Ngưỡng':>8}  Kết quả")
+    so_hoi_quy = 0
+    for ca in cac_ca:
+        goc = baseline.get("cac_ca", {}).get(ca.ten)
+        if not goc:
+            print(f"{ca.ten:<34}{'-':>13}{ket_qua[ca.ten]:>13.1f}{'-':>8}{'-':>8}  chưa có baseline")
+            continue
+        nguong = args.nguong if args.nguong is not None else goc.get("nguong", ca.nguong)
+        ti_le = ket_qua[ca.ten] / goc["us"]
+        hoi_quy = ti_le > 1 + nguong
+        so_hoi_quy += hoi_quy
+        print(f"{ca.ten:<34}{goc['us']:>13.1f}{ket_qua[ca.ten]:>13.1f}{ti_le:>7.2f}x{'+' + format(nguong, '.0%'):>8}  "
+              f"{'CHẬM HƠN NGƯỠNG' if hoi_quy else ('nhanh hơn' if ti_le < 1 / (1 + nguong) else 'ok')}")
+    if so_hoi_quy:
+        print(f"\n{so_hoi_quy} ca hồi quy vượt ngưỡng.")
+        return 1
+    print("\nKhông có hồi quy.")
+    return 0
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Micro-benchmark các hot path của BOLT Network API (ASGI trong tiến trình).")
+    parser.add_argument("--luu", action="store_true", help="Ghi kết quả làm baseline (chỉ cập nhật các ca đã chạy)")
+    parser.add_argument("--chi", help="Chỉ chạy các ca có tên bắt đầu bằng các tiền tố này, phân cách bằng dấu phẩy")
+    parser.add_argument("--nguong", type=float, help="Ngưỡng hồi quy cho MỌI ca (VD: 0.2 = chậm hơn 20%%), thay ngưỡng riêng từng ca")
+    parser.add_argument("--he-so", type=float, default=1.0, help="Nhân số lần gọi mỗi vòng (nhỏ hơn = chạy nhanh hơn, nhiễu hơn)")
+    sys.exit(asyncio.run(chay(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,100 @@
+# === cache_bolt.py (Bộ nhớ đệm dùng chung cho BOLT Network API) ===
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bộ nhớ đệm LRU có giới hạn kích thước và thời gian sống (TTL) cho mỗi mục.
+    An toàn luồng vì các endpoint `def` của FastAPI chạy trong threadpool.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max(1, int(max_size))
+        self.ttl_seconds = float(ttl_seconds)
+        self._data: "OrderedDict[object, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= now:
+                # Hết hạn: xoá luôn để không chiếm chỗ của mục còn hiệu lực
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate) -> int:
+        """Xoá mọi mục có key thoả `predicate(key)`. Trả về số mục đã xoá."""
+        with self._lock:
+            stale = [key for key in self._data if predicate(key)]
+            for key in stale:
+                del self._data[key]
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class VersionedTTLCache(TTLCache):
+    """
+    TTLCache gắn với phiên bản của dữ liệu nguồn: người gọi đọc `version` TRƯỚC khi tính kết quả
+    và đưa nó vào key. bump() sau mỗi lần ghi dữ liệu nguồn xoá cache và tăng phiên bản, nên cả
+    kết quả do request đang chạy dở ghi vào (tính từ dữ liệu cũ) cũng không bao giờ được đọc lại.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        super().__init__(max_size, ttl_seconds)
+        self.version = 0
+        self.invalidations = 0
+
+    def bump(self) -> int:
+        with self._lock:
+            self.version += 1
+            self.invalidations += 1
+            self._data.clear()
+            return self.version
+
+    def stats(self) -> dict:
+        ket_qua = super().stats()
+        ket_qua.update(version=self.version, invalidations=self.invalidations)
+        return ket_qua
@@ -0,0 +1,129 @@
+# === export_bolt.py (Ghi luồng NDJSON / CSV / Parquet theo từng khúc dòng, không giữ cả kết quả trong bộ nhớ) ===
+# Parquet cần pyarrow (tuỳ chọn, không có trong requirements.txt vì nặng cho gateway): pip install pyarrow
+import csv
+import datetime
+import io
+import zlib
+from typing import AsyncIterator, List, Sequence, Tuple
+
+import json_bolt
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Không có pyarrow: NDJSON/CSV vẫn dùng được
+    pyarrow = None
+
+DINH_DANG_HOP_LE = ("ndjson", "csv", "parquet")
+NEN_HOP_LE = ("none", "gzip")
+
+MEDIA_TYPE = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+# Kiểu cột (cac_cot = [(tên, kiểu), ...]) -> kiểu Arrow cho Parquet
+_KIEU_ARROW = {
+    "string": lambda: pyarrow.string(), "timestamp": lambda: pyarrow.timestamp("us"),
+    "float": lambda: pyarrow.float64(), "int": lambda: pyarrow.int64(),
+}
+
+
+def ho_tro(dinh_dang: str) -> bool:
+    return dinh_dang in DINH_DANG_HOP_LE and (dinh_dang != "parquet" or pyarrow is not None)
+
+
+def ten_file(goc: str, dinh_dang: str, nen: str) -> str:
+    # Parquet tự nén theo cột bên trong file, không bọc gzip bên ngoài
+    return f"{goc}.{dinh_dang}" + (".gz" if nen == "gzip" and dinh_dang != "parquet" else "")
+
+
+async def _ndjson(cac_cot: Sequence[Tuple[str, str]], khuc_dong: AsyncIterator[List[tuple]]) -> AsyncIterator[bytes]:
+    ten = [c for c, _ in cac_cot]
+    async for dong in khuc_dong:
+        yield b"".join(json_bolt.dumps(dict(zip(ten, d))) + b"\n" for d in dong)
+
+
+def _o_csv(gia_tri):
+    # Cùng định dạng thời điểm với NDJSON (ISO 8601), None -> ô rỗng
+    return gia_tri.isoformat() if isinstance(gia_tri, datetime.datetime) else gia_tri
+
+
+async def _csv(cac_cot: Sequence[Tuple[str, str]], khuc_dong: AsyncIterator[List[tuple]]) -> AsyncIterator[bytes]:
+    bo_dem = io.StringIO()
+    viet = csv.writer(bo_dem, lineterminator="\n")
+    viet.writerow([c for c, _ in cac_cot])
+    async for dong in khuc_dong:
+        viet.writerows([_o_csv(x) for x in d] for d in dong)
+        yield bo_dem.getvalue().encode("utf-8")
+        bo_dem.seek(0)
+        bo_dem.truncate()
+    if bo_dem.tell(): yield bo_dem.getvalue().encode("utf-8")
+
+
+class _DauGhi:
+    """File-like chỉ ghi cho ParquetWriter: giữ phần byte mới ghi cho tới khi được lấy ra."""
+
+    def __init__(self):
+        self._phan: List[bytes] = []
+        self._vi_tri = 0
+        self.closed = False
+
+    def write(self, du_lieu) -> int:
+        du_lieu = bytes(du_lieu)
+        self._phan.append(du_lieu)
+        self._vi_tri += len(du_lieu)
+        return len(du_lieu)
+
+    def tell(self) -> int: return self._vi_tri
+    def flush(self) -> None: pass
+    def close(self) -> None: self.closed = True
+    def writable(self) -> bool: return True
+
+    def lay_ra(self) -> bytes:
+        du_lieu, self._phan = b"".join(self._phan), []
+        return du_lieu
+
+
+async def _parquet(cac_cot: Sequence[Tuple[str, str]], khuc_dong: AsyncIterator[List[tuple]], nen: str, so_dong_moi_nhom: int) -> AsyncIterator[bytes]:
+    """
+    Mỗi row group được ghi ra ngay khi đủ `so_dong_moi_nhom` dòng: bộ nhớ giữ tối đa một row group.
+    Phần chân (metadata) của file nằm ở cuối, được ghi khi luồng kết thúc.
+    """
+    schema = pyarrow.schema([(ten, _KIEU_ARROW[kieu]()) for ten, kieu in cac_cot])
+    dau_ghi = _DauGhi()
+    ghi = pyarrow.parquet.ParquetWriter(dau_ghi, schema, compression="gzip" if nen == "gzip" else "snappy")
+    cho_ghi: List[tuple] = []
+
+    def ghi_nhom():
+        cot = list(zip(*cho_ghi))
+        ghi.write_table(pyarrow.Table.from_arrays([pyarrow.array(cot[i], type=schema.field(i).type) for i in range(len(cac_cot))], schema=schema))
+        cho_ghi.clear()
+
+    try:
+        async for dong in khuc_dong:
+            cho_ghi.extend(dong)
+            if len(cho_ghi) >= so_dong_moi_nhom:
+                ghi_nhom()
+                yield dau_ghi.lay_ra()
+        if cho_ghi: ghi_nhom()
+    finally:
+        ghi.close()
+    yield dau_ghi.lay_ra()
+
+
+async def _gzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    nen = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: định dạng gzip
+    async for chunk in chunks:
+        if du_lieu := nen.compress(chunk): yield du_lieu
+    yield nen.flush()
+
+
+def ghi_luong(dinh_dang: str, nen: str, cac_cot: Sequence[Tuple[str, str]], khuc_dong: AsyncIterator[List[tuple]],
+              so_dong_moi_nhom: int = 50000) -> AsyncIterator[bytes]:
+    """
+    Mã hoá luồng các khúc dòng (mỗi khúc là list tuple theo thứ tự `cac_cot`) thành luồng byte.
+    `nen="gzip"` nén cả luồng NDJSON/CSV; với Parquet là codec nén các cột bên trong file.
+    """
+    if not ho_tro(dinh_dang): raise ValueError(f"Định dạng không hỗ trợ: {dinh_dang}")
+    if nen not in NEN_HOP_LE: raise ValueError(f"Kiểu nén không hỗ trợ: {nen}")
+    if dinh_dang == "parquet": return _parquet(cac_cot, khuc_dong, nen, so_dong_moi_nhom)
+    chunks = _ndjson(cac_cot, khuc_dong) if dinh_dang == "ndjson" else _csv(cac_cot, khuc_dong)
+    return _gzip(chunks) if nen == "gzip" else chunks
@@ -0,0 +1,64 @@
+# === export_obd_logs.py (CLI xuất obd_logs qua GET /admin/obd/export) ===
+# Cách dùng:
+#   ADMIN_API_KEY=... python export_obd_logs.py --start 2025-01-01 --end 2025-01-15 --device-id BOLT-TEST-001
+#   python export_obd_logs.py --start 2025-01-01 --format parquet -o fleet.parquet --api-url https://bolt-api.example.com
+# Dữ liệu được ghi thẳng xuống file theo từng khúc khi tải về (không giữ cả file trong bộ nhớ).
+import argparse
+import os
+import re
+import sys
+
+import requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xuất obd_logs (NDJSON, CSV hoặc Parquet) từ BOLT Network API.")
+    parser.add_argument("--start", required=True, help="Từ thời điểm (ISO 8601, gồm), VD: 2025-01-01 hoặc 2025-01-01T08:00:00")
+    parser.add_argument("--end", help="Tới thời điểm (không gồm); bỏ trống = tới hiện tại")
+    parser.add_argument("--device-id", help="Bỏ trống = cả hạm đội")
+    parser.add_argument("--format", choices=["ndjson", "csv", "parquet"], default="ndjson")
+    parser.add_argument("--compression", choices=["none", "gzip"], default="none")
+    parser.add_argument("-o", "--output", help="Mặc định: tên file máy chủ đề xuất; '-' = stdout")
+    parser.add_argument("--api-url", default=os.environ.get("API_BASE_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--admin-key", default=os.environ.get("ADMIN_API_KEY"))
+    args = parser.parse_args()
+
+    if not args.admin_key:
+        sys.exit("Thiếu admin key: truyền --admin-key hoặc đặt biến môi trường ADMIN_API_KEY.")
+    url = f"{args.api_url.rstrip('/')}/admin/obd/export"
+    params = {"start": args.start, "format": args.format, "compression": args.compression}
+    if args.end: params["end"] = args.end
+    if args.device_id: params["device_id"] = args.device_id
+
+    try:
+        # Đọc timeout áp dụng cho từng lần nhận dữ liệu, không phải cả lần tải
+        response = requests.get(url, params=params, headers={"X-Admin-Api-Key": args.admin_key}, stream=True, timeout=(10, 300))
+    except requests.exceptions.ConnectionError:
+        sys.exit("--- LỖI KẾT NỐI --- Không thể kết nối tới API. Hãy đảm bảo máy chủ 'uvicorn' đang chạy.")
+    if response.status_code != 200:
+        print(f"--- XUẤT THẤT BẠI ({response.status_code}) ---", file=sys.stderr)
+        sys.exit(response.text)
+
+    ten_goi_y = re.search(r'filename="([^"]+)"', response.headers.get("content-disposition", ""))
+    dich = args.output or (ten_goi_y.group(1) if ten_goi_y else f"obd_logs.{args.format}")
+    print(f"Đang xuất obd_logs ({args.format}) từ {url} vào: {dich}", file=sys.stderr)
+    so_byte = 0
+    f = sys.stdout.buffer if dich == "-" else open(dich, "wb")
+    try:
+        # Máy chủ không đặt Content-Encoding cho gzip (file .gz là nội dung tải về) nên byte được ghi nguyên vẹn
+        for chunk in response.iter_content(1 << 16):
+            f.write(chunk)
+            so_byte += len(chunk)
+    except requests.exceptions.RequestException as e:
+        # Luồng bị ngắt giữa chừng (VD: lỗi CSDL phía máy chủ): không để lại file dở dang
+        if dich != "-":
+            f.close()
+            os.remove(dich)
+        sys.exit(f"--- XUẤT THẤT BẠI --- Luồng dữ liệu bị ngắt giữa chừng: {e}")
+    finally:
+        if dich != "-": f.close()
+    print(f"--- XUẤT HOÀN TẤT --- {so_byte:,} byte", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# === import_bolt.py (Đọc luồng CSV / NDJSON theo từng bản ghi, không nạp cả file vào bộ nhớ) ===
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Optional, Tuple
+
+DINH_DANG_HOP_LE = ("csv", "ndjson")
+
+# Độ dài tối đa (ký tự) của một dòng, và của một bản ghi CSV nhiều dòng: file không có xuống dòng hoặc
+# thiếu dấu " đóng không làm bộ nhớ tăng theo kích thước file
+DO_DAI_TOI_DA = 64 * 1024
+
+
+async def _doc_dong(chunks: AsyncIterator[bytes], encoding: str = "utf-8-sig", toi_da: int = DO_DAI_TOI_DA) -> AsyncIterator[Optional[str]]:
+    """
+    Ghép các khúc byte thành từng dòng (giữ ký tự xuống dòng). utf-8-sig bỏ BOM của file xuất từ Excel.
+    Dòng dài quá `toi_da` ký tự sinh ra None; phần còn lại của dòng đó bị bỏ qua, không giữ trong bộ nhớ.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    du, bo_qua = "", False
+    async for chunk in chunks:
+        moi = decoder.decode(chunk)
+        dau = 0
+        # Chỉ tìm "\n" trong phần mới nhận: phần dư `du` đã được tìm ở khúc trước
+        while (cuoi := moi.find("\n", dau)) != -1:
+            if bo_qua: bo_qua = False
+            elif len(du) + cuoi + 1 - dau > toi_da: yield None
+            else: yield du + moi[dau:cuoi + 1]
+            du, dau = "", cuoi + 1
+        if bo_qua: continue
+        du += moi[dau:]
+        if len(du) > toi_da:
+            yield None
+            du, bo_qua = "", True
+    du += decoder.decode(b"", final=True)
+    if bo_qua: return
+    if len(du) > toi_da: yield None
+    elif du: yield du
+
+
+async def doc_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Sinh (số dòng, bản ghi, lỗi) cho từng bản ghi CSV; dòng đầu tiên là tiêu đề cột.
+    Ô rỗng thành None. Ô có dấu ngoặc kép có thể kéo dài qua nhiều dòng.
+    """
+    tieu_de = None
+    cac_dong, so_ngoac, dong_bat_dau, so_dong = [], 0, 0, 0
+    do_dai = 0
+    async for dong in _doc_dong(chunks):
+        so_dong += 1
+        if not cac_dong: dong_bat_dau = so_dong
+        if dong is None or do_dai + len(dong) > DO_DAI_TOI_DA:
+            # Bỏ cả bản ghi đang ghép; dòng sau bắt đầu bản ghi mới
+            loi = f"Dòng dài quá {DO_DAI_TOI_DA} ký tự" if dong is None and not cac_dong else f"Bản ghi dài quá {DO_DAI_TOI_DA} ký tự (thiếu dấu \" đóng?)"
+            yield dong_bat_dau, None, loi
+            cac_dong, so_ngoac, do_dai = [], 0, 0
+            continue
+        cac_dong.append(dong)
+        do_dai += len(dong)
+        # Số dấu " lẻ: đang ở giữa một ô có ngoặc, bản ghi còn tiếp ở dòng sau
+        so_ngoac += dong.count('"')
+        if so_ngoac % 2: continue
+        ban_ghi, cac_dong, so_ngoac, do_dai = "".join(cac_dong), [], 0, 0
+        if not ban_ghi.strip(): continue
+        try: o = next(csv.reader([ban_ghi]))
+        except csv.Error as e:
+            yield dong_bat_dau, None, f"CSV không hợp lệ: {e}"; continue
+        if tieu_de is None:
+            tieu_de = [cot.strip().lower() for cot in o]; continue
+        if len(o) != len(tieu_de):
+            yield dong_bat_dau, None, f"Có {len(o)} cột, tiêu đề có {len(tieu_de)} cột"; continue
+        yield dong_bat_dau, {cot: (gia_tri.strip() or None) for cot, gia_tri in zip(tieu_de, o)}, None
+    if cac_dong:
+        yield dong_bat_dau, None, "CSV không hợp lệ: thiếu dấu \" đóng"
+
+
+async def doc_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Sinh (số dòng, bản ghi, lỗi) cho từng dòng JSON (mỗi dòng một object)."""
+    so_dong = 0
+    async for dong in _doc_dong(chunks):
+        so_dong += 1
+        if dong is None:
+            yield so_dong, None, f"Dòng dài quá {DO_DAI_TOI_DA} ký tự"; continue
+        if not dong.strip(): continue
+        try: ban_ghi = json.loads(dong)
+        except ValueError as e:
+            yield so_dong, None, f"JSON không hợp lệ: {e}"; continue
+        if not isinstance(ban_ghi, dict):
+            yield so_dong, None, "Mỗi dòng phải là một JSON object"; continue
+        yield so_dong, ban_ghi, None
+
+
+def doc_ban_ghi(dinh_dang: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    if dinh_dang not in DINH_DANG_HOP_LE: raise ValueError(f"Định dạng không hỗ trợ: {dinh_dang}")
+    return doc_csv(chunks) if dinh_dang == "csv" else doc_ndjson(chunks)
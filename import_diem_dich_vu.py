@@ -0,0 +1,56 @@
+# === import_diem_dich_vu.py (CLI nhập hàng loạt điểm dịch vụ qua POST /admin/diem-dich-vu/import) ===
+# Cách dùng:
+#   ADMIN_API_KEY=... python import_diem_dich_vu.py tram_xang.csv
+#   python import_diem_dich_vu.py gara.ndjson --api-url https://bolt-api.example.com --admin-key ...
+# CSV cần dòng tiêu đề: id,ten,loai,dia_chi,vi_do,kinh_do
+import argparse
+import os
+import sys
+
+import requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nhập hàng loạt điểm dịch vụ (CSV hoặc NDJSON) vào BOLT Network API.")
+    parser.add_argument("file", help="Đường dẫn file .csv hoặc .ndjson/.jsonl")
+    parser.add_argument("--api-url", default=os.environ.get("API_BASE_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--admin-key", default=os.environ.get("ADMIN_API_KEY"))
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Mặc định đoán theo đuôi file")
+    args = parser.parse_args()
+
+    if not args.admin_key:
+        sys.exit("Thiếu admin key: truyền --admin-key hoặc đặt biến môi trường ADMIN_API_KEY.")
+    dinh_dang = args.format or ("ndjson" if args.file.lower().endswith((".ndjson", ".jsonl")) else "csv")
+    url = f"{args.api_url.rstrip('/')}/admin/diem-dich-vu/import"
+    headers = {
+        "X-Admin-Api-Key": args.admin_key,
+        "Content-Type": "text/csv; charset=utf-8" if dinh_dang == "csv" else "application/x-ndjson",
+    }
+
+    print(f"Đang gửi '{args.file}' ({dinh_dang}) tới: {url}")
+    try:
+        # Truyền file object: requests gửi theo luồng, không đọc cả file vào bộ nhớ
+        with open(args.file, "rb") as f:
+            response = requests.post(url, data=f, headers=headers, params={"format": dinh_dang}, timeout=(10, 600))
+    except requests.exceptions.ConnectionError:
+        sys.exit("--- LỖI KẾT NỐI --- Không thể kết nối tới API. Hãy đảm bảo máy chủ 'uvicorn' đang chạy.")
+
+    if response.status_code != 200:
+        print(f"--- NHẬP THẤT BẠI ({response.status_code}) ---")
+        sys.exit(response.text)
+
+    ket_qua = response.json()
+    print("--- NHẬP HOÀN TẤT ---")
+    print(f"Đã đọc: {ket_qua['received']} | Hợp lệ: {ket_qua['accepted']} | Lỗi: {ket_qua['rejected']}")
+    print(f"Thêm mới: {ket_qua['inserted']} | Cập nhật: {ket_qua['updated']} | Không đổi: {ket_qua['unchanged']}")
+    if ket_qua["errors"]:
+        print("\nCác dòng bị từ chối:")
+        for loi in ket_qua["errors"]:
+            print(f"  Dòng {loi['line']}: {loi['error']}")
+        if ket_qua["errors_truncated"]:
+            print("  ... (còn lỗi khác, chỉ hiển thị một phần)")
+    sys.exit(1 if ket_qua["rejected"] else 0)
+
+
+if __name__ == "__main__":
+    main()
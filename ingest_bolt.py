@@ -0,0 +1,191 @@
+# === ingest_bolt.py (Bộ đệm ghi trễ - write-behind - cho heartbeat) ===
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import exc
+
+logger = logging.getLogger(__name__)
+
+
+def la_loi_du_lieu(e: BaseException) -> bool:
+    """
+    Lỗi do chính dữ liệu của lô (ghi lại y nguyên vẫn lỗi): vi phạm ràng buộc, giá trị ngoài miền của cột,
+    tham số không chuyển được sang kiểu CSDL. Mọi lỗi khác (mất kết nối, CSDL ngừng, timeout, khoá) là tạm thời.
+    Xét cả chuỗi nguyên nhân: driver báo lỗi chuyển tham số theo nhiều cách (sqlite3: OverflowError trần;
+    asyncpg: asyncpg.DataError - một ValueError - nằm dưới DBAPIError chung của SQLAlchemy).
+    """
+    for _ in range(8):
+        if e is None: return False
+        if isinstance(e, exc.DBAPIError) and e.connection_invalidated: return False
+        if isinstance(e, (exc.DataError, exc.IntegrityError, ValueError, TypeError, OverflowError)): return True
+        e = e.orig if isinstance(e, exc.StatementError) else e.__cause__
+    return False
+
+
+class WriteBehindBuffer:
+    """
+    Gom các bản ghi trong bộ nhớ rồi ghi xuống CSDL theo lô, khi đủ `max_batch`
+    bản ghi hoặc sau `flush_interval` giây (tuỳ điều kiện nào đến trước).
+
+    Mọi thao tác chạy trên cùng một event loop nên không cần khoá.
+    Bản ghi đã được xác nhận với thiết bị nên không bị bỏ vì CSDL gặp sự cố:
+    - Lỗi tạm thời (xem la_loi_du_lieu): cả lô nằm lại đầu hàng đợi, không tính lần thử; vòng nền chờ
+      lùi dần từ `backoff_min` tới tối đa `backoff_max` giây (bỏ qua tín hiệu đủ lô) rồi mới ghi lại.
+    - Lỗi dữ liệu: lô được chia đôi và thử từng nửa cho tới khi chỉ còn từng bản ghi; chỉ bản ghi đơn lẻ
+      lỗi dữ liệu quá `max_retries` lần mới bị bỏ, một bản ghi hỏng không kéo theo cả lô.
+    """
+
+    def __init__(self, flush_fn: Callable[[List], Awaitable[None]], max_batch: int = 500,
+                 flush_interval: float = 0.2, max_queue: int = 50000, max_retries: int = 3,
+                 backoff_min: float = 0.5, backoff_max: float = 10.0):
+        self.flush_fn = flush_fn
+        self.max_batch = max(1, int(max_batch))
+        self.flush_interval = float(flush_interval)
+        self.max_queue = max(self.max_batch, int(max_queue))
+        self.max_retries = max_retries
+        self.backoff_min = float(backoff_min)
+        self.backoff_max = max(self.backoff_min, float(backoff_max))
+        self._items: List = []
+        # Các lô đã chia nhỏ sau khi ghi lỗi, cũ hơn mọi bản ghi trong _items nên được ghi trước
+        self._lo_tach: List[List] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._retries = 0
+        # Số lần lỗi tạm thời liên tiếp và thời điểm (monotonic) được ghi lại
+        self._loi_tam_thoi = 0
+        self._cho_den = 0.0
+        self._stopping = False
+        # Số liệu thống kê
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.transient_errors = 0
+        self.dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._items) + sum(len(lo) for lo in self._lo_tach)
+
+    def start(self) -> None:
+        if self.running: return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, item) -> bool:
+        """Thêm một bản ghi. Trả về False khi hàng đợi đã đầy (người gọi nên trả 503)."""
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            return False
+        self._items.append(item)
+        self.accepted += 1
+        if len(self._items) >= self.max_batch and self._wake: self._wake.set()
+        return True
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            cho = self._cho_den - time.monotonic()
+            if cho > 0:
+                # Đang lùi lại sau lỗi tạm thời: chỉ dừng máy chủ mới cắt ngang
+                try: await asyncio.wait_for(self._stop.wait(), timeout=cho)
+                except asyncio.TimeoutError: pass
+                continue
+            try: await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError: pass
+            self._wake.clear()
+            while self._items or self._lo_tach:
+                if not await self.flush_once(): break
+                if len(self._items) < self.max_batch and not self._lo_tach: break
+
+    async def flush_once(self) -> bool:
+        """Ghi một lô. Trả về False nếu lỗi (lô được giữ lại để thử lại)."""
+        if self._lo_tach: batch = self._lo_tach.pop(0)
+        elif self._items: batch, self._items = self._items[:self.max_batch], self._items[self.max_batch:]
+        else: return True
+        bat_dau = time.perf_counter()
+        try:
+            await self.flush_fn(batch)
+        except Exception as e:
+            self.flush_errors += 1
+            if not la_loi_du_lieu(e):
+                self.transient_errors += 1
+                self._lo_tach.insert(0, batch)
+                cho = min(self.backoff_max, self.backoff_min * 2 ** self._loi_tam_thoi)
+                self._loi_tam_thoi += 1
+                self._cho_den = time.monotonic() + cho
+                logger.warning("Ghi lô %d bản ghi thất bại (lỗi tạm thời, lần %d), thử lại sau %.1f giây: %s", len(batch), self._loi_tam_thoi, cho, e)
+                return False
+            self._loi_tam_thoi = 0
+            if len(batch) > 1:
+                giua = len(batch) // 2
+                self._lo_tach[:0] = [batch[:giua], batch[giua:]]
+                logger.warning("Ghi lô %d bản ghi thất bại (lỗi dữ liệu), thử lại từng nửa: %s", len(batch), e)
+                return False
+            self._retries += 1
+            if self._retries > self.max_retries:
+                self.dropped += 1
+                self._retries = 0
+                logger.error("Bỏ bản ghi lỗi dữ liệu sau %d lần thử lại: %s (%r)", self.max_retries, e, batch[0])
+            else:
+                self._lo_tach.insert(0, batch)
+            return False
+        self._retries = 0
+        self._loi_tam_thoi = 0
+        self._cho_den = 0.0
+        ms = (time.perf_counter() - bat_dau) * 1000
+        self.flushes += 1
+        self.flushed += len(batch)
+        self.last_flush_ms = ms
+        self.max_flush_ms = max(self.max_flush_ms, ms)
+        self._total_flush_ms += ms
+        return True
+
+    async def drain(self, timeout: float = 10.0) -> int:
+        """
+        Dừng vòng nền và ghi nốt các bản ghi còn lại (dùng khi tắt máy chủ), tối đa `timeout` giây.
+        CSDL vẫn lỗi khi hết hạn thì dừng, không bỏ bản ghi: trả về (và ghi log) số bản ghi chưa ghi được.
+        """
+        han = time.monotonic() + timeout
+        if self._task:
+            # Không cancel: để lô đang ghi dở hoàn tất rồi vòng nền tự thoát (đang lùi lại thì thoát ngay)
+            self._stopping = True
+            self._stop.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+        while (self._items or self._lo_tach) and time.monotonic() < han:
+            if not await self.flush_once():
+                cho = min(self._cho_den, han) - time.monotonic()
+                if cho > 0: await asyncio.sleep(cho)
+        if con_lai := self.queue_depth:
+            logger.error("Hết %.1f giây chờ ghi nốt bộ đệm: %d bản ghi chưa ghi được xuống CSDL", timeout, con_lai)
+        return con_lai
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "transient_errors": self.transient_errors,
+            "dropped": self.dropped,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
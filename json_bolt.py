@@ -0,0 +1,61 @@
+# === json_bolt.py (Serialize JSON nhanh cho các endpoint trả danh sách lớn) ===
+import datetime
+import decimal
+import json
+import math
+import uuid
+from enum import Enum
+from typing import Any, Mapping, Optional
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # Không có orjson: vẫn chạy được với json chuẩn, chỉ chậm hơn
+    orjson = None
+
+
+def _mac_dinh(obj: Any):
+    """Kiểu mà json chuẩn không tự serialize; định dạng giống Pydantic/orjson."""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)): return obj.isoformat()
+    if isinstance(obj, uuid.UUID): return str(obj)
+    if isinstance(obj, Enum): return obj.value
+    if isinstance(obj, decimal.Decimal): return float(obj)
+    raise TypeError(f"Không serialize được kiểu {type(obj).__name__}")
+
+
+def bo_so_khong_huu_han(noi_dung: Any) -> Any:
+    """Thay NaN/Infinity (JSON không biểu diễn được) bằng None trong dict/list lồng nhau."""
+    if isinstance(noi_dung, float): return noi_dung if math.isfinite(noi_dung) else None
+    if isinstance(noi_dung, dict): return {k: bo_so_khong_huu_han(v) for k, v in noi_dung.items()}
+    if isinstance(noi_dung, (list, tuple)): return [bo_so_khong_huu_han(x) for x in noi_dung]
+    return noi_dung
+
+
+def dumps(noi_dung: Any) -> bytes:
+    """JSON dạng bytes (UTF-8, không khoảng trắng thừa)."""
+    if orjson is not None: return orjson.dumps(noi_dung, default=_mac_dinh)
+    return json.dumps(noi_dung, default=_mac_dinh, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class JSONNhanhResponse(Response):
+    """
+    Response JSON trả thẳng từ dict/list đã đúng schema: FastAPI bỏ qua bước validate lại theo
+    response_model + jsonable_encoder (response_model vẫn dùng cho OpenAPI).
+    Người gọi phải bảo đảm các key khớp với model (VD: danh sách cột SELECT = các trường của model).
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def tra_json(noi_dung: Any, response: Optional[Response] = None, headers: Optional[Mapping[str, str]] = None) -> JSONNhanhResponse:
+    """
+    Bọc kết quả thành JSONNhanhResponse. Trả Response trực tiếp thì FastAPI không gộp header của
+    tham số `response` nữa, nên header đã đặt trên đó (ETag, X-Next-Cursor, ...) được chép sang.
+    """
+    gop = dict(response.headers) if response is not None else {}
+    gop.pop("content-length", None)
+    if headers: gop.update(headers)
+    return JSONNhanhResponse(noi_dung, headers=gop)
@@ -0,0 +1,53 @@
+# === log_bolt.py (Cấu hình logging có cấu trúc cho BOLT Network API) ===
+import datetime
+import json
+import logging
+import sys
+
+# Thuộc tính có sẵn của LogRecord: mọi thuộc tính khác là trường `extra=` do người gọi truyền vào
+_THUOC_TINH_CHUAN = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def _truong_them(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _THUOC_TINH_CHUAN}
+
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi bản ghi log là một dòng JSON: thời điểm, mức, logger, nội dung và các trường `extra=`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        ban_ghi = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        ban_ghi.update(_truong_them(record))
+        if record.exc_info: ban_ghi["exc"] = self.formatException(record.exc_info)
+        return json.dumps(ban_ghi, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Dạng văn bản cho người đọc; các trường `extra=` được nối thêm dạng key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        dong = super().format(record)
+        them = _truong_them(record)
+        return dong + (" " + " ".join(f"{k}={v}" for k, v in them.items()) if them else "")
+
+
+def cau_hinh_logging(muc: str = "INFO", dinh_dang: str = "text") -> None:
+    """
+    Gắn một handler stderr cho root logger (thay handler cũ nếu gọi lại).
+    Log dưới `muc` bị bỏ ngay ở logger.isEnabledFor(): log DEBUG trên hot path gần như không tốn gì khi tắt.
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if dinh_dang == "json" else TextFormatter())
+    root = logging.getLogger()
+    for cu in [h for h in root.handlers if getattr(h, "_bolt", False)]: root.removeHandler(cu)
+    handler._bolt = True
+    root.addHandler(handler)
+    root.setLevel(muc.upper())
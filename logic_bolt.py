@@ -1,5 +1,10 @@
 import math
 
+try:
+    import numpy as np
+except ImportError: # numpy chỉ cần cho bộ máy tính hàng loạt (BangDiemDichVu)
+    np = None
+
 def tinh_khoang_cach(lat1, lon1, lat2, lon2):
     """
     Hàm này tính khoảng cách giữa 2 điểm tọa độ (tính bằng km)
@@ -47,32 +52,152 @@ def tim_diem_gan_nhat(vi_do_nguoi_dung, kinh_do_nguoi_dung, danh_sach_diem, loai
             khoang_cach_ngan_nhat = khoang_cach
             diem_gan_nhat = diem
             
-    # Thêm thông tin khoảng cách vào kết quả trả về
-    diem_gan_nhat['khoang_cach_km'] = round(khoang_cach_ngan_nhat, 2)
-    
-    return diem_gan_nhat
+    # Thêm thông tin khoảng cách vào BẢN SAO của điểm (không sửa danh sách đầu vào)
+    return {**diem_gan_nhat, 'khoang_cach_km': round(khoang_cach_ngan_nhat, 2)}
+
+# --- BỘ MÁY TÍNH KHOẢNG CÁCH HÀNG LOẠT (NumPy) ---
+# Dùng cho phân tích offline: vị trí của cả hạm đội so với toàn bộ danh sách trạm.
+# Cùng công thức (và cùng thứ tự phép tính) với tinh_khoang_cach nên cho cùng kết quả.
+
+def _can_numpy():
+    if np is None:
+        raise ImportError("Cần cài numpy để dùng bộ máy tính khoảng cách hàng loạt (pip install numpy).")
+
+def _haversine_mang(lat1_rad, lon1_rad, cos_lat1, lat2_rad, lon2_rad, cos_lat2):
+    """Haversine trên mảng radian đã broadcast được với nhau (cos vĩ độ tính sẵn)."""
+    dlon = lon2_rad - lon1_rad
+    dlat = lat2_rad - lat1_rad
+    a = np.sin(dlat / 2)**2 + cos_lat1 * cos_lat2 * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return 6371 * c
+
+def ma_tran_khoang_cach(vi_do_1, kinh_do_1, vi_do_2, kinh_do_2):
+    """
+    Ma trận khoảng cách (km) kích thước (len(vi_do_1), len(vi_do_2)):
+    phần tử [i, j] = tinh_khoang_cach(vi_do_1[i], kinh_do_1[i], vi_do_2[j], kinh_do_2[j]).
+    """
+    _can_numpy()
+    lat1 = np.radians(np.asarray(vi_do_1, dtype=float))[:, None]
+    lon1 = np.radians(np.asarray(kinh_do_1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(vi_do_2, dtype=float))[None, :]
+    lon2 = np.radians(np.asarray(kinh_do_2, dtype=float))[None, :]
+    return _haversine_mang(lat1, lon1, np.cos(lat1), lat2, lon2, np.cos(lat2))
+
+class BangDiemDichVu:
+    """
+    Danh sách điểm dịch vụ lưu dạng mảng toạ độ (radian, cos vĩ độ tính sẵn một lần)
+    để tính khoảng cách cho nhiều vị trí cùng lúc. Lọc theo loại bằng mặt nạ boolean.
+    """
+
+    def __init__(self, danh_sach_diem):
+        _can_numpy()
+        self.danh_sach_diem = list(danh_sach_diem)
+        self.vi_do = np.array([diem['vi_do'] for diem in self.danh_sach_diem], dtype=float)
+        self.kinh_do = np.array([diem['kinh_do'] for diem in self.danh_sach_diem], dtype=float)
+        self.loai = np.array([diem['loai'] for diem in self.danh_sach_diem], dtype=object)
+        self._lat_rad = np.radians(self.vi_do)
+        self._lon_rad = np.radians(self.kinh_do)
+        self._cos_lat = np.cos(self._lat_rad)
+
+    def __len__(self):
+        return len(self.danh_sach_diem)
+
+    def mat_na_loai(self, loai_diem=None):
+        """Mặt nạ các điểm thuộc `loai_diem` (một loại, hoặc danh sách nhiều loại; None = tất cả)."""
+        if loai_diem is None:
+            return np.ones(len(self), dtype=bool)
+        if isinstance(loai_diem, str):
+            return self.loai == loai_diem
+        return np.isin(self.loai, list(loai_diem))
+
+    def _khoang_cach_toi(self, vi_do, kinh_do, chi_so):
+        lat = np.radians(np.asarray(vi_do, dtype=float))[:, None]
+        lon = np.radians(np.asarray(kinh_do, dtype=float))[:, None]
+        return _haversine_mang(lat, lon, np.cos(lat), self._lat_rad[chi_so][None, :], self._lon_rad[chi_so][None, :], self._cos_lat[chi_so][None, :])
+
+    def ma_tran_khoang_cach(self, vi_do, kinh_do, loai_diem=None):
+        """
+        Ma trận khoảng cách từ các vị trí (vi_do[i], kinh_do[i]) tới các điểm thuộc `loai_diem`.
+        Trả về (ma_tran (n, m), chi_so (m,)): cột j ứng với self.danh_sach_diem[chi_so[j]].
+        """
+        chi_so = np.flatnonzero(self.mat_na_loai(loai_diem))
+        return self._khoang_cach_toi(vi_do, kinh_do, chi_so), chi_so
+
+    def k_diem_gan_nhat(self, vi_do, kinh_do, k=1, loai_diem=None, kich_thuoc_khoi=1024):
+        """
+        k điểm gần nhất cho từng vị trí. Trả về (chi_so (n, k), khoang_cach (n, k)), sắp theo
+        khoảng cách tăng dần, hoà thì điểm đứng trước trong danh sách được chọn trước (như tim_diem_gan_nhat).
+        Thiếu điểm thì phần còn lại là chỉ số -1 và khoảng cách inf.
+        Xử lý từng khối `kich_thuoc_khoi` vị trí để bộ nhớ không tăng theo n * m.
+        """
+        vi_do = np.atleast_1d(np.asarray(vi_do, dtype=float))
+        kinh_do = np.atleast_1d(np.asarray(kinh_do, dtype=float))
+        n = len(vi_do)
+        chi_so_loc = np.flatnonzero(self.mat_na_loai(loai_diem))
+        ket_qua_chi_so = np.full((n, k), -1, dtype=np.int64)
+        ket_qua_khoang_cach = np.full((n, k), np.inf)
+        k_thuc = min(k, len(chi_so_loc))
+        if k_thuc == 0:
+            return ket_qua_chi_so, ket_qua_khoang_cach
+        for dau in range(0, n, kich_thuoc_khoi):
+            d = self._khoang_cach_toi(vi_do[dau:dau + kich_thuoc_khoi], kinh_do[dau:dau + kich_thuoc_khoi], chi_so_loc)
+            d = np.where(np.isnan(d), np.inf, d)
+            so_hang = len(d)
+            if k_thuc == 1:
+                cot = np.argmin(d, axis=1)[:, None] # argmin trả về vị trí ĐẦU TIÊN khi hoà
+            else:
+                # Ứng viên = mọi điểm <= khoảng cách thứ k (gồm cả các điểm hoà ở biên),
+                # rồi sắp ổn định theo (hàng, khoảng cách, chỉ số) và lấy k phần tử đầu mỗi hàng
+                nguong = np.partition(d, k_thuc - 1, axis=1)[:, k_thuc - 1:k_thuc]
+                hang, cot_ung_vien = np.nonzero(d <= nguong)
+                thu_tu = np.lexsort((cot_ung_vien, d[hang, cot_ung_vien], hang))
+                hang, cot_ung_vien = hang[thu_tu], cot_ung_vien[thu_tu]
+                cot = cot_ung_vien[np.searchsorted(hang, np.arange(so_hang))[:, None] + np.arange(k_thuc)]
+            ket_qua_chi_so[dau:dau + so_hang, :k_thuc] = chi_so_loc[cot]
+            ket_qua_khoang_cach[dau:dau + so_hang, :k_thuc] = np.take_along_axis(d, cot, axis=1)
+        return ket_qua_chi_so, ket_qua_khoang_cach
+
+    def tim_diem_gan_nhat_hang_loat(self, vi_do, kinh_do, loai_diem=None):
+        """
+        Phiên bản hàng loạt của tim_diem_gan_nhat: với mỗi vị trí trả về bản sao của điểm gần nhất
+        kèm 'khoang_cach_km', hoặc None nếu không có điểm nào phù hợp.
+        """
+        chi_so, khoang_cach = self.k_diem_gan_nhat(vi_do, kinh_do, k=1, loai_diem=loai_diem)
+        return [
+            {**self.danh_sach_diem[i], 'khoang_cach_km': round(float(kc), 2)} if i >= 0 else None
+            for i, kc in zip(chi_so[:, 0], khoang_cach[:, 0])
+        ]
 
 # --- VÍ DỤ SỬ DỤNG ---
 
-# 1. Cơ sở dữ liệu mẫu của chúng ta
-CSDL_diem_dich_vu = [
-  { "id": "GAS001", "ten": "Cây xăng Petrolimex", "loai": "xang_dau", "vi_do": 10.7769, "kinh_do": 106.7009 },
-  { "id": "GAS002", "ten": "Cây xăng Comeco", "loai": "xang_dau", "vi_do": 10.7811, "kinh_do": 106.6982 },
-  { "id": "EV001", "ten": "Trạm sạc VinFast", "loai": "tram_sac", "vi_do": 10.7852, "kinh_do": 106.6954 },
-  { "id": "GARAGE001", "ten": "Garage Auto A+", "loai": "sua_chua", "vi_do": 10.7714, "kinh_do": 106.6682 }
-]
-
-# 2. Giả sử vị trí hiện tại của người dùng
-vi_tri_hien_tai_lat = 10.7800
-vi_tri_hien_tai_lon = 106.6990
-
-# 3. Tìm cây xăng gần nhất
-cay_xang_gan_nhat = tim_diem_gan_nhat(vi_tri_hien_tai_lat, vi_tri_hien_tai_lon, CSDL_diem_dich_vu, loai_diem="xang_dau")
-print(f"Cây xăng gần nhất là: {cay_xang_gan_nhat['ten']}")
-print(f"Khoảng cách: {cay_xang_gan_nhat['khoang_cach_km']} km")
-print("-" * 20)
-
-# 4. Tìm trạm sạc gần nhất
-tram_sac_gan_nhat = tim_diem_gan_nhat(vi_tri_hien_tai_lat, vi_tri_hien_tai_lon, CSDL_diem_dich_vu, loai_diem="tram_sac")
-print(f"Trạm sạc gần nhất là: {tram_sac_gan_nhat['ten']}")
-print(f"Khoảng cách: {tram_sac_gan_nhat['khoang_cach_km']} km")
+if __name__ == "__main__":
+    # 1. Cơ sở dữ liệu mẫu của chúng ta
+    CSDL_diem_dich_vu = [
+      { "id": "GAS001", "ten": "Cây xăng Petrolimex", "loai": "xang_dau", "vi_do": 10.7769, "kinh_do": 106.7009 },
+      { "id": "GAS002", "ten": "Cây xăng Comeco", "loai": "xang_dau", "vi_do": 10.7811, "kinh_do": 106.6982 },
+      { "id": "EV001", "ten": "Trạm sạc VinFast", "loai": "tram_sac", "vi_do": 10.7852, "kinh_do": 106.6954 },
+      { "id": "GARAGE001", "ten": "Garage Auto A+", "loai": "sua_chua", "vi_do": 10.7714, "kinh_do": 106.6682 }
+    ]
+
+    # 2. Giả sử vị trí hiện tại của người dùng
+    vi_tri_hien_tai_lat = 10.7800
+    vi_tri_hien_tai_lon = 106.6990
+
+    # 3. Tìm cây xăng gần nhất
+    cay_xang_gan_nhat = tim_diem_gan_nhat(vi_tri_hien_tai_lat, vi_tri_hien_tai_lon, CSDL_diem_dich_vu, loai_diem="xang_dau")
+    print(f"Cây xăng gần nhất là: {cay_xang_gan_nhat['ten']}")
+    print(f"Khoảng cách: {cay_xang_gan_nhat['khoang_cach_km']} km")
+    print("-" * 20)
+
+    # 4. Tìm trạm sạc gần nhất
+    tram_sac_gan_nhat = tim_diem_gan_nhat(vi_tri_hien_tai_lat, vi_tri_hien_tai_lon, CSDL_diem_dich_vu, loai_diem="tram_sac")
+    print(f"Trạm sạc gần nhất là: {tram_sac_gan_nhat['ten']}")
+    print(f"Khoảng cách: {tram_sac_gan_nhat['khoang_cach_km']} km")
+    print("-" * 20)
+
+    # 5. Tìm cây xăng gần nhất cho nhiều xe cùng lúc (bộ máy NumPy)
+    bang_diem = BangDiemDichVu(CSDL_diem_dich_vu)
+    vi_do_cac_xe = [10.7800, 10.7700, 10.7850]
+    kinh_do_cac_xe = [106.6990, 106.6700, 106.6950]
+    for xe, diem in enumerate(bang_diem.tim_diem_gan_nhat_hang_loat(vi_do_cac_xe, kinh_do_cac_xe, loai_diem="xang_dau")):
+        print(f"Xe {xe}: {diem['ten']} ({diem['khoang_cach_km']} km)")
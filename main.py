@@ -3,51 +3,240 @@ import math
 import datetime
 import uuid
 import os # <-- ĐÃ THÊM
+import base64
 from enum import Enum
-from fastapi import FastAPI, HTTPException, Query, Depends, Header, status, Path
-from typing import Optional, List
+from fastapi import FastAPI, HTTPException, Query, Depends, Header, status, Path, Request, WebSocket, WebSocketException, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from typing import Any, Optional, List, Dict, AsyncIterator
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from pydantic import BaseModel, validator
-from sqlalchemy import create_engine, text, Column, String, Float, MetaData, Table, BigInteger, DateTime, func, Boolean, UUID
+from pydantic import BaseModel, Field, validator, ValidationError
+from sqlalchemy import create_engine, event, text, Column, String, Float, MetaData, Table, BigInteger, Integer, DateTime, func, Boolean, Uuid, Index, bindparam
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from starlette.concurrency import run_in_threadpool
 from pydantic_settings import BaseSettings
 from passlib.context import CryptContext
 import secrets # <-- ĐÃ THÊM
+import hmac
+import hashlib
+from cache_bolt import TTLCache, VersionedTTLCache
+from spatial_bolt import DiemDichVuIndex, bounding_box, haversine_km, o_geohash, NUA_CHU_VI_KM
+from ingest_bolt import WriteBehindBuffer
+from alerts_bolt import AlertWorkerPool
+import partitions_bolt
+import sqlite_bolt
+import pool_bolt
+from pubsub_bolt import PubSubHub
+import import_bolt
+import export_bolt
+import json_bolt
+from json_bolt import tra_json
+import json
+import asyncio
+import logging
+import time
+import functools
+import re
+import log_bolt
+from metrics_bolt import Registry, PrometheusMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 # --- 1. SETTINGS ---
 class Settings(BaseSettings):
+    # PostgreSQL, hoặc SQLite cho gateway một máy / chạy thử: sqlite:///bolt.db (file, WAL), sqlite:// (bộ nhớ)
     DATABASE_URL: str
+    # SQLite: thời gian chờ tối đa khi CSDL đang bị transaction khác khoá ghi
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+
+    # Pool kết nối Postgres (xem pool_bolt). WEB_CONCURRENCY: số tiến trình uvicorn (uvicorn --workers đọc cùng biến)
+    WEB_CONCURRENCY: int = 1
+    # Tổng số kết nối tối đa của MỌI tiến trình tới Postgres/PgBouncer (chừa lại cho psql, migration, ...)
+    DB_MAX_CONNECTIONS: int = 80
+    # Ghi đè kích thước tự tính cho mỗi engine (-1 = tự chia DB_MAX_CONNECTIONS theo nhu cầu)
+    DB_POOL_SIZE: int = -1
+    DB_MAX_OVERFLOW: int = -1
+    DB_POOL_TIMEOUT_SECONDS: float = 10.0
+    # Đóng và mở lại kết nối sống quá lâu (tránh bị firewall/PgBouncer cắt ngầm)
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    # Ping kết nối đã rảnh quá số giây này trước khi dùng, loại kết nối chết (0 = ping mọi lần lấy, -1 = tắt)
+    DB_POOL_PING_IDLE_SECONDS: float = 30.0
+    # Số prepared statement asyncpg giữ mỗi kết nối
+    DB_STATEMENT_CACHE_SIZE: int = 500
+    # Kết nối qua PgBouncer chế độ transaction: tắt cache prepared statement
+    DB_PGBOUNCER: bool = False
     
     # --- 1b. SETTINGS MỚI (v0.15.0) ---
     # Key này sẽ được dùng cho Dashboard Admin v3.0
     ADMIN_API_KEY: str 
+
+    # Cache xác thực thiết bị: bỏ qua SELECT + bcrypt cho các request lặp lại
+    AUTH_CACHE_TTL_SECONDS: int = 300
+    AUTH_CACHE_MAX_SIZE: int = 10000
+
+    # Chỉ mục không gian trong bộ nhớ cho diem_dich_vu
+    SPATIAL_INDEX_ENABLED: bool = True
+    SPATIAL_INDEX_CELL_DEG: float = 0.1
+    # Nạp lại định kỳ để các worker khác thấy điểm mới (0 = tắt)
+    SPATIAL_INDEX_REFRESH_SECONDS: int = 300
+
+    # Cache kết quả /cac-diem-xung-quanh và /tim-diem-gan-nhat theo ô geohash
+    # (độ chính xác 6 ≈ ô 1.2 x 0.6 km: người dùng gần nhau dùng chung một mục cache)
+    DIEM_CACHE_ENABLED: bool = True
+    DIEM_CACHE_MAX_SIZE: int = 10000
+    DIEM_CACHE_TTL_SECONDS: int = 300
+    DIEM_CACHE_GEOHASH_PRECISION: int = 6
+    # Bán kính của khoá cache /cac-diem-xung-quanh được làm tròn lên mức gần nhất (km); bán kính lớn hơn mức cuối
+    # hoặc tập ứng viên quá DIEM_CACHE_MAX_CANDIDATES điểm thì không cache (truy vấn thẳng)
+    DIEM_CACHE_RADIUS_BUCKETS_KM: List[float] = [1, 2, 5, 10, 20]
+    DIEM_CACHE_MAX_CANDIDATES: int = 2000
+    # Bán kính tối đa của /cac-diem-xung-quanh
+    DIEM_SEARCH_MAX_RADIUS_KM: float = 100.0
+
+    # Bộ đệm ghi trễ cho heartbeat: ghi theo lô khi đủ số dòng hoặc hết chu kỳ
+    INGEST_BUFFER_ENABLED: bool = True
+    INGEST_FLUSH_MAX_ROWS: int = 500
+    INGEST_FLUSH_INTERVAL_MS: int = 200
+    INGEST_MAX_QUEUE: int = 50000
+    # CSDL lỗi tạm thời (mất kết nối, ngừng): chờ lùi dần tới tối đa số giây này giữa các lần ghi lại
+    INGEST_RETRY_BACKOFF_MAX_SECONDS: float = 10.0
+    # Thời gian tối đa ghi nốt bộ đệm khi tắt máy chủ
+    INGEST_DRAIN_TIMEOUT_SECONDS: float = 15.0
+    # Số heartbeat tối đa trong một request /device/heartbeat/batch
+    HEARTBEAT_BATCH_MAX_ITEMS: int = 1000
+
+    # Worker xét cảnh báo chạy nền (ngoài đường đi của request heartbeat)
+    ALERT_WORKER_ENABLED: bool = True
+    ALERT_WORKER_CONCURRENCY: int = 2
+    ALERT_WORKER_BATCH_SIZE: int = 50
+    ALERT_WORKER_POLL_SECONDS: float = 5.0
+    ALERT_JOB_MAX_ATTEMPTS: int = 5
+
+    # Chống lặp cảnh báo: cùng (thiết bị, loại, mã lỗi) trong cửa sổ này chỉ tăng bộ đếm của cảnh báo chưa đọc
+    ALERT_SUPPRESSION_WINDOW_SECONDS: int = 1800
+    ALERT_SUPPRESSION_MAX_KEYS: int = 100000
+
+    # Phân vùng obd_logs theo thời gian ("day" | "month"), lưu trữ và rollup
+    OBD_PARTITION_INTERVAL: str = "month"
+    OBD_PARTITIONS_AHEAD: int = 2
+    OBD_RETENTION_DAYS: int = 90 # 0 = giữ dữ liệu thô mãi mãi
+    OBD_MAINTENANCE_INTERVAL_SECONDS: int = 3600
+
+    # Số thiết bị tối đa mỗi trang của /admin/fleet/snapshot
+    FLEET_SNAPSHOT_MAX_LIMIT: int = 5000
+
+    # Luồng sự kiện realtime (WebSocket/SSE): hàng đợi mỗi người nghe, số người nghe tối đa, keep-alive
+    PUBSUB_SUBSCRIBER_QUEUE_SIZE: int = 256
+    PUBSUB_MAX_SUBSCRIBERS: int = 10000
+    PUBSUB_KEEPALIVE_SECONDS: float = 15.0
+
+    # GET /device/alerts?wait=...: thời gian giữ request tối đa và chu kỳ kiểm tra lại phiên bản
+    # (kiểm tra lại để thấy cả cảnh báo do worker/tiến trình khác ghi)
+    ALERT_LONG_POLL_MAX_SECONDS: float = 30.0
+    ALERT_LONG_POLL_RECHECK_SECONDS: float = 5.0
+
+    # Phân trang keyset cho danh sách cảnh báo / thiết bị (kích thước trang mặc định và tối đa)
+    ALERT_PAGE_SIZE_DEFAULT: int = 100
+    ALERT_PAGE_SIZE_MAX: int = 1000
+    DEVICE_PAGE_SIZE_DEFAULT: int = 500
+    DEVICE_PAGE_SIZE_MAX: int = 5000
+
+    # Nhập hàng loạt điểm dịch vụ: số dòng mỗi lần kiểm tra + COPY, số lỗi tối đa trả về
+    DIEM_DICH_VU_IMPORT_CHUNK_ROWS: int = 5000
+    DIEM_DICH_VU_IMPORT_MAX_ERRORS: int = 1000
+
+    # Số alert_id tối đa trong một request đánh dấu đã đọc hàng loạt
+    ALERT_BULK_READ_MAX_IDS: int = 10000
+
+    # Xuất obd_logs (GET /admin/obd/export): số dòng mỗi trang keyset, mỗi trang đọc trong một transaction ngắn riêng
+    OBD_EXPORT_PAGE_ROWS: int = 2000
+    OBD_EXPORT_PARQUET_ROW_GROUP: int = 50000
+
+    # Logging: mức (DEBUG/INFO/WARNING/...) và định dạng ("text" hoặc "json" một dòng/bản ghi)
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"
+    # Số liệu đo Prometheus tại GET /metrics
+    METRICS_ENABLED: bool = True
     
     class Config: env_file = ".env"
 settings = Settings()
+log_bolt.cau_hinh_logging(settings.LOG_LEVEL, settings.LOG_FORMAT)
+logger = logging.getLogger("bolt.api")
 
 # --- CONSTANTS ---
 LOW_FUEL_THRESHOLD = 20.0
 TEST_DEVICE_ID = "BOLT-TEST-001" 
 
-# --- 2. DATABASE (Giữ nguyên) ---
-engine = create_engine(settings.DATABASE_URL)
+# --- 2. DATABASE ---
+# Chế độ SQLite (xem sqlite_bolt): các câu SQL chỉ Postgres mới có được thay bằng dạng tương đương ở từng chỗ dùng
+LA_SQLITE = sqlite_bolt.la_sqlite(settings.DATABASE_URL)
+_DATABASE_URL = sqlite_bolt.cau_hinh_url(settings.DATABASE_URL) if LA_SQLITE else settings.DATABASE_URL
+_THAM_SO_ENGINE = sqlite_bolt.tham_so_engine() if LA_SQLITE else {}
+
+# Postgres: pool giữ sẵn đủ kết nối cho nhu cầu thường xuyên (không mở/đóng kết nối trên đường heartbeat),
+# tổng mọi tiến trình không vượt DB_MAX_CONNECTIONS.
+# Engine bất đồng bộ: request async + bộ đệm ghi heartbeat + worker cảnh báo + bảo trì; đồng bộ: route `def` trong threadpool
+_NHU_CAU_ASYNC = 5 + 1 + (settings.ALERT_WORKER_CONCURRENCY if settings.ALERT_WORKER_ENABLED else 0) + 1
+_NHU_CAU_SYNC = 5
+
+def _tham_so_pool(lop_pool, kich_thuoc: tuple) -> dict:
+    pool_size, max_overflow = kich_thuoc
+    if settings.DB_POOL_SIZE >= 0: pool_size = max(1, settings.DB_POOL_SIZE)
+    if settings.DB_MAX_OVERFLOW >= 0: max_overflow = settings.DB_MAX_OVERFLOW
+    return pool_bolt.tham_so_engine(lop_pool, pool_size, max_overflow, settings.DB_POOL_TIMEOUT_SECONDS,
+                                    settings.DB_POOL_RECYCLE_SECONDS, settings.DB_POOL_PING_IDLE_SECONDS)
+
+_POOL_ASYNC, _POOL_SYNC = pool_bolt.chia_ngan_sach(settings.DB_MAX_CONNECTIONS, settings.WEB_CONCURRENCY, _NHU_CAU_ASYNC, _NHU_CAU_SYNC)
+engine = create_engine(_DATABASE_URL, **(_THAM_SO_ENGINE or _tham_so_pool(QueuePool, _POOL_SYNC)))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Engine bất đồng bộ (asyncpg, hoặc aiosqlite với SQLite) cho các route `async def`: truy vấn không chặn event loop.
+# Các route `def` vẫn dùng engine đồng bộ ở trên (FastAPI chạy chúng trong threadpool).
+def _async_database_url(url: str):
+    u = make_url(url)
+    if LA_SQLITE: return u.set(drivername="sqlite+aiosqlite")
+    u = u.set(drivername="postgresql+asyncpg")
+    # asyncpg không hiểu `sslmode` của libpq (URL kiểu Render/Heroku), đổi sang `ssl`
+    if "sslmode" in u.query:
+        u = u.difference_update_query(["sslmode"]).update_query_dict({"ssl": u.query["sslmode"]})
+    return u
+
+if LA_SQLITE: async_engine = create_async_engine(_async_database_url(_DATABASE_URL), **_THAM_SO_ENGINE)
+else:
+    _url_async, _connect_args_async = pool_bolt.cau_hinh_asyncpg(_async_database_url(_DATABASE_URL), settings.DB_STATEMENT_CACHE_SIZE, settings.DB_PGBOUNCER)
+    async_engine = create_async_engine(_url_async, connect_args=_connect_args_async, **_tham_so_pool(AsyncAdaptedQueuePool, _POOL_ASYNC))
+if LA_SQLITE:
+    for _eng in (engine, async_engine.sync_engine):
+        sqlite_bolt.cau_hinh_engine(_eng, settings.SQLITE_BUSY_TIMEOUT_MS, wal=not sqlite_bolt.la_bo_nho(_DATABASE_URL))
+elif settings.DB_POOL_PING_IDLE_SECONDS > 0:
+    for _eng in (engine, async_engine.sync_engine): pool_bolt.ping_khi_ranh_lau(_eng, settings.DB_POOL_PING_IDLE_SECONDS)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 metadata = MetaData()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # --- 2a, 2b, 2c. BẢNG DỮ LIỆU (Giữ nguyên) ---
 # ... (Giữ nguyên các định nghĩa bảng diem_dich_vu_table, devices_table, v.v...)
+# Khoá tự tăng: SQLite chỉ tự sinh giá trị cho cột INTEGER PRIMARY KEY (bí danh của rowid)
+ID_TU_TANG = BigInteger().with_variant(Integer, "sqlite")
 diem_dich_vu_table = Table(
     "diem_dich_vu", metadata,
     Column("id", String, primary_key=True), Column("ten", String, nullable=False),
     Column("loai", String, nullable=False), Column("dia_chi", String),
     Column("vi_do", Float, nullable=False), Column("kinh_do", Float, nullable=False)
 )
+# Chỉ mục cho tiền lọc hộp bao (bounding box) của các truy vấn Haversine
+Index("ix_diem_dich_vu_loai_vi_do_kinh_do", diem_dich_vu_table.c.loai, diem_dich_vu_table.c.vi_do, diem_dich_vu_table.c.kinh_do)
+Index("ix_diem_dich_vu_vi_do_kinh_do", diem_dich_vu_table.c.vi_do, diem_dich_vu_table.c.kinh_do)
 devices_table = Table(
     "devices", metadata,
     Column("id", String, primary_key=True), Column("api_key_hash", String, nullable=False),
-    Column("vehicle_make", String), Column("vehicle_model", String)
+    Column("vehicle_make", String), Column("vehicle_model", String),
+    # Tăng mỗi khi cảnh báo của thiết bị được ghi/gộp hoặc đánh dấu đã đọc (dùng làm ETag)
+    Column("alert_version", BigInteger, nullable=False, server_default="0")
 )
 device_locations_table = Table(
     "device_locations", metadata,
@@ -55,23 +244,107 @@ device_locations_table = Table(
     Column("last_lat", Float, nullable=False), Column("last_lon", Float, nullable=False),
     Column("last_seen", DateTime, nullable=False, default=func.now())
 )
+# Phân vùng theo khoảng `timestamp` (khoá chính phải chứa cột phân vùng).
+# Phân vùng được tạo/xoá bởi bao_tri_obd_logs(), xem partitions_bolt. SQLite: bảng thường, khoá chính chỉ là id.
 obd_logs_table = Table(
     "obd_logs", metadata,
-    Column("id", BigInteger, primary_key=True, autoincrement=True),
+    Column("id", ID_TU_TANG, primary_key=True, autoincrement=True),
     Column("device_id", String, nullable=False),
-    Column("timestamp", DateTime, nullable=False, default=func.now()),
+    Column("timestamp", DateTime, primary_key=not LA_SQLITE, nullable=False, default=func.now()),
     Column("fuel_level", Float), Column("rpm", BigInteger),
-    Column("speed", BigInteger), Column("error_codes", String)
+    Column("speed", BigInteger), Column("error_codes", String),
+    postgresql_partition_by="RANGE (timestamp)"
 )
+Index("ix_obd_logs_device_id_timestamp", obd_logs_table.c.device_id, obd_logs_table.c.timestamp)
+
+# Bảng tổng hợp theo phút/giờ, giữ lại sau khi dữ liệu thô hết hạn.
+# Lưu tổng + số mẫu (thay vì trung bình) để gộp cộng dồn được: avg = *_sum / *_count.
+def _bang_rollup(ten: str) -> Table:
+    cot = [Column("device_id", String, primary_key=True), Column("bucket", DateTime, primary_key=True),
+           Column("samples", BigInteger, nullable=False)]
+    for chi_so in ("fuel_level", "rpm", "speed"):
+        cot += [Column(f"{chi_so}_sum", Float, nullable=False), Column(f"{chi_so}_count", BigInteger, nullable=False),
+                Column(f"{chi_so}_min", Float), Column(f"{chi_so}_max", Float)]
+    return Table(ten, metadata, *cot)
+
+obd_rollup_minute_table = _bang_rollup("obd_rollup_minute")
+obd_rollup_hour_table = _bang_rollup("obd_rollup_hour")
 user_alerts_table = Table(
     "user_alerts", metadata,
-    Column("alert_id", UUID(as_uuid=True), primary_key=True, default=uuid.uuid4),
+    # Postgres: kiểu UUID gốc; SQLite: chuỗi 36 ký tự có gạch nối (giống JSON trả về cho client)
+    Column("alert_id", Uuid(as_uuid=True).with_variant(String(36), "sqlite"), primary_key=True, default=uuid.uuid4),
     Column("device_id", String, nullable=False),
     Column("timestamp", DateTime, default=func.now()),
     Column("alert_type", String, nullable=False),
     Column("message", String, nullable=False),
-    Column("is_read", Boolean, default=False, nullable=False)
+    Column("is_read", Boolean, default=False, nullable=False),
+    # Chống lặp: khoá gộp (mã lỗi với ERROR_CODE, rỗng với LOW_FUEL), số lần lặp và lần gặp cuối
+    Column("dedupe_key", String, nullable=False, server_default=""),
+    Column("occurrence_count", Integer, nullable=False, server_default="1"),
+    Column("last_seen", DateTime)
+)
+# Mỗi (thiết bị, loại, khoá) chỉ có tối đa MỘT cảnh báo chưa đọc; lặp lại thì ON CONFLICT tăng bộ đếm
+Index("ux_user_alerts_unread_dedupe", user_alerts_table.c.device_id, user_alerts_table.c.alert_type, user_alerts_table.c.dedupe_key,
+      unique=True, postgresql_where=text("is_read = false"), sqlite_where=text("is_read = false"))
+# Danh sách cảnh báo chưa đọc theo thiết bị, phân trang keyset theo (timestamp, alert_id);
+# cũng dùng cho đếm / lấy cảnh báo mới nhất trong snapshot hạm đội
+Index("ix_user_alerts_device_id_timestamp_alert_id_unread", user_alerts_table.c.device_id, user_alerts_table.c.timestamp,
+      user_alerts_table.c.alert_id, postgresql_where=text("is_read = false"), sqlite_where=text("is_read = false"))
+# Hàng đợi bền vững (transactional outbox) cho việc xét cảnh báo: mỗi dòng được ghi
+# CÙNG transaction với dòng obd_logs tương ứng, nên việc chỉ tồn tại khi log đã commit
+# và chỉ bị xoá cùng transaction với cảnh báo được tạo ra (at-least-once).
+alert_jobs_table = Table(
+    "alert_jobs", metadata,
+    Column("id", ID_TU_TANG, primary_key=True, autoincrement=True),
+    Column("device_id", String, nullable=False),
+    Column("timestamp", DateTime, nullable=False),
+    Column("lat", Float, nullable=False), Column("lon", Float, nullable=False),
+    Column("fuel_level", Float), Column("error_codes", String),
+    Column("attempts", Integer, nullable=False, server_default="0"),
+    Column("next_attempt_at", DateTime, nullable=False, server_default=func.now()),
+    Column("last_error", String)
 )
+Index("ix_alert_jobs_next_attempt_at", alert_jobs_table.c.next_attempt_at)
+
+def nang_cap_schema(conn) -> None:
+    """
+    Nâng cấp các bảng đã tồn tại từ phiên bản trước (create_all không thêm cột mới).
+    Chạy trước tao_chi_muc_con_thieu: các cảnh báo chưa đọc bị trùng được gộp vào bản mới nhất
+    (cộng dồn occurrence_count, các bản cũ đánh dấu đã đọc) để tạo được chỉ mục unique.
+    CSDL SQLite luôn được tạo mới bằng create_all với schema hiện tại nên không cần nâng cấp.
+    """
+    if conn.dialect.name == "sqlite": return
+    conn.execute(text("ALTER TABLE user_alerts ADD COLUMN IF NOT EXISTS dedupe_key VARCHAR NOT NULL DEFAULT ''"))
+    conn.execute(text("ALTER TABLE user_alerts ADD COLUMN IF NOT EXISTS occurrence_count INTEGER NOT NULL DEFAULT 1"))
+    conn.execute(text("ALTER TABLE user_alerts ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP"))
+    conn.execute(text("ALTER TABLE devices ADD COLUMN IF NOT EXISTS alert_version BIGINT NOT NULL DEFAULT 0"))
+    # Thay bằng ix_user_alerts_device_id_timestamp_alert_id_unread (thêm alert_id cho phân trang keyset)
+    conn.execute(text("DROP INDEX IF EXISTS ix_user_alerts_device_id_timestamp_unread"))
+    if conn.execute(text("SELECT to_regclass('ux_user_alerts_unread_dedupe')")).scalar() is None:
+        conn.execute(text("""
+        WITH nhom AS (
+            SELECT alert_id, ROW_NUMBER() OVER w AS thu_tu, SUM(occurrence_count) OVER (PARTITION BY device_id, alert_type, dedupe_key) AS tong, MAX(COALESCE(last_seen, timestamp)) OVER (PARTITION BY device_id, alert_type, dedupe_key) AS cuoi
+            FROM user_alerts WHERE is_read = false
+            WINDOW w AS (PARTITION BY device_id, alert_type, dedupe_key ORDER BY timestamp DESC, alert_id)
+        )
+        UPDATE user_alerts u SET
+            is_read = (nhom.thu_tu > 1),
+            occurrence_count = CASE WHEN nhom.thu_tu = 1 THEN nhom.tong ELSE u.occurrence_count END,
+            last_seen = CASE WHEN nhom.thu_tu = 1 THEN nhom.cuoi ELSE u.last_seen END
+        FROM nhom WHERE u.alert_id = nhom.alert_id
+        """))
+    # obd_logs cũ (bảng thường) -> bảng phân vùng; dữ liệu cũ thành phân vùng obd_logs_legacy
+    if partitions_bolt.chuyen_sang_phan_vung(conn, "obd_logs", "timestamp", settings.OBD_PARTITION_INTERVAL,
+                                             conn.execute(text("SELECT LOCALTIMESTAMP")).scalar(), obd_logs_table.create):
+        logger.info("Đã chuyển obd_logs sang bảng phân vùng theo thời gian.")
+
+def tao_chi_muc_con_thieu(conn) -> None:
+    """
+    create_all() bỏ qua các bảng đã tồn tại (kèm chỉ mục của chúng),
+    nên chỉ mục được thêm sau phải tạo riêng cho các CSDL cũ.
+    """
+    for table in metadata.sorted_tables:
+        for index in table.indexes: index.create(conn, checkfirst=True)
 
 # DB Dependency (Giữ nguyên)
 def get_db():
@@ -81,15 +354,26 @@ def get_db():
     finally:
         db.close()
 
+# DB Dependency bất đồng bộ cho các route `async def`
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def _thoi_diem_csdl(ts: datetime.datetime) -> datetime.datetime:
+    # Cột TIMESTAMP (không múi giờ): Postgres vốn bỏ qua offset, asyncpg thì báo lỗi với giá trị có tzinfo
+    return ts.replace(tzinfo=None) if ts.tzinfo else ts
+
 # --- 3. PYDANTIC MODELS ---
 class DiemDichVuInputModel(BaseModel): id: str; ten: str; loai: str; dia_chi: Optional[str] = None; vi_do: float; kinh_do: float
 class DiemDichVuResponseModel(BaseModel): id: str; ten: str; loai: str; dia_chi: Optional[str] = None; vi_do: float; kinh_do: float; khoang_cach_km: float
-class LocationModel(BaseModel): lat: float; lon: float
-class OBDDataModel(BaseModel): fuel_level: Optional[float] = None; engine_status: Optional[str] = None; rpm: Optional[int] = None; speed: Optional[int] = None; error_codes: Optional[List[str]] = []
+# Heartbeat được trả 202 TRƯỚC khi ghi (bộ đệm ghi trễ): giá trị CSDL không nhận được (ngoài BIGINT, NaN/inf) phải bị từ chối ngay ở đây
+_BIGINT_MIN, _BIGINT_MAX = -2**63, 2**63 - 1
+class LocationModel(BaseModel): lat: float = Field(allow_inf_nan=False); lon: float = Field(allow_inf_nan=False)
+class OBDDataModel(BaseModel): fuel_level: Optional[float] = Field(None, allow_inf_nan=False); engine_status: Optional[str] = None; rpm: Optional[int] = Field(None, ge=_BIGINT_MIN, le=_BIGINT_MAX); speed: Optional[int] = Field(None, ge=_BIGINT_MIN, le=_BIGINT_MAX); error_codes: Optional[List[str]] = []
 class DeviceHeartbeatModel(BaseModel): timestamp: datetime.datetime; location: LocationModel; obd_data: OBDDataModel
 class DeviceLocationResponse(BaseModel): device_id: str; last_lat: float; last_lon: float; last_seen: datetime.datetime
 class AlertType(str, Enum): LOW_FUEL = "LOW_FUEL"; ERROR_CODE = "ERROR_CODE"
-class UserAlertResponse(BaseModel): alert_id: uuid.UUID; device_id: str; timestamp: datetime.datetime; alert_type: AlertType; message: str; is_read: bool
+class UserAlertResponse(BaseModel): alert_id: uuid.UUID; device_id: str; timestamp: datetime.datetime; alert_type: AlertType; message: str; is_read: bool; occurrence_count: int = 1; last_seen: Optional[datetime.datetime] = None
 class MockLocationInput(BaseModel):
     lat: float
     lon: float
@@ -107,6 +391,71 @@ class DeviceAdminListModel(BaseModel):
     vehicle_make: Optional[str] = None
     vehicle_model: Optional[str] = None
 
+class DeviceApiKeyRotateModel(BaseModel):
+    # Bỏ trống để máy chủ tự sinh key ngẫu nhiên
+    api_key: Optional[str] = None
+
+class DeviceApiKeyResponse(BaseModel):
+    device_id: str
+    api_key: str
+
+# --- 3f. MODEL LÔ HEARTBEAT ---
+class HeartbeatBatchItemResult(BaseModel):
+    index: int
+    status: str # "accepted" | "rejected"
+    error: Optional[str] = None
+
+class HeartbeatBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+    results: List[HeartbeatBatchItemResult]
+
+# --- 3g. MODEL SNAPSHOT HẠM ĐỘI ---
+class FleetDeviceSnapshot(BaseModel):
+    id: str
+    vehicle_make: Optional[str] = None
+    vehicle_model: Optional[str] = None
+    last_lat: Optional[float] = None
+    last_lon: Optional[float] = None
+    last_seen: Optional[datetime.datetime] = None
+    unread_alert_count: int = 0
+    latest_alert: Optional[UserAlertResponse] = None # Cảnh báo chưa đọc mới nhất
+
+class FleetSnapshotResponse(BaseModel):
+    total: int # Tổng số thiết bị khớp bộ lọc (không tính phân trang)
+    limit: int
+    offset: int
+    devices: List[FleetDeviceSnapshot]
+
+# --- 3h. MODEL NHẬP HÀNG LOẠT ĐIỂM DỊCH VỤ ---
+class DiemDichVuImportError(BaseModel):
+    line: int # Số dòng (bắt đầu từ 1) của bản ghi trong file
+    error: str
+
+class DiemDichVuImportResponse(BaseModel):
+    received: int
+    accepted: int
+    rejected: int
+    inserted: int
+    updated: int
+    unchanged: int # Trùng hoàn toàn với dữ liệu đã có, hoặc id lặp lại trong file (bản sau cùng được dùng)
+    errors: List[DiemDichVuImportError]
+    errors_truncated: bool = False
+
+
+# --- 3i. MODEL ĐÁNH DẤU ĐÃ ĐỌC HÀNG LOẠT ---
+class DeviceAlertBulkReadModel(BaseModel):
+    # Các điều kiện được kết hợp bằng AND
+    alert_ids: Optional[List[uuid.UUID]] = None
+    alert_type: Optional[AlertType] = None
+    older_than: Optional[datetime.datetime] = None # Chỉ các cảnh báo có timestamp < older_than
+
+class AdminAlertBulkReadModel(DeviceAlertBulkReadModel):
+    device_id: Optional[str] = None
+
+class AlertBulkReadResponse(BaseModel):
+    updated: int
+
 
 # --- 4. LIFESPAN (Giữ nguyên) ---
 def seed_initial_data(db: Session):
@@ -140,18 +489,403 @@ def seed_initial_data(db: Session):
     db.execute(stmt_location_seed, {"device_id": PROD_DEVICE_ID})
 
     db.commit()
-    print("Khởi tạo/Seed CSDL Postgres thành công (Phase 1, 2 & Initial Location).")
+    logger.info("Khởi tạo/Seed CSDL Postgres thành công (Phase 1, 2 & Initial Location).")
+
+
+# --- 4b. CHỈ MỤC KHÔNG GIAN (diem_dich_vu) ---
+# Các endpoint tìm kiếm dùng chỉ mục này khi đã nạp xong; nếu chưa (VD: lỗi CSDL lúc khởi động)
+# thì quay về truy vấn HAVERSINE_SQL như cũ.
+diem_dich_vu_index = DiemDichVuIndex(cell_deg=settings.SPATIAL_INDEX_CELL_DEG)
+
+def nap_chi_muc_khong_gian() -> int:
+    with SessionLocal() as db:
+        rows = db.execute(text(f"SELECT {_SQL_COT_DIEM_DICH_VU} FROM diem_dich_vu")).fetchall()
+    diem_dich_vu_index.load(dict(row._mapping) for row in rows)
+    return len(diem_dich_vu_index)
+
+async def _lam_moi_chi_muc_dinh_ky(chu_ky: int):
+    while True:
+        await asyncio.sleep(chu_ky)
+        try: await asyncio.to_thread(nap_chi_muc_khong_gian)
+        except Exception as e: logger.error("Không thể nạp lại chỉ mục không gian: %s", e)
+
+# --- 4c. BỘ ĐỆM GHI HEARTBEAT (write-behind) ---
+# SQLite giới hạn 32766 tham số/câu lệnh: chia INSERT nhiều dòng thành từng khúc (Postgres dùng unnest, xem _ghi_lo_heartbeat_pg)
+_SO_DONG_MOI_INSERT = 1000
+def _obd_row(device_id: str, payload: DeviceHeartbeatModel) -> dict:
+    return {"device_id": device_id, "timestamp": _thoi_diem_csdl(payload.timestamp), "fuel_level": payload.obd_data.fuel_level, "rpm": payload.obd_data.rpm, "speed": payload.obd_data.speed, "error_codes": ",".join(payload.obd_data.error_codes) if payload.obd_data.error_codes else None}
+
+def _vi_tri_moi_nhat(items: List[tuple]) -> List[dict]:
+    """Gộp các heartbeat thành MỘT vị trí mới nhất cho mỗi thiết bị (hoà thì lấy bản đến sau)."""
+    moi_nhat = {}
+    for device_id, payload in items:
+        ts = _thoi_diem_csdl(payload.timestamp)
+        if device_id not in moi_nhat or ts >= moi_nhat[device_id]["last_seen"]:
+            moi_nhat[device_id] = {"device_id": device_id, "last_lat": payload.location.lat, "last_lon": payload.location.lon, "last_seen": ts}
+    return list(moi_nhat.values())
+
+def _tom_tat_canh_bao(payloads: List[DeviceHeartbeatModel]) -> List[DeviceHeartbeatModel]:
+    """
+    Gộp các lần đọc của MỘT thiết bị thành tối đa 2 heartbeat đại diện cho việc xét cảnh báo:
+    lần nhiên liệu thấp mới nhất, và lần có mã lỗi mới nhất (kèm hợp tất cả mã lỗi trong lô).
+    """
+    theo_thoi_gian = sorted(payloads, key=lambda p: _thoi_diem_csdl(p.timestamp))
+    dai_dien = []
+    thap = [p for p in theo_thoi_gian if p.obd_data.fuel_level is not None and p.obd_data.fuel_level < LOW_FUEL_THRESHOLD]
+    if thap:
+        p = thap[-1]
+        dai_dien.append(DeviceHeartbeatModel(timestamp=p.timestamp, location=p.location, obd_data=OBDDataModel(fuel_level=p.obd_data.fuel_level)))
+    co_loi = [p for p in theo_thoi_gian if p.obd_data.error_codes]
+    if co_loi:
+        cac_ma = list(dict.fromkeys(ma for p in co_loi for ma in p.obd_data.error_codes))
+        p = co_loi[-1]
+        dai_dien.append(DeviceHeartbeatModel(timestamp=p.timestamp, location=p.location, obd_data=OBDDataModel(error_codes=cac_ma)))
+    return dai_dien
+
+async def ghi_lo_heartbeat(db: AsyncSession, items: List[tuple], gop_canh_bao: bool = False) -> List[dict]:
+    """
+    Ghi một lô (device_id, DeviceHeartbeatModel) trong MỘT transaction:
+    upsert vị trí (đã gộp theo thiết bị) + INSERT nhiều dòng obd_logs + việc xét cảnh báo (alert_jobs).
+    `gop_canh_bao=True`: xét cảnh báo trên cả lô (tối đa 1 cảnh báo mỗi loại/thiết bị) thay vì từng lần đọc.
+    Trả về các vị trí đã ghi. Người gọi commit rồi gọi alert_workers.notify() và phat_vi_tri().
+    """
+    vi_tri = _vi_tri_moi_nhat(items)
+    if not LA_SQLITE: return await _ghi_lo_heartbeat_pg(db, items, vi_tri, gop_canh_bao)
+    for i in range(0, len(vi_tri), _SO_DONG_MOI_INSERT):
+        stmt_loc = sqlite_insert(device_locations_table).values(vi_tri[i:i + _SO_DONG_MOI_INSERT])
+        stmt_loc = stmt_loc.on_conflict_do_update(index_elements=["device_id"], set_={"last_lat": stmt_loc.excluded.last_lat, "last_lon": stmt_loc.excluded.last_lon, "last_seen": stmt_loc.excluded.last_seen})
+        await db.execute(stmt_loc)
+    obd_rows = [_obd_row(device_id, payload) for device_id, payload in items]
+    for i in range(0, len(obd_rows), _SO_DONG_MOI_INSERT):
+        await db.execute(obd_logs_table.insert().values(obd_rows[i:i + _SO_DONG_MOI_INSERT]))
+    jobs = _viec_xet_canh_bao(items, gop_canh_bao)
+    for i in range(0, len(jobs), _SO_DONG_MOI_INSERT):
+        await db.execute(alert_jobs_table.insert().values(jobs[i:i + _SO_DONG_MOI_INSERT]))
+    return vi_tri
+
+def _viec_xet_canh_bao(items: List[tuple], gop_canh_bao: bool) -> List[dict]:
+    if gop_canh_bao:
+        theo_thiet_bi = {}
+        for device_id, payload in items: theo_thiet_bi.setdefault(device_id, []).append(payload)
+        items = [(device_id, p) for device_id, payloads in theo_thiet_bi.items() for p in _tom_tat_canh_bao(payloads)]
+    return [{"device_id": device_id, "timestamp": _thoi_diem_csdl(p.timestamp), "lat": p.location.lat, "lon": p.location.lon,
+             "fuel_level": p.obd_data.fuel_level, "error_codes": ",".join(p.obd_data.error_codes) if p.obd_data.error_codes else None}
+            for device_id, p in items if _can_xet_canh_bao(p)]
+
+# Postgres: INSERT nhiều dòng bằng unnest() của các mảng tham số. Câu SQL KHÔNG phụ thuộc số dòng nên lô
+# 1 hay 500 heartbeat dùng chung MỘT prepared statement của asyncpg (VALUES (...), (...) sinh một câu mới,
+# parse + plan lại, cho mỗi kích thước lô), và mỗi mảng chỉ là một tham số nên không cần chia khúc.
+_SQL_UPSERT_VI_TRI_PG = text("""
+INSERT INTO device_locations (device_id, last_lat, last_lon, last_seen)
+SELECT * FROM unnest(CAST(:device_id AS VARCHAR[]), CAST(:last_lat AS DOUBLE PRECISION[]), CAST(:last_lon AS DOUBLE PRECISION[]), CAST(:last_seen AS TIMESTAMP[]))
+ON CONFLICT (device_id) DO UPDATE SET last_lat = EXCLUDED.last_lat, last_lon = EXCLUDED.last_lon, last_seen = EXCLUDED.last_seen
+""")
+_SQL_GHI_OBD_PG = text("""
+INSERT INTO obd_logs (device_id, timestamp, fuel_level, rpm, speed, error_codes)
+SELECT * FROM unnest(CAST(:device_id AS VARCHAR[]), CAST(:timestamp AS TIMESTAMP[]), CAST(:fuel_level AS DOUBLE PRECISION[]),
+                     CAST(:rpm AS BIGINT[]), CAST(:speed AS BIGINT[]), CAST(:error_codes AS VARCHAR[]))
+""")
+_SQL_GHI_VIEC_PG = text("""
+INSERT INTO alert_jobs (device_id, timestamp, lat, lon, fuel_level, error_codes)
+SELECT * FROM unnest(CAST(:device_id AS VARCHAR[]), CAST(:timestamp AS TIMESTAMP[]), CAST(:lat AS DOUBLE PRECISION[]),
+                     CAST(:lon AS DOUBLE PRECISION[]), CAST(:fuel_level AS DOUBLE PRECISION[]), CAST(:error_codes AS VARCHAR[]))
+""")
+
+def _theo_cot(rows: List[dict]) -> dict:
+    return {cot: [row[cot] for row in rows] for cot in rows[0]}
 
+async def _ghi_lo_heartbeat_pg(db: AsyncSession, items: List[tuple], vi_tri: List[dict], gop_canh_bao: bool) -> List[dict]:
+    if not items: return vi_tri
+    await db.execute(_SQL_UPSERT_VI_TRI_PG, _theo_cot(vi_tri))
+    await db.execute(_SQL_GHI_OBD_PG, _theo_cot([_obd_row(device_id, payload) for device_id, payload in items]))
+    jobs = _viec_xet_canh_bao(items, gop_canh_bao)
+    if jobs: await db.execute(_SQL_GHI_VIEC_PG, _theo_cot(jobs))
+    return vi_tri
+
+def _can_xet_canh_bao(payload: DeviceHeartbeatModel) -> bool:
+    fuel = payload.obd_data.fuel_level
+    return bool(payload.obd_data.error_codes) or (fuel is not None and fuel < LOW_FUEL_THRESHOLD)
+
+async def _flush_heartbeat(items: List[tuple]) -> None:
+    async with AsyncSessionLocal() as db:
+        try:
+            vi_tri = await ghi_lo_heartbeat(db, items)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+    alert_workers.notify()
+    phat_vi_tri(vi_tri)
+
+heartbeat_buffer = WriteBehindBuffer(
+    _flush_heartbeat,
+    max_batch=settings.INGEST_FLUSH_MAX_ROWS,
+    flush_interval=settings.INGEST_FLUSH_INTERVAL_MS / 1000,
+    max_queue=settings.INGEST_MAX_QUEUE,
+    backoff_max=settings.INGEST_RETRY_BACKOFF_MAX_SECONDS,
+)
+
+# --- 4d. WORKER XÉT CẢNH BÁO (đọc alert_jobs) ---
+# SQLite không có FOR UPDATE SKIP LOCKED: chỉ chạy MỘT worker, và transaction mở bằng BEGIN IMMEDIATE
+# (sqlite_bolt.GHI_NGAY) giữ khoá ghi từ lúc nhận việc
+_SQL_KHOA_VIEC = "" if LA_SQLITE else "FOR UPDATE SKIP LOCKED"
+_SQL_HEN_THU_LAI = "datetime('now', '+' || :delay || ' seconds')" if LA_SQLITE else "NOW() + make_interval(secs => :delay)"
+
+async def _xu_ly_lo_alert_jobs() -> int:
+    """
+    Nhận tối đa ALERT_WORKER_BATCH_SIZE việc (FOR UPDATE SKIP LOCKED: nhiều worker/tiến trình
+    không nhận trùng), xét cảnh báo cho từng việc trong một SAVEPOINT riêng rồi xoá việc.
+    Việc lỗi được hẹn thử lại với thời gian chờ tăng dần cho tới ALERT_JOB_MAX_ATTEMPTS lần.
+    """
+    stmt_claim = text(f"""
+    SELECT id, device_id, timestamp, lat, lon, fuel_level, error_codes, attempts FROM alert_jobs
+    WHERE attempts < :max_attempts AND next_attempt_at <= NOW()
+    ORDER BY id LIMIT :limit {_SQL_KHOA_VIEC}
+    """)
+    stmt_done = text("DELETE FROM alert_jobs WHERE id = :id")
+    stmt_retry = text(f"UPDATE alert_jobs SET attempts = attempts + 1, next_attempt_at = {_SQL_HEN_THU_LAI}, last_error = :error WHERE id = :id")
+    cac_canh_bao = []
+    async with AsyncSessionLocal() as db:
+        # Chỉ có tác dụng với SQLite (Postgres bỏ qua execution option lạ)
+        await db.connection(execution_options={sqlite_bolt.GHI_NGAY: True})
+        jobs = (await db.execute(stmt_claim, {"max_attempts": settings.ALERT_JOB_MAX_ATTEMPTS, "limit": settings.ALERT_WORKER_BATCH_SIZE})).fetchall()
+        for job in jobs:
+            payload = DeviceHeartbeatModel(
+                timestamp=job.timestamp, location=LocationModel(lat=job.lat, lon=job.lon),
+                obd_data=OBDDataModel(fuel_level=job.fuel_level, error_codes=job.error_codes.split(",") if job.error_codes else []))
+            try:
+                async with db.begin_nested():
+                    canh_bao = await db.run_sync(_trigger_proactive_alerts, job.device_id, payload)
+                    await db.execute(stmt_done, {"id": job.id})
+                cac_canh_bao.extend(canh_bao)
+                ALERT_JOBS_TOTAL.labels("ok").inc()
+            except Exception as e:
+                logger.warning("Xét cảnh báo thất bại: %s", e, extra={"job_id": job.id, "attempt": job.attempts + 1, "device_id": job.device_id})
+                ALERT_JOBS_TOTAL.labels("loi").inc()
+                await db.execute(stmt_retry, {"id": job.id, "delay": float(min(2 ** job.attempts, 300)), "error": str(e)[:500]})
+        await db.commit()
+    # Chỉ phát sau khi commit: người nghe không bao giờ thấy cảnh báo đã bị rollback
+    for canh_bao in cac_canh_bao: phat_su_kien(canh_bao["device_id"], {"type": "alert", "alert": canh_bao})
+    return len(jobs)
+
+alert_workers = AlertWorkerPool(
+    _xu_ly_lo_alert_jobs,
+    concurrency=1 if LA_SQLITE else settings.ALERT_WORKER_CONCURRENCY,
+    poll_interval=settings.ALERT_WORKER_POLL_SECONDS,
+)
+
+# --- 4e. BẢO TRÌ obd_logs (phân vùng, lưu trữ, rollup) ---
+# Khoá advisory: chỉ một worker/tiến trình bảo trì tại một thời điểm
+_KHOA_BAO_TRI_OBD = 7200009
+
+def _rollup_obd(conn, nguon: str, dieu_kien: str, params: dict) -> None:
+    """Cộng dồn dữ liệu thô từ `nguon` vào obd_rollup_minute và obd_rollup_hour."""
+    for do_chi_tiet in ("minute", "hour"):
+        cot_chon, cot_gop = [], []
+        for chi_so in ("fuel_level", "rpm", "speed"):
+            cot_chon += [f"COALESCE(SUM({chi_so}), 0)", f"COUNT({chi_so})", f"MIN({chi_so})", f"MAX({chi_so})"]
+            cot_gop += [f"{chi_so}_sum = t.{chi_so}_sum + EXCLUDED.{chi_so}_sum", f"{chi_so}_count = t.{chi_so}_count + EXCLUDED.{chi_so}_count",
+                        f"{chi_so}_min = LEAST(t.{chi_so}_min, EXCLUDED.{chi_so}_min)", f"{chi_so}_max = GREATEST(t.{chi_so}_max, EXCLUDED.{chi_so}_max)"]
+        conn.execute(text(f"""
+        INSERT INTO obd_rollup_{do_chi_tiet} AS t
+        SELECT device_id, date_trunc('{do_chi_tiet}', timestamp), COUNT(*), {", ".join(cot_chon)}
+        FROM {nguon} WHERE {dieu_kien} GROUP BY 1, 2
+        ON CONFLICT (device_id, bucket) DO UPDATE SET samples = t.samples + EXCLUDED.samples, {", ".join(cot_gop)}
+        """), params)
+
+def bao_tri_obd_logs() -> dict:
+    """
+    Tạo trước phân vùng cho kỳ hiện tại + OBD_PARTITIONS_AHEAD kỳ tới; với các phân vùng quá
+    OBD_RETENTION_DAYS thì tổng hợp vào bảng rollup rồi xoá, trong cùng một transaction.
+    """
+    with engine.begin() as conn:
+        if LA_SQLITE: return _bao_tri_obd_sqlite(conn)
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:khoa)"), {"khoa": _KHOA_BAO_TRI_OBD}).scalar():
+            return {"skipped": True}
+        hien_tai = conn.execute(text("SELECT LOCALTIMESTAMP")).scalar()
+        da_tao = partitions_bolt.dam_bao_phan_vung(conn, "obd_logs", "timestamp", settings.OBD_PARTITION_INTERVAL, hien_tai, settings.OBD_PARTITIONS_AHEAD)
+        da_xoa = []
+        if settings.OBD_RETENTION_DAYS > 0:
+            moc = hien_tai - datetime.timedelta(days=settings.OBD_RETENTION_DAYS)
+            da_xoa = partitions_bolt.het_han_phan_vung(conn, "obd_logs", "timestamp", moc, _rollup_obd)
+    return {"skipped": False, "created": da_tao, "dropped": da_xoa}
+
+def _bao_tri_obd_sqlite(conn) -> dict:
+    """SQLite không có phân vùng: dòng thô quá OBD_RETENTION_DAYS được rollup rồi xoá bằng DELETE."""
+    if settings.OBD_RETENTION_DAYS <= 0: return {"skipped": False, "created": [], "dropped": [], "deleted_rows": 0}
+    hien_tai = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)  # Cùng chuẩn UTC với NOW() của sqlite_bolt
+    params = {"moc": hien_tai - datetime.timedelta(days=settings.OBD_RETENTION_DAYS)}
+    _rollup_obd(conn, "obd_logs", "timestamp < :moc", params)
+    da_xoa = conn.execute(text("DELETE FROM obd_logs WHERE timestamp < :moc"), params).rowcount
+    return {"skipped": False, "created": [], "dropped": [], "deleted_rows": da_xoa}
+
+async def _bao_tri_obd_dinh_ky(chu_ky: int):
+    while True:
+        await asyncio.sleep(chu_ky)
+        try: await asyncio.to_thread(bao_tri_obd_logs)
+        except Exception as e: logger.error("Không thể bảo trì obd_logs: %s", e)
+
+# --- 4f. HUB SỰ KIỆN REALTIME (WebSocket/SSE) ---
+# Topic "fleet" nhận mọi sự kiện; "device:<id>" chỉ nhận sự kiện của một thiết bị.
+# Sự kiện chỉ được phát SAU khi dữ liệu tương ứng đã commit.
+event_hub = PubSubHub(max_queue=settings.PUBSUB_SUBSCRIBER_QUEUE_SIZE, max_subscribers=settings.PUBSUB_MAX_SUBSCRIBERS)
+
+def phat_su_kien(device_id: str, event: dict) -> None:
+    event_hub.publish(("fleet", f"device:{device_id}"), jsonable_encoder({**event, "device_id": device_id}))
+
+def phat_vi_tri(vi_tri: List[dict]) -> None:
+    for v in vi_tri:
+        phat_su_kien(v["device_id"], {"type": "location", "last_lat": v["last_lat"], "last_lon": v["last_lon"], "last_seen": v["last_seen"]})
+
+def _topics_theo_doi(device_id: Optional[str]) -> List[str]:
+    return [f"device:{device_id}"] if device_id else ["fleet"]
+
+def _dang_ky_nghe(topics: List[str]):
+    sub = event_hub.subscribe(topics)
+    if sub is None: raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Đã đủ số kết nối realtime tối đa, vui lòng thử lại sau.")
+    return sub
+
+async def _luong_sse(sub):
+    """Chuyển sự kiện của `sub` thành luồng Server-Sent Events; gửi comment keep-alive khi rảnh."""
+    try:
+        while True:
+            event = await sub.get(timeout=settings.PUBSUB_KEEPALIVE_SECONDS)
+            if event is None: yield ": keep-alive\n\n"; continue
+            dong_id = f"id: {event['seq']}\n" if "seq" in event else ""
+            yield f"{dong_id}event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    finally:
+        sub.close()
+
+def _phan_hoi_sse(sub) -> StreamingResponse:
+    return StreamingResponse(_luong_sse(sub), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _phat_websocket(websocket: WebSocket, sub) -> None:
+    """Đẩy sự kiện qua WebSocket cho tới khi client ngắt kết nối (tin nhắn từ client bị bỏ qua)."""
+    async def cho_ngat_ket_noi():
+        while (await websocket.receive())["type"] != "websocket.disconnect": pass
+    ngat = asyncio.create_task(cho_ngat_ket_noi())
+    try:
+        while True:
+            lay = asyncio.create_task(sub.get(timeout=settings.PUBSUB_KEEPALIVE_SECONDS))
+            await asyncio.wait({lay, ngat}, return_when=asyncio.FIRST_COMPLETED)
+            if ngat.done(): lay.cancel(); return
+            await websocket.send_text(json.dumps(lay.result() or {"type": "keep-alive"}, ensure_ascii=False))
+    except WebSocketDisconnect: pass
+    finally:
+        ngat.cancel()
+        sub.close()
+
+# --- 4g. SỐ LIỆU ĐO (Prometheus, GET /metrics) ---
+# Số liệu chỉ của tiến trình hiện tại: chạy nhiều worker uvicorn thì Prometheus scrape mỗi worker
+# (hoặc cộng dồn theo nhãn instance). Các bộ đếm sẵn có trong stats() được đọc lúc scrape, không đếm lại.
+metrics = Registry()
+HTTP_REQUEST_SECONDS = metrics.histogram("bolt_http_request_duration_seconds", "Thời gian xử lý request HTTP theo route", ("method", "route", "status"))
+HTTP_IN_PROGRESS = metrics.gauge("bolt_http_requests_in_progress", "Số request HTTP đang xử lý (gồm cả stream SSE đang mở)")
+DB_STATEMENT_SECONDS = metrics.histogram("bolt_db_statement_duration_seconds", "Thời gian thực thi câu lệnh SQL theo loại lệnh và bảng", ("engine", "statement", "table"))
+DB_ERRORS_TOTAL = metrics.counter("bolt_db_errors_total", "Số câu lệnh SQL lỗi", ("engine",))
+DB_POOL_WAIT_SECONDS = metrics.histogram("bolt_db_pool_wait_seconds", "Thời gian chờ lấy kết nối từ pool CSDL", ("engine",), moc=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0))
+DB_POOL_TIMEOUTS_TOTAL = metrics.counter("bolt_db_pool_timeouts_total", "Số lần hết DB_POOL_TIMEOUT_SECONDS mà không lấy được kết nối", ("engine",))
+DB_CONNECTIONS_OPENED_TOTAL = metrics.counter("bolt_db_connections_opened_total", "Số kết nối CSDL mới được mở (tăng đều = pool quá nhỏ hoặc kết nối bị recycle/cắt)", ("engine",))
+BCRYPT_VERIFY_SECONDS = metrics.histogram("bolt_bcrypt_verify_seconds", "Thời gian kiểm tra API key bằng bcrypt (cache xác thực trượt)", moc=(0.01, 0.025, 0.05, 0.1, 0.2, 0.35, 0.5, 1.0, 2.5))
+ALERTS_TOTAL = metrics.counter("bolt_alerts_total", "Cảnh báo đã ghi theo loại; ket_qua=moi (dòng mới) hoặc gop (tăng occurrence_count)", ("alert_type", "ket_qua"))
+ALERT_JOBS_TOTAL = metrics.counter("bolt_alert_jobs_total", "Việc xét cảnh báo đã xử lý theo kết quả", ("ket_qua",))
+OBD_EXPORT_ROWS_TOTAL = metrics.counter("bolt_obd_export_rows_total", "Số dòng obd_logs đã xuất qua /admin/obd/export", ("format",))
+HEARTBEATS_TOTAL = metrics.counter("bolt_heartbeats_total", "Heartbeat đã nhận theo đường ghi (buffer = xác nhận trước, ghi theo lô sau)", ("duong",))
+
+def _so_lieu_pool():
+    for ten, eng in (("sync", engine), ("async", async_engine)):
+        pool = eng.pool
+        # NullPool/StaticPool không có các số đếm này
+        for trang_thai, ham in (("checked_out", "checkedout"), ("idle", "checkedin"), ("overflow", "overflow"), ("size", "size")):
+            # QueuePool.overflow() bắt đầu từ -pool_size: chỉ phần vượt pool_size mới là kết nối tràn
+            if hasattr(pool, ham): yield ten, trang_thai, max(0, getattr(pool, ham)())
+
+metrics.callback("bolt_db_pool_connections", "Kết nối trong pool CSDL theo trạng thái", "gauge", _so_lieu_pool, ("engine", "state"))
+metrics.callback("bolt_heartbeat_buffer_queue_depth", "Số heartbeat đang chờ ghi trong bộ đệm", "gauge", lambda: [(heartbeat_buffer.queue_depth,)])
+metrics.callback("bolt_heartbeat_buffer_flushed_total", "Heartbeat đã ghi xuống CSDL từ bộ đệm", "counter", lambda: [(heartbeat_buffer.flushed,)])
+metrics.callback("bolt_heartbeat_buffer_rejected_total", "Heartbeat bị từ chối vì bộ đệm đầy", "counter", lambda: [(heartbeat_buffer.rejected,)])
+metrics.callback("bolt_heartbeat_buffer_dropped_total", "Heartbeat bị bỏ vì lỗi dữ liệu (CSDL không nhận) sau khi thử lại", "counter", lambda: [(heartbeat_buffer.dropped,)])
+metrics.callback("bolt_heartbeat_buffer_last_flush_seconds", "Thời gian ghi lô heartbeat gần nhất", "gauge", lambda: [(heartbeat_buffer.last_flush_ms / 1000,)])
+metrics.callback("bolt_alert_worker_errors_total", "Lỗi của vòng worker cảnh báo", "counter", lambda: [(alert_workers.errors,)])
+metrics.callback("bolt_pubsub_subscribers", "Người nghe SSE/WebSocket đang kết nối", "gauge", lambda: [(event_hub.subscribers,)])
+metrics.callback("bolt_pubsub_dropped_total", "Sự kiện bị bỏ vì người nghe chậm", "counter", lambda: [(event_hub.dropped,)])
+metrics.callback("bolt_cache_hits_total", "Số lần trúng cache", "counter", lambda: [(ten, c.hits) for ten, c in _cac_cache()], ("cache",))
+metrics.callback("bolt_cache_misses_total", "Số lần trượt cache", "counter", lambda: [(ten, c.misses) for ten, c in _cac_cache()], ("cache",))
+
+def _cac_cache():
+    return (("device_auth", device_auth_cache), ("alert_suppression", alert_suppression), ("diem_dich_vu_search", diem_search_cache))
+
+_MAU_BANG_SQL = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=2048)
+def _phan_loai_cau_lenh(statement: str) -> tuple:
+    """(lệnh, bảng) của một câu SQL, VD ("SELECT", "user_alerts"): nhãn có số giá trị giới hạn thay vì cả câu SQL."""
+    tu = statement.lstrip().split(None, 1)
+    lenh = tu[0].upper() if tu else "?"
+    bang = _MAU_BANG_SQL.search(statement)
+    return lenh, bang.group(1).lower() if bang else "-"
+
+def _gan_do_thoi_gian_sql(eng, ten: str) -> None:
+    @event.listens_for(eng, "before_cursor_execute")
+    def _truoc(conn, cursor, statement, parameters, context, executemany):
+        context._bolt_bat_dau = time.perf_counter()
+
+    @event.listens_for(eng, "after_cursor_execute")
+    def _sau(conn, cursor, statement, parameters, context, executemany):
+        bat_dau = getattr(context, "_bolt_bat_dau", None)
+        if bat_dau is not None: DB_STATEMENT_SECONDS.labels(ten, *_phan_loai_cau_lenh(statement)).observe(time.perf_counter() - bat_dau)
+
+    @event.listens_for(eng, "handle_error")
+    def _loi(exception_context):
+        DB_ERRORS_TOTAL.labels(ten).inc()
+
+def _gan_do_pool(eng, ten: str) -> None:
+    cho, het_han = DB_POOL_WAIT_SECONDS.labels(ten), DB_POOL_TIMEOUTS_TOTAL.labels(ten)
+    def khi_cho(giay: float, la_het_han: bool):
+        cho.observe(giay)
+        if la_het_han: het_han.inc()
+    # Chỉ pool tạo bởi pool_bolt (Postgres) mới đo được thời gian chờ
+    if hasattr(type(eng.pool), "khi_cho"): type(eng.pool).khi_cho = khi_cho
+
+    @event.listens_for(eng, "connect")
+    def _mo_ket_noi(dbapi_conn, connection_record):
+        DB_CONNECTIONS_OPENED_TOTAL.labels(ten).inc()
+
+if settings.METRICS_ENABLED:
+    _gan_do_thoi_gian_sql(engine, "sync")
+    _gan_do_thoi_gian_sql(async_engine.sync_engine, "async")
+    _gan_do_pool(engine, "sync")
+    _gan_do_pool(async_engine.sync_engine, "async")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # ... (Logic lifespan giữ nguyên)
-    print("API đang khởi động... kết nối tới PostgreSQL...")
+    logger.info("API đang khởi động... kết nối tới PostgreSQL...")
     try:
-        with engine.begin() as conn: metadata.create_all(conn)
+        with engine.begin() as conn: metadata.create_all(conn); nang_cap_schema(conn); tao_chi_muc_con_thieu(conn)
         with SessionLocal() as db: seed_initial_data(db)
-    except Exception as e: print(f"LỖI NGHIÊM TRỌNG KHI KẾT NỐI/KHỞI TẠO CSDL: {e}")
-    yield; print("Máy chủ đang tắt...")
+        logger.info("Bảo trì obd_logs: %s", bao_tri_obd_logs())
+    except Exception as e: logger.critical("LỖI NGHIÊM TRỌNG KHI KẾT NỐI/KHỞI TẠO CSDL: %s", e)
+    cac_tac_vu_nen = []
+    if settings.OBD_MAINTENANCE_INTERVAL_SECONDS > 0:
+        cac_tac_vu_nen.append(asyncio.create_task(_bao_tri_obd_dinh_ky(settings.OBD_MAINTENANCE_INTERVAL_SECONDS)))
+    if settings.SPATIAL_INDEX_ENABLED:
+        try: logger.info("Đã nạp %d điểm dịch vụ vào chỉ mục không gian.", nap_chi_muc_khong_gian())
+        except Exception as e: logger.error("Không thể nạp chỉ mục, dùng truy vấn SQL: %s", e)
+        if settings.SPATIAL_INDEX_REFRESH_SECONDS > 0:
+            cac_tac_vu_nen.append(asyncio.create_task(_lam_moi_chi_muc_dinh_ky(settings.SPATIAL_INDEX_REFRESH_SECONDS)))
+    if settings.INGEST_BUFFER_ENABLED: heartbeat_buffer.start()
+    if settings.ALERT_WORKER_ENABLED: alert_workers.start()
+    yield
+    for tac_vu in cac_tac_vu_nen: tac_vu.cancel()
+    # Ghi nốt các heartbeat còn trong bộ đệm trước khi đóng kết nối CSDL
+    if heartbeat_buffer.running:
+        await heartbeat_buffer.drain(settings.INGEST_DRAIN_TIMEOUT_SECONDS)
+        logger.info("Đã ghi nốt bộ đệm heartbeat: %s", heartbeat_buffer.stats())
+    # Việc chưa xử lý vẫn nằm trong alert_jobs và được nhận lại ở lần khởi động sau
+    await alert_workers.stop()
+    await async_engine.dispose()
+    logger.info("Máy chủ đang tắt...")
 
 # --- 5. APP (ĐÃ CẬP NHẬT) ---
 app = FastAPI(
@@ -161,25 +895,101 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+@app.exception_handler(RequestValidationError)
+async def loi_kiem_tra_request(request: Request, exc: RequestValidationError):
+    """
+    Như handler mặc định của FastAPI, nhưng giá trị NaN/Infinity trong body (json.loads vẫn nhận) được trả lại
+    dạng null: handler mặc định render chúng bị lỗi nên request thành 500 thay vì 422.
+    """
+    # json chuẩn (không dùng orjson): giá trị gửi lên có thể là số nguyên vượt 64 bit
+    return JSONResponse({"detail": json_bolt.bo_so_khong_huu_han(jsonable_encoder(exc.errors()))}, status_code=422)
+
 # --- 6. CẤU HÌNH CORS (Giữ nguyên) ---
 origins = ["*"]
 app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+# Đo thời gian theo route (thêm sau CORS nên bao ngoài cùng, tính cả thời gian của các middleware khác)
+if settings.METRICS_ENABLED:
+    app.add_middleware(PrometheusMiddleware, histogram=HTTP_REQUEST_SECONDS, dang_xu_ly=HTTP_IN_PROGRESS, bo_qua=("/metrics",))
 
 # --- 7. CÔNG THỨC HAVERSINE (Giữ nguyên) ---
+# POWER thay cho toán tử ^ (chỉ Postgres có); với SQLite các hàm toán học do sqlite_bolt đăng ký
 HAVERSINE_SQL = """( 6371 * 2 * ASIN( SQRT(
-    SIN((RADIANS(vi_do) - RADIANS(:user_lat)) / 2) ^ 2 +
+    POWER(SIN((RADIANS(vi_do) - RADIANS(:user_lat)) / 2), 2) +
     COS(RADIANS(:user_lat)) * COS(RADIANS(vi_do)) *
-    SIN((RADIANS(kinh_do) - RADIANS(:user_lon)) / 2) ^ 2
+    POWER(SIN((RADIANS(kinh_do) - RADIANS(:user_lon)) / 2), 2)
 )))"""
 
-# --- 8. BẢO MẬT (Device - Giữ nguyên) ---
-async def get_current_device(x_device_id: str = Header(...), x_api_key: str = Header(...), db: Session = Depends(get_db)) -> str:
-    stmt = text("SELECT api_key_hash FROM devices WHERE id = :device_id")
-    result = db.execute(stmt, {"device_id": x_device_id}).fetchone()
+# Các cột của diem_dich_vu (= các trường của DiemDichVuResponseModel trừ khoảng cách)
+_COT_DIEM_DICH_VU = ("id", "ten", "loai", "dia_chi", "vi_do", "kinh_do")
+_SQL_COT_DIEM_DICH_VU = ", ".join(_COT_DIEM_DICH_VU)
+
+# Bán kính khởi đầu của vòng tìm "gần nhất" theo hộp mở rộng (mỗi vòng x4)
+BAN_KINH_TIM_GAN_NHAT_BAN_DAU_KM = 5.0
+# /tim-diem-gan-nhat/theo-loai: các loại mặc định (cây xăng, trạm sạc, gara) và số loại tối đa mỗi request
+LOAI_DIEM_GAN_NHAT_MAC_DINH = ["xang_dau", "tram_sac", "sua_chua"]
+MAX_LOAI_DIEM_GAN_NHAT = 20
+
+def _dieu_kien_hop_bao(params: dict, vi_do: float, kinh_do: float, ban_kinh_km: float) -> str:
+    """
+    Sinh điều kiện WHERE theo hộp vĩ độ/kinh độ (dùng được chỉ mục) chứa trọn vòng tròn
+    bán kính, để Haversine chỉ phải tính trên các dòng còn lại.
+    """
+    lat_min, lat_max, cac_khoang_lon = bounding_box(vi_do, kinh_do, ban_kinh_km)
+    params.update({"bb_lat_min": lat_min, "bb_lat_max": lat_max})
+    dieu_kien = "vi_do BETWEEN :bb_lat_min AND :bb_lat_max"
+    if cac_khoang_lon == [(-180.0, 180.0)]: return dieu_kien
+    dk_lon = []
+    for i, (lon_min, lon_max) in enumerate(cac_khoang_lon):
+        params[f"bb_lon_min_{i}"], params[f"bb_lon_max_{i}"] = lon_min, lon_max
+        dk_lon.append(f"kinh_do BETWEEN :bb_lon_min_{i} AND :bb_lon_max_{i}")
+    return f"{dieu_kien} AND ({' OR '.join(dk_lon)})"
+
+# --- 8. BẢO MẬT (Device) ---
+# Cache xác thực: key = (device_id, HMAC-SHA256 của API key đã gửi).
+# Bí mật HMAC chỉ sống trong tiến trình nên cache không bao giờ giữ API key dạng rõ.
+# Chỉ lưu các lần xác thực THÀNH CÔNG; key sai luôn phải đi qua bcrypt.
+_AUTH_CACHE_SECRET = secrets.token_bytes(32)
+device_auth_cache = TTLCache(max_size=settings.AUTH_CACHE_MAX_SIZE, ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS)
+
+def _device_auth_cache_key(device_id: str, api_key: str) -> tuple:
+    digest = hmac.new(_AUTH_CACHE_SECRET, api_key.encode("utf-8"), hashlib.sha256).digest()
+    return (device_id, digest)
+
+def invalidate_device_credentials(device_id: str) -> int:
+    """
+    Xoá mọi mục cache của một thiết bị. Phải gọi mỗi khi api_key_hash thay đổi.
+    (Mỗi worker uvicorn có cache riêng; TTL giới hạn độ trễ ở các worker khác.)
+    """
+    return device_auth_cache.invalidate_where(lambda key: key[0] == device_id)
+
+_SQL_XAC_THUC = text("SELECT api_key_hash FROM devices WHERE id = :device_id")
+
+async def _xac_thuc_thiet_bi(device_id: str, api_key: str, db: AsyncSession) -> str:
+    cache_key = _device_auth_cache_key(device_id, api_key)
+    if device_auth_cache.get(cache_key): return device_id
+    result = (await db.execute(_SQL_XAC_THUC, {"device_id": device_id})).fetchone()
     if not result: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device ID not registered")
     stored_hash = result[0]
-    if not pwd_context.verify(x_api_key, stored_hash): raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API Key")
-    return x_device_id
+    # Kết thúc transaction đọc trước khi chờ bcrypt: không giữ snapshot/khoá đọc (SQLite) trong lúc đó
+    await db.rollback()
+    # bcrypt tốn hàng chục ms CPU: đẩy sang threadpool để không chặn event loop
+    bat_dau = time.perf_counter()
+    hop_le = await run_in_threadpool(pwd_context.verify, api_key, stored_hash)
+    BCRYPT_VERIFY_SECONDS.observe(time.perf_counter() - bat_dau)
+    if not hop_le: raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API Key")
+    device_auth_cache.set(cache_key, True)
+    return device_id
+
+async def get_current_device(x_device_id: str = Header(...), x_api_key: str = Header(...), db: AsyncSession = Depends(get_async_db)) -> str:
+    return await _xac_thuc_thiet_bi(x_device_id, x_api_key, db)
+
+async def xac_thuc_thiet_bi_ngan(device_id: str, api_key: str) -> str:
+    """
+    Xác thực bằng session riêng, đóng ngay sau khi kiểm tra: dùng cho các kết nối
+    sống lâu (SSE/WebSocket) để không giữ một kết nối CSDL suốt thời gian stream.
+    """
+    async with AsyncSessionLocal() as db:
+        return await _xac_thuc_thiet_bi(device_id, api_key, db)
 
 # --- 8b. BẢO MẬT ADMIN (v0.15.0) ---
 async def get_admin_access(x_admin_api_key: str = Header(...)):
@@ -199,46 +1009,362 @@ async def get_admin_access(x_admin_api_key: str = Header(...)):
 
 # --- 9 & 10. HÀM LOGIC NỘI BỘ & AI TRIGGER (Giữ nguyên) ---
 def _tim_diem_gan_nhat_logic(db: Session, vi_do: float, kinh_do: float, loai_diem: Optional[str] = None) -> Optional[dict]:
-    # ... (Toàn bộ logic _tim_diem_gan_nhat_logic giữ nguyên)
-    params = {"user_lat": vi_do, "user_lon": kinh_do}
-    base_query = f"SELECT *, {HAVERSINE_SQL} AS khoang_cach_km FROM diem_dich_vu"
-    where_clause = ""
-    if loai_diem: where_clause = " WHERE loai = :loai"; params["loai"] = loai_diem
-    query = text(f"{base_query} {where_clause} ORDER BY khoang_cach_km ASC LIMIT 1")
+    if diem_dich_vu_index.ready:
+        ket_qua = diem_dich_vu_index.nearest(vi_do, kinh_do, loai=loai_diem, k=1)
+        return ket_qua[0] if ket_qua else None
+    # Hộp mở rộng dần: chỉ quét các điểm quanh xe, vòng cuối (toàn cầu) mới bỏ hộp
+    ban_kinh = BAN_KINH_TIM_GAN_NHAT_BAN_DAU_KM
     try:
-        result = db.execute(query, params).fetchone()
-        if not result: return None
+        while True:
+            vong_cuoi = ban_kinh >= NUA_CHU_VI_KM
+            params = {"user_lat": vi_do, "user_lon": kinh_do, "radius": 2 * NUA_CHU_VI_KM if vong_cuoi else ban_kinh}
+            dieu_kien = [] if vong_cuoi else [_dieu_kien_hop_bao(params, vi_do, kinh_do, ban_kinh)]
+            if loai_diem: dieu_kien.insert(0, "loai = :loai"); params["loai"] = loai_diem
+            where_clause = f" WHERE {' AND '.join(dieu_kien)}" if dieu_kien else ""
+            query = text(f"SELECT * FROM (SELECT *, {HAVERSINE_SQL} AS khoang_cach_km FROM diem_dich_vu{where_clause}) AS subquery WHERE khoang_cach_km <= :radius ORDER BY khoang_cach_km ASC LIMIT 1")
+            result = db.execute(query, params).fetchone()
+            if result: break
+            if vong_cuoi: return None
+            ban_kinh = min(ban_kinh * 4, NUA_CHU_VI_KM)
         ket_qua = dict(result._mapping); ket_qua['khoang_cach_km'] = round(ket_qua['khoang_cach_km'], 2)
         return ket_qua
-    except Exception as e: print(f"--- [LỖI LOGIC] Lỗi khi tìm điểm gần nhất (nội bộ): {e} ---"); return None
+    except Exception as e: logger.error("Lỗi khi tìm điểm gần nhất (nội bộ): %s", e); return None
+
+def _tim_diem_gan_nhat_theo_loai(db: Session, vi_do: float, kinh_do: float, cac_loai: List[str]) -> dict:
+    """
+    Điểm gần nhất cho từng loại trong `cac_loai` bằng MỘT lần tìm: một lần duyệt chỉ mục,
+    hoặc mỗi vòng hộp mở rộng là một truy vấn (ROW_NUMBER theo loai) cho mọi loại còn thiếu.
+    Trả về {loai: diem hoặc None}.
+    """
+    cac_loai = list(dict.fromkeys(cac_loai))
+    if diem_dich_vu_index.ready: return diem_dich_vu_index.nearest_by_loai(vi_do, kinh_do, cac_loai)
+    ket_qua = dict.fromkeys(cac_loai)
+    ban_kinh = BAN_KINH_TIM_GAN_NHAT_BAN_DAU_KM
+    con_lai = cac_loai
+    try:
+        while con_lai:
+            vong_cuoi = ban_kinh >= NUA_CHU_VI_KM
+            params = {"user_lat": vi_do, "user_lon": kinh_do, "radius": 2 * NUA_CHU_VI_KM if vong_cuoi else ban_kinh, "cac_loai": con_lai}
+            dieu_kien = ["loai IN :cac_loai"] + ([] if vong_cuoi else [_dieu_kien_hop_bao(params, vi_do, kinh_do, ban_kinh)])
+            # ROW_NUMBER thay cho DISTINCT ON (chỉ Postgres có) để chạy được cả trên SQLite
+            query = text(f"""
+            SELECT {_SQL_COT_DIEM_DICH_VU}, khoang_cach_km FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY loai ORDER BY khoang_cach_km ASC, id) AS thu_tu
+                FROM (SELECT *, {HAVERSINE_SQL} AS khoang_cach_km FROM diem_dich_vu WHERE {' AND '.join(dieu_kien)}) AS subquery
+                WHERE khoang_cach_km <= :radius
+            ) AS xep_hang WHERE thu_tu = 1
+            """).bindparams(bindparam("cac_loai", expanding=True))
+            for row in db.execute(query, params).fetchall():
+                diem = dict(row._mapping); diem['khoang_cach_km'] = round(diem['khoang_cach_km'], 2)
+                ket_qua[diem['loai']] = diem
+            con_lai = [] if vong_cuoi else [loai for loai in con_lai if ket_qua[loai] is None]
+            ban_kinh = min(ban_kinh * 4, NUA_CHU_VI_KM)
+    except Exception as e: logger.error("Lỗi khi tìm điểm gần nhất theo loại (nội bộ): %s", e)
+    return ket_qua
+
+# Lần phát cuối (theo giờ thiết bị) của từng (device_id, alert_type, dedupe_key) trong tiến trình này.
+# Trúng cửa sổ chặn thì chỉ tăng bộ đếm của cảnh báo CHƯA ĐỌC, bỏ qua cả việc tìm trạm gần nhất.
+# Map chỉ là lối tắt: kết quả giống hệt ở mọi worker vì chỉ mục unique ux_user_alerts_unread_dedupe
+# quyết định gộp hay tạo mới (cảnh báo đã đọc thì lần lặp sau là cảnh báo mới).
+alert_suppression = TTLCache(max_size=settings.ALERT_SUPPRESSION_MAX_KEYS, ttl_seconds=settings.ALERT_SUPPRESSION_WINDOW_SECONDS)
 
-def _trigger_proactive_alerts(db: Session, device_id: str, payload: DeviceHeartbeatModel):
-    # ... (Toàn bộ logic _trigger_proactive_alerts giữ nguyên)
+_COT_CANH_BAO = "alert_id, device_id, timestamp, alert_type, message, is_read, occurrence_count, last_seen"
+# Phải chạy CÙNG transaction với mọi thay đổi trên user_alerts của thiết bị
+SQL_TANG_PHIEN_BAN_CANH_BAO = text("UPDATE devices SET alert_version = alert_version + 1 WHERE id = :device_id")
+
+def _ghi_canh_bao(db: Session, device_id: str, alert_type: AlertType, dedupe_key: str, timestamp: datetime.datetime, tao_message) -> Optional[dict]:
+    """
+    Ghi (hoặc gộp) một cảnh báo và trả về dòng cảnh báo sau khi ghi (None nếu không ghi gì).
+    `tao_message()` chỉ được gọi khi thực sự cần nội dung mới; trả về None nghĩa là không có gì để cảnh báo.
+    """
+    khoa = (device_id, alert_type.value, dedupe_key)
+    timestamp = _thoi_diem_csdl(timestamp)
+    lan_cuoi = alert_suppression.get(khoa)
+    if lan_cuoi is not None and abs((timestamp - lan_cuoi).total_seconds()) < settings.ALERT_SUPPRESSION_WINDOW_SECONDS:
+        # Tối đa một dòng chưa đọc mỗi khoá (ux_user_alerts_unread_dedupe); không có thì ghi mới như bình thường
+        stmt_bump = text(f"""
+        UPDATE user_alerts SET occurrence_count = occurrence_count + 1, last_seen = GREATEST(last_seen, :timestamp)
+        WHERE device_id = :device_id AND alert_type = :alert_type AND dedupe_key = :dedupe_key AND is_read = false
+        RETURNING {_COT_CANH_BAO}
+        """)
+        row = db.execute(stmt_bump, {"device_id": device_id, "alert_type": alert_type.value, "dedupe_key": dedupe_key, "timestamp": timestamp}).fetchone()
+        if row:
+            db.execute(SQL_TANG_PHIEN_BAN_CANH_BAO, {"device_id": device_id})
+            ALERTS_TOTAL.labels(alert_type.value, "gop").inc()
+            logger.debug("Gộp cảnh báo lặp", extra={"device_id": device_id, "alert_type": alert_type.value, "dedupe_key": dedupe_key})
+            return dict(row._mapping)
+    msg = tao_message()
+    if not msg: return None
+    stmt_upsert = text(f"""
+    INSERT INTO user_alerts (alert_id, device_id, timestamp, alert_type, message, is_read, dedupe_key, occurrence_count, last_seen)
+    VALUES (:alert_id, :device_id, :timestamp, :alert_type, :message, false, :dedupe_key, 1, :timestamp)
+    ON CONFLICT (device_id, alert_type, dedupe_key) WHERE is_read = false
+    DO UPDATE SET occurrence_count = user_alerts.occurrence_count + 1, last_seen = GREATEST(user_alerts.last_seen, EXCLUDED.last_seen)
+    RETURNING {_COT_CANH_BAO}, (alert_id = :alert_id) AS la_moi
+    """)
+    # Dòng mới giữ alert_id vừa sinh; dòng gộp giữ alert_id cũ (thay cho xmax = 0, chỉ Postgres có)
+    row = db.execute(stmt_upsert, {"alert_id": uuid.uuid4(), "device_id": device_id, "timestamp": timestamp, "alert_type": alert_type.value, "message": msg, "dedupe_key": dedupe_key}).fetchone()
+    db.execute(SQL_TANG_PHIEN_BAN_CANH_BAO, {"device_id": device_id})
+    alert_suppression.set(khoa, timestamp)
+    canh_bao = dict(row._mapping)
+    la_moi = canh_bao.pop("la_moi")
+    ALERTS_TOTAL.labels(alert_type.value, "moi" if la_moi else "gop").inc()
+    logger.debug("Đã lưu cảnh báo", extra={"device_id": device_id, "alert_type": alert_type.value, "dedupe_key": dedupe_key, "la_moi": la_moi})
+    return canh_bao
+
+def _trigger_proactive_alerts(db: Session, device_id: str, payload: DeviceHeartbeatModel) -> List[dict]:
+    """
+    Xét và lưu cảnh báo cho một heartbeat; trả về các cảnh báo đã ghi (để phát realtime sau khi commit).
+    Chạy trong worker nền (_xu_ly_lo_alert_jobs): lỗi được ném ra để worker hẹn thử lại
+    thay vì lặng lẽ bỏ qua cảnh báo.
+    Cảnh báo lặp lại được gộp theo (thiết bị, loại, mã lỗi) thay vì chèn dòng mới.
+    """
+    da_ghi = []
     vi_tri_xe = payload.location
-    stmt_insert_alert = text("INSERT INTO user_alerts (alert_id, device_id, timestamp, alert_type, message, is_read) VALUES (:alert_id, :device_id, :timestamp, :alert_type, :message, false)")
+    fuel = payload.obd_data.fuel_level
+    nhien_lieu_thap = fuel is not None and fuel < LOW_FUEL_THRESHOLD
+    error_codes = list(dict.fromkeys(payload.obd_data.error_codes or []))
+    # Tìm trạm gần nhất lười (chỉ khi có cảnh báo mới cần nội dung) và một lần cho mọi loại cần dùng:
+    # vừa nhiên liệu thấp vừa có mã lỗi thì trạm xăng và gara được tìm chung một lượt
+    cac_loai_can = (["xang_dau"] if nhien_lieu_thap else []) + (["sua_chua"] if error_codes else [])
+    diem_gan_nhat = {}
+    def tim_diem(loai: str) -> Optional[dict]:
+        if not diem_gan_nhat: diem_gan_nhat.update(_tim_diem_gan_nhat_theo_loai(db, vi_tri_xe.lat, vi_tri_xe.lon, cac_loai_can))
+        return diem_gan_nhat.get(loai)
     # Fuel check
+    if nhien_lieu_thap:
+        logger.debug("Phát hiện nhiên liệu thấp", extra={"device_id": device_id, "fuel_level": fuel})
+        def msg_nhien_lieu():
+            tram_xang = tim_diem("xang_dau")
+            if tram_xang: return f"Nhiên liệu thấp ({fuel}%)! Trạm xăng gần nhất: {tram_xang.get('ten')} (cách {tram_xang.get('khoang_cach_km')} km)."
+        da_ghi.append(_ghi_canh_bao(db, device_id, AlertType.LOW_FUEL, "", payload.timestamp, msg_nhien_lieu))
+    # Error code check: mỗi mã lỗi là một cảnh báo riêng để chặn lặp theo từng mã
+    if error_codes:
+        logger.debug("Phát hiện mã lỗi động cơ", extra={"device_id": device_id, "error_codes": error_codes})
+        for code in error_codes:
+            def msg_ma_loi(code=code):
+                gara = tim_diem("sua_chua")
+                if gara: return f"Phát hiện Mã lỗi ({code})! Gara gần nhất: {gara.get('ten')} (cách {gara.get('khoang_cach_km')} km)."
+            da_ghi.append(_ghi_canh_bao(db, device_id, AlertType.ERROR_CODE, code, payload.timestamp, msg_ma_loi))
+    return [canh_bao for canh_bao in da_ghi if canh_bao]
+
+# --- 10b. ETAG / LONG-POLL CHO DANH SÁCH CẢNH BÁO ---
+# ETag = devices.alert_version. Kiểm tra phiên bản chỉ là một lần đọc theo khoá chính,
+# rẻ hơn nhiều so với truy vấn + serialize toàn bộ danh sách cảnh báo.
+async def _doc_phien_ban_canh_bao(db: AsyncSession, device_id: str) -> int:
+    phien_ban = (await db.execute(text("SELECT alert_version FROM devices WHERE id = :device_id"), {"device_id": device_id})).scalar()
+    # Kết thúc transaction đọc để trả kết nối về pool (quan trọng khi đang long-poll)
+    await db.rollback()
+    return phien_ban or 0
+
+def _etag_canh_bao(phien_ban: int) -> str:
+    return f'"alerts-{phien_ban}"'
+
+def _etag_khop(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match: return False
+    cac_tag = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in cac_tag or etag in (tag[2:] if tag.startswith("W/") else tag for tag in cac_tag)
+
+async def _cho_phien_ban_moi(db: AsyncSession, device_id: str, phien_ban: int, wait: float) -> int:
+    """
+    Giữ request tới khi alert_version khác `phien_ban` hoặc hết `wait` giây. Thức dậy ngay khi
+    hub phát sự kiện cảnh báo của thiết bị (cùng tiến trình), và kiểm tra lại CSDL mỗi
+    ALERT_LONG_POLL_RECHECK_SECONDS để thấy thay đổi từ tiến trình khác. Không giữ kết nối CSDL khi chờ.
+    """
+    loop = asyncio.get_running_loop()
+    han = loop.time() + min(wait, settings.ALERT_LONG_POLL_MAX_SECONDS)
+    # Đăng ký TRƯỚC khi đọc lại phiên bản: không lỡ sự kiện xảy ra giữa hai bước
+    sub = event_hub.subscribe(_topics_theo_doi(device_id), max_queue=8)
     try:
-        fuel = payload.obd_data.fuel_level
-        if fuel is not None and fuel < LOW_FUEL_THRESHOLD:
-            print(f"--- [AI Phân tích] Phát hiện nhiên liệu thấp ({fuel}%) cho {device_id} ---")
-            tram_xang = _tim_diem_gan_nhat_logic(db=db, vi_do=vi_tri_xe.lat, kinh_do=vi_tri_xe.lon, loai_diem="xang_dau")
-            if tram_xang:
-                msg = f"Nhiên liệu thấp ({fuel}%)! Trạm xăng gần nhất: {tram_xang.get('ten')} (cách {tram_xang.get('khoang_cach_km')} km)."
-                db.execute(stmt_insert_alert, {"alert_id": uuid.uuid4(), "device_id": device_id, "timestamp": payload.timestamp, "alert_type": AlertType.LOW_FUEL, "message": msg})
-                print("--- [AI CẢNH BÁO] Đã lưu cảnh báo Nhiên liệu thấp vào CSDL. ---")
-    except Exception as e: print(f"--- [LỖI AI] Lỗi khi xử lý cảnh báo nhiên liệu: {e} ---")
-    # Error code check
+        phien_ban_moi = await _doc_phien_ban_canh_bao(db, device_id)
+        while phien_ban_moi == phien_ban and (con_lai := han - loop.time()) > 0:
+            cho = min(con_lai, settings.ALERT_LONG_POLL_RECHECK_SECONDS)
+            if sub is None: await asyncio.sleep(cho)
+            else:
+                event = await sub.get(timeout=cho)
+                # Vị trí không đổi danh sách cảnh báo: chờ tiếp mà không cần đọc CSDL
+                if event is not None and event["type"] == "location": continue
+            phien_ban_moi = await _doc_phien_ban_canh_bao(db, device_id)
+        return phien_ban_moi
+    finally:
+        if sub is not None: sub.close()
+
+# --- 10c. PHÂN TRANG KEYSET ---
+# Cursor là giá trị khoá sắp xếp của dòng cuối trang trước (mã hoá base64url, client coi như chuỗi mờ).
+# Trang kế tiếp được đọc bằng so sánh (khoá) < / > cursor trên chỉ mục, nên chi phí mỗi trang
+# không phụ thuộc vào việc trang nằm sâu tới đâu (khác với OFFSET).
+def _ma_hoa_cursor(*gia_tri) -> str:
+    return base64.urlsafe_b64encode(json.dumps(gia_tri, default=str).encode("utf-8")).decode("ascii").rstrip("=")
+
+def _giai_ma_cursor(cursor: str, *kieu) -> list:
     try:
-        error_codes = payload.obd_data.error_codes
-        if error_codes:
-            codes_str = ", ".join(error_codes)
-            print(f"--- [AI Phân tích] Phát hiện Mã lỗi Động cơ ({codes_str}) cho {device_id} ---")
-            gara = _tim_diem_gan_nhat_logic(db=db, vi_do=vi_tri_xe.lat, kinh_do=vi_tri_xe.lon, loai_diem="sua_chua")
-            if gara:
-                msg = f"Phát hiện Mã lỗi ({codes_str})! Gara gần nhất: {gara.get('ten')} (cách {gara.get('khoang_cach_km')} km)."
-                db.execute(stmt_insert_alert, {"alert_id": uuid.uuid4(), "device_id": device_id, "timestamp": payload.timestamp, "alert_type": AlertType.ERROR_CODE, "message": msg})
-                print("--- [AI CẢNH BÁO] Đã lưu cảnh báo Mã lỗi vào CSDL. ---")
-    except Exception as e: print(f"--- [LỖI AI] Lỗi khi xử lý cảnh báo mã lỗi: {e} ---")
+        gia_tri = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if len(gia_tri) != len(kieu): raise ValueError(cursor)
+        return [chuyen(x) for chuyen, x in zip(kieu, gia_tri)]
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor không hợp lệ.")
+
+def _dat_trang_ke_tiep(request: Request, response: Response, next_cursor: Optional[str]) -> None:
+    """Trang kế tiếp được báo qua header (giữ nguyên body dạng danh sách cho các client cũ)."""
+    if next_cursor is None: return
+    response.headers["X-Next-Cursor"] = next_cursor
+    response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+
+# Hai dạng cố định (trang đầu / có cursor): cùng một câu SQL mỗi lần gọi, asyncpg dùng lại prepared statement
+_SQL_CANH_BAO_CHUA_DOC = {co_cursor: text(f"""
+SELECT {_COT_CANH_BAO} FROM user_alerts WHERE device_id = :device_id AND is_read = false
+{"AND (timestamp, alert_id) < (:cursor_ts, :cursor_id)" if co_cursor else ""}
+ORDER BY timestamp DESC, alert_id DESC LIMIT :limit
+""") for co_cursor in (False, True)}
+
+async def _tra_canh_bao_chua_doc(db: AsyncSession, device_id: str, request: Request, response: Response, if_none_match: Optional[str],
+                                 wait: float, cursor: Optional[str], limit: int):
+    params = {"device_id": device_id, "limit": limit + 1}
+    if cursor: params["cursor_ts"], params["cursor_id"] = _giai_ma_cursor(cursor, datetime.datetime.fromisoformat, uuid.UUID)
+    try:
+        # Đọc phiên bản TRƯỚC danh sách: nếu có cảnh báo chen vào giữa, lần poll sau sẽ thấy phiên bản mới
+        phien_ban = await _doc_phien_ban_canh_bao(db, device_id)
+        if _etag_khop(if_none_match, _etag_canh_bao(phien_ban)) and wait > 0:
+            phien_ban = await _cho_phien_ban_moi(db, device_id, phien_ban, wait)
+        etag = _etag_canh_bao(phien_ban)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if _etag_khop(if_none_match, etag): return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        result = (await db.execute(_SQL_CANH_BAO_CHUA_DOC[bool(cursor)], params)).fetchall()
+    except Exception as e: raise HTTPException(status_code=500, detail=f"Lỗi truy vấn CSDL: {e}")
+    response.headers.update(headers)
+    trang = result[:limit]
+    _dat_trang_ke_tiep(request, response, _ma_hoa_cursor(trang[-1].timestamp, trang[-1].alert_id) if len(result) > limit else None)
+    # _COT_CANH_BAO khớp các trường của UserAlertResponse: trả thẳng, không validate lại từng dòng
+    return tra_json([row._asdict() for row in trang], response)
+
+# --- 10d. ĐÁNH DẤU ĐÃ ĐỌC HÀNG LOẠT ---
+async def _danh_dau_da_doc_hang_loat(db: AsyncSession, dieu_kien: DeviceAlertBulkReadModel, device_id: Optional[str]) -> int:
+    """
+    Đánh dấu đã đọc mọi cảnh báo chưa đọc khớp điều kiện bằng MỘT câu UPDATE, tăng alert_version
+    của các thiết bị bị ảnh hưởng trong cùng câu lệnh, rồi phát một sự kiện "alerts_read" mỗi thiết bị.
+    """
+    if dieu_kien.alert_ids is not None and len(dieu_kien.alert_ids) > settings.ALERT_BULK_READ_MAX_IDS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Tối đa {settings.ALERT_BULK_READ_MAX_IDS} alert_id mỗi request.")
+    loc, params = ["is_read = false"], {}
+    if device_id is not None: loc.append("device_id = :device_id"); params["device_id"] = device_id
+    if dieu_kien.alert_ids is not None: loc.append("alert_id IN :alert_ids" if LA_SQLITE else "alert_id = ANY(:alert_ids)"); params["alert_ids"] = dieu_kien.alert_ids
+    if dieu_kien.alert_type is not None: loc.append("alert_type = :alert_type"); params["alert_type"] = dieu_kien.alert_type.value
+    if dieu_kien.older_than is not None: loc.append("timestamp < :older_than"); params["older_than"] = _thoi_diem_csdl(dieu_kien.older_than)
+    stmt = text(f"""
+    WITH da_doc AS (
+        UPDATE user_alerts SET is_read = true WHERE {" AND ".join(loc)} RETURNING device_id
+    ), theo_thiet_bi AS (
+        SELECT device_id, COUNT(*) AS so_luong FROM da_doc GROUP BY device_id
+    ), tang_phien_ban AS (
+        UPDATE devices SET alert_version = alert_version + 1 WHERE id IN (SELECT device_id FROM theo_thiet_bi)
+    )
+    SELECT device_id, so_luong FROM theo_thiet_bi
+    """)
+    try:
+        if LA_SQLITE: theo_thiet_bi = await _danh_dau_da_doc_sqlite(db, loc, params)
+        else: theo_thiet_bi = {row.device_id: row.so_luong for row in (await db.execute(stmt, params)).fetchall()}
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi cập nhật cảnh báo: {e}")
+    for device_id, so_luong in theo_thiet_bi.items(): phat_su_kien(device_id, {"type": "alerts_read", "count": so_luong})
+    return sum(theo_thiet_bi.values())
+
+async def _danh_dau_da_doc_sqlite(db: AsyncSession, loc: List[str], params: dict) -> Dict[str, int]:
+    """SQLite không cho UPDATE trong WITH: đánh dấu đã đọc rồi tăng alert_version bằng hai câu lệnh cùng transaction."""
+    stmt = text(f"UPDATE user_alerts SET is_read = true WHERE {' AND '.join(loc)} RETURNING device_id")
+    if "alert_ids" in params: stmt = stmt.bindparams(bindparam("alert_ids", expanding=True))
+    theo_thiet_bi = {}
+    for row in (await db.execute(stmt, params)).fetchall(): theo_thiet_bi[row.device_id] = theo_thiet_bi.get(row.device_id, 0) + 1
+    if theo_thiet_bi:
+        stmt_tang = text("UPDATE devices SET alert_version = alert_version + 1 WHERE id IN :cac_id").bindparams(bindparam("cac_id", expanding=True))
+        await db.execute(stmt_tang, {"cac_id": list(theo_thiet_bi)})
+    return theo_thiet_bi
+
+# --- 10e. CACHE KẾT QUẢ TÌM ĐIỂM DỊCH VỤ (theo ô geohash) ---
+# Mỗi mục cache giữ TẬP ỨNG VIÊN đủ cho mọi vị trí trong một ô geohash (tìm quanh tâm ô với bán kính
+# nới thêm bán kính ô), rồi lọc + sắp xếp lại chính xác theo toạ độ thật của request: kết quả giống hệt
+# khi không có cache. Mọi lần ghi diem_dich_vu gọi bump(); các worker khác thấy điểm mới sau tối đa TTL.
+diem_search_cache = VersionedTTLCache(max_size=settings.DIEM_CACHE_MAX_SIZE, ttl_seconds=settings.DIEM_CACHE_TTL_SECONDS)
+
+def _lay_cac_diem_xung_quanh(db: Session, vi_do: float, kinh_do: float, ban_kinh_km: float, loai_diem: Optional[str]) -> List[dict]:
+    if diem_dich_vu_index.ready: return diem_dich_vu_index.radius(vi_do, kinh_do, ban_kinh_km, loai=loai_diem)
+    params = {"user_lat": vi_do, "user_lon": kinh_do, "radius": ban_kinh_km}; inner_query = f"SELECT {_SQL_COT_DIEM_DICH_VU}, {HAVERSINE_SQL} AS khoang_cach_km FROM diem_dich_vu"
+    where_clause = f" WHERE {_dieu_kien_hop_bao(params, vi_do, kinh_do, ban_kinh_km)}"
+    if loai_diem: where_clause += " AND loai = :loai"; params["loai"] = loai_diem
+    query = text(f"SELECT * FROM ({inner_query} {where_clause}) AS subquery WHERE khoang_cach_km <= :radius ORDER BY khoang_cach_km ASC")
+    try: result = db.execute(query, params).fetchall(); ket_qua = [dict(row._mapping) for row in result]; [d.update({'khoang_cach_km': round(d['khoang_cach_km'], 2)}) for d in ket_qua]; return ket_qua
+    except Exception as e: raise HTTPException(status_code=500, detail=f"Lỗi truy vấn CSDL: {e}")
+
+def _loc_chinh_xac(ung_vien: List[dict], vi_do: float, kinh_do: float, ban_kinh_km: Optional[float] = None) -> List[dict]:
+    """Tính lại khoảng cách từ đúng toạ độ truy vấn, bỏ điểm ngoài bán kính, sắp xếp như chỉ mục (khoảng cách, id)."""
+    ket_qua = []
+    for diem in ung_vien:
+        kc = haversine_km(vi_do, kinh_do, diem["vi_do"], diem["kinh_do"])
+        if ban_kinh_km is None or kc <= ban_kinh_km: ket_qua.append((kc, diem))
+    ket_qua.sort(key=lambda x: (x[0], x[1]["id"]))
+    return [{**diem, "khoang_cach_km": round(kc, 2)} for kc, diem in ket_qua]
+
+def _bo_khoang_cach(cac_diem: List[dict]) -> List[dict]:
+    return [{k: v for k, v in diem.items() if k != "khoang_cach_km"} for diem in cac_diem]
+
+def _cac_diem_xung_quanh_co_cache(db: Session, vi_do: float, kinh_do: float, ban_kinh_km: float, loai_diem: Optional[str]) -> List[dict]:
+    # Đọc phiên bản TRƯỚC khi truy vấn: nếu có lần ghi chen giữa, mục này mang phiên bản cũ và bị bỏ qua
+    phien_ban = diem_search_cache.version
+    # Khoá theo mức bán kính (không theo số thực gửi lên): mỗi ô geohash chỉ có vài mục cache
+    muc = next((m for m in sorted(settings.DIEM_CACHE_RADIUS_BUCKETS_KM) if ban_kinh_km <= m), None)
+    if muc is None: return _lay_cac_diem_xung_quanh(db, vi_do, kinh_do, ban_kinh_km, loai_diem)
+    ma_o, tam_lat, tam_lon, ban_kinh_o = o_geohash(vi_do, kinh_do, settings.DIEM_CACHE_GEOHASH_PRECISION)
+    key = (phien_ban, "xung_quanh", ma_o, muc, loai_diem)
+    ung_vien = diem_search_cache.get(key)
+    if ung_vien is None:
+        # Mọi điểm cách truy vấn <= r (<= mức) thì cách tâm ô <= mức + bán kính ô
+        ung_vien = _bo_khoang_cach(_lay_cac_diem_xung_quanh(db, tam_lat, tam_lon, muc + ban_kinh_o, loai_diem))
+        if len(ung_vien) <= settings.DIEM_CACHE_MAX_CANDIDATES: diem_search_cache.set(key, ung_vien)
+    return _loc_chinh_xac(ung_vien, vi_do, kinh_do, ban_kinh_km)
+
+def _tim_diem_gan_nhat_co_cache(db: Session, vi_do: float, kinh_do: float, loai_diem: Optional[str]) -> Optional[dict]:
+    phien_ban = diem_search_cache.version
+    ma_o, tam_lat, tam_lon, ban_kinh_o = o_geohash(vi_do, kinh_do, settings.DIEM_CACHE_GEOHASH_PRECISION)
+    key = (phien_ban, "gan_nhat", ma_o, loai_diem)
+    ung_vien = diem_search_cache.get(key)
+    if ung_vien is None:
+        gan_tam = _tim_diem_gan_nhat_logic(db, tam_lat, tam_lon, loai_diem)
+        # Không cache kết quả rỗng: _tim_diem_gan_nhat_logic cũng trả None khi lỗi CSDL
+        if not gan_tam: return None
+        # Điểm gần nhất của mọi vị trí trong ô cách tâm ô không quá d0 + 2 x bán kính ô
+        d0 = haversine_km(tam_lat, tam_lon, gan_tam["vi_do"], gan_tam["kinh_do"])
+        ung_vien = _bo_khoang_cach(_lay_cac_diem_xung_quanh(db, tam_lat, tam_lon, d0 + 2 * ban_kinh_o, loai_diem)) or _bo_khoang_cach([gan_tam])
+        diem_search_cache.set(key, ung_vien)
+    ket_qua = _loc_chinh_xac(ung_vien, vi_do, kinh_do)
+    return ket_qua[0] if ket_qua else None
+
+# --- 10f. XUẤT obd_logs THEO LUỒNG ---
+_COT_XUAT_OBD = (("id", "int"), ("device_id", "string"), ("timestamp", "timestamp"), ("fuel_level", "float"),
+                 ("rpm", "int"), ("speed", "int"), ("error_codes", "string"))
+
+async def _doc_obd_logs(tu: datetime.datetime, den: Optional[datetime.datetime], device_id: Optional[str]) -> AsyncIterator[List[tuple]]:
+    """
+    Sinh obd_logs trong [tu, den) theo thứ tự (device_id, timestamp, id), mỗi lần một trang OBD_EXPORT_PAGE_ROWS dòng.
+    Mỗi trang được đọc hết rồi đóng session (kết thúc transaction) TRƯỚC khi yield: client đọc chậm không giữ
+    snapshot/khoá trên obd_logs (VACUUM, tách phân vùng, khoá ghi SQLite của bộ đệm heartbeat).
+    Trang sau đọc tiếp từ dòng cuối đã gửi (keyset) trong transaction mới.
+    """
+    dieu_kien = ["timestamp >= :tu"]
+    params = {"tu": _thoi_diem_csdl(tu), "limit": settings.OBD_EXPORT_PAGE_ROWS}
+    if den is not None: dieu_kien.append("timestamp < :den"); params["den"] = _thoi_diem_csdl(den)
+    if device_id is not None: dieu_kien.append("device_id = :device_id"); params["device_id"] = device_id
+    cot = ", ".join(ten for ten, _ in _COT_XUAT_OBD)
+    moc = None
+    while True:
+        dieu_kien_trang = dieu_kien + (["(device_id, timestamp, id) > (:moc_device_id, :moc_timestamp, :moc_id)"] if moc else [])
+        stmt = text(f"SELECT {cot} FROM obd_logs WHERE {' AND '.join(dieu_kien_trang)} ORDER BY device_id, timestamp, id LIMIT :limit")
+        async with AsyncSessionLocal() as db:
+            trang = [tuple(dong) for dong in (await db.execute(stmt, {**params, **(moc or {})})).all()]
+        if not trang: return
+        moc = {"moc_id": trang[-1][0], "moc_device_id": trang[-1][1], "moc_timestamp": trang[-1][2]}
+        yield trang
+        if len(trang) < settings.OBD_EXPORT_PAGE_ROWS: return
 
 # --- 11. API ENDPOINTS (PHASE 1 - Public Maps - Giữ nguyên) ---
 @app.post("/diem-dich-vu", status_code=201, response_model=DiemDichVuInputModel)
@@ -247,62 +1373,125 @@ def them_diem_dich_vu(diem: DiemDichVuInputModel, db: Session = Depends(get_db))
     stmt = text("INSERT INTO diem_dich_vu (id, ten, loai, dia_chi, vi_do, kinh_do) VALUES (:id, :ten, :loai, :dia_chi, :vi_do, :kinh_do) ON CONFLICT (id) DO UPDATE SET ten = EXCLUDED.ten, loai = EXCLUDED.loai, dia_chi = EXCLUDED.dia_chi, vi_do = EXCLUDED.vi_do, kinh_do = EXCLUDED.kinh_do")
     try: db.execute(stmt, diem.dict()); db.commit()
     except Exception as e: db.rollback(); raise HTTPException(status_code=500, detail=f"Lỗi CSDL: {e}")
+    if diem_dich_vu_index.ready: diem_dich_vu_index.upsert(diem.dict())
+    diem_search_cache.bump()
     return diem
 
 @app.get("/cac-diem-xung-quanh", response_model=List[DiemDichVuResponseModel])
-def lay_cac_diem_xung_quanh(vi_do: float, kinh_do: float, ban_kinh_km: float = Query(5.0), loai_diem: Optional[str] = Query(None), db: Session = Depends(get_db)):
-    # ... (Gi getY:g nguyên)
-    params = {"user_lat": vi_do, "user_lon": kinh_do, "radius": ban_kinh_km}; inner_query = f"SELECT *, {HAVERSINE_SQL} AS khoang_cach_km FROM diem_dich_vu"; where_clause = ""
-    if loai_diem: where_clause = " WHERE loai = :loai"; params["loai"] = loai_diem
-    query = text(f"SELECT * FROM ({inner_query} {where_clause}) AS subquery WHERE khoang_cach_km <= :radius ORDER BY khoang_cach_km ASC")
-    try: result = db.execute(query, params).fetchall(); ket_qua = [dict(row._mapping) for row in result]; [d.update({'khoang_cach_km': round(d['khoang_cach_km'], 2)}) for d in ket_qua]; return ket_qua
-    except Exception as e: raise HTTPException(status_code=500, detail=f"Lỗi truy vấn CSDL: {e}")
+def lay_cac_diem_xung_quanh(vi_do: float, kinh_do: float, ban_kinh_km: float = Query(5.0, gt=0, le=settings.DIEM_SEARCH_MAX_RADIUS_KM), loai_diem: Optional[str] = Query(None), db: Session = Depends(get_db)):
+    if settings.DIEM_CACHE_ENABLED: return tra_json(_cac_diem_xung_quanh_co_cache(db, vi_do, kinh_do, ban_kinh_km, loai_diem))
+    return tra_json(_lay_cac_diem_xung_quanh(db, vi_do, kinh_do, ban_kinh_km, loai_diem))
 
 @app.get("/tim-diem-gan-nhat", response_model=DiemDichVuResponseModel)
 def tim_diem_gan_nhat_api(vi_do: float, kinh_do: float, loai_diem: Optional[str] = None, db: Session = Depends(get_db)):
     # ... (Giữ nguyên)
-    diem = _tim_diem_gan_nhat_logic(db, vi_do, kinh_do, loai_diem);
+    if settings.DIEM_CACHE_ENABLED: diem = _tim_diem_gan_nhat_co_cache(db, vi_do, kinh_do, loai_diem)
+    else: diem = _tim_diem_gan_nhat_logic(db, vi_do, kinh_do, loai_diem)
     if not diem: raise HTTPException(status_code=404, detail="Không tìm thấy điểm dịch vụ nào phù hợp.")
     return diem
 
+@app.get("/tim-diem-gan-nhat/theo-loai", response_model=Dict[str, Optional[DiemDichVuResponseModel]])
+def tim_diem_gan_nhat_theo_loai_api(vi_do: float, kinh_do: float, loai_diem: List[str] = Query(LOAI_DIEM_GAN_NHAT_MAC_DINH), db: Session = Depends(get_db)):
+    """Điểm gần nhất của từng loại (mặc định: cây xăng, trạm sạc, gara) trong một lần tìm; loại không có điểm nào trả về null."""
+    if len(loai_diem) > MAX_LOAI_DIEM_GAN_NHAT: raise HTTPException(status_code=400, detail=f"Tối đa {MAX_LOAI_DIEM_GAN_NHAT} loại điểm mỗi lần tìm.")
+    return _tim_diem_gan_nhat_theo_loai(db, vi_do, kinh_do, loai_diem)
+
 # --- 12. API ENDPOINTS (PHASE 2 & 3 - Device Scoped - Giữ nguyên) ---
 @app.post("/device/heartbeat", status_code=status.HTTP_202_ACCEPTED)
-async def device_heartbeat(payload: DeviceHeartbeatModel, device_id: str = Depends(get_current_device), db: Session = Depends(get_db)):
-    # ... (Giữ nguyên)
-    stmt_loc = text("INSERT INTO device_locations (device_id, last_lat, last_lon, last_seen) VALUES (:device_id, :lat, :lon, :timestamp) ON CONFLICT (device_id) DO UPDATE SET last_lat = EXCLUDED.last_lat, last_lon = EXCLUDED.last_lon, last_seen = EXCLUDED.last_seen")
-    stmt_obd = text("INSERT INTO obd_logs (device_id, timestamp, fuel_level, rpm, speed, error_codes) VALUES (:device_id, :timestamp, :fuel_level, :rpm, :speed, :error_codes)")
+async def device_heartbeat(payload: DeviceHeartbeatModel, device_id: str = Depends(get_current_device), db: AsyncSession = Depends(get_async_db)):
+    if heartbeat_buffer.running:
+        # Ghi trễ: xác nhận ngay (202), bản ghi được ghi theo lô ở nền
+        if not heartbeat_buffer.submit((device_id, payload)):
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Bộ đệm heartbeat đã đầy, vui lòng gửi lại sau.")
+        HEARTBEATS_TOTAL.labels("buffer").inc()
+        return {"status": "accepted"}
     try:
-        db.execute(stmt_loc, {"device_id": device_id, "lat": payload.location.lat, "lon": payload.location.lon, "timestamp": payload.timestamp})
-        db.execute(stmt_obd, {"device_id": device_id, "timestamp": payload.timestamp, "fuel_level": payload.obd_data.fuel_level, "rpm": payload.obd_data.rpm, "speed": payload.obd_data.speed, "error_codes": ",".join(payload.obd_data.error_codes) if payload.obd_data.error_codes else None})
-        _trigger_proactive_alerts(db, device_id, payload)
-        db.commit()
-    except Exception as e: db.rollback(); raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi ghi log hoặc cảnh báo: {e}")
+        vi_tri = await ghi_lo_heartbeat(db, [(device_id, payload)])
+        await db.commit()
+    except Exception as e: await db.rollback(); raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi ghi log hoặc cảnh báo: {e}")
+    HEARTBEATS_TOTAL.labels("truc_tiep").inc()
+    alert_workers.notify()
+    phat_vi_tri(vi_tri)
     return {"status": "accepted"}
 
+# Body nhận List[Any] để phần tử sai kiểu chỉ bị từ chối riêng (không thành 422 cả lô): schema phần tử khai báo lại cho OpenAPI
+@app.post("/device/heartbeat/batch", status_code=status.HTTP_200_OK, response_model=HeartbeatBatchResponse,
+          openapi_extra={"requestBody": {"content": {"application/json": {"schema": {
+              "items": {"$ref": "#/components/schemas/DeviceHeartbeatModel"}, "maxItems": settings.HEARTBEAT_BATCH_MAX_ITEMS}}}}})
+async def device_heartbeat_batch(items: List[Any], device_id: str = Depends(get_current_device), db: AsyncSession = Depends(get_async_db)):
+    """
+    Nhận một mảng heartbeat (theo thứ tự) mà thiết bị đã lưu tạm khi mất kết nối.
+    Xác thực một lần, kiểm tra từng phần tử, ghi tất cả phần tử hợp lệ trong MỘT transaction
+    (chỉ vị trí mới nhất được áp vào device_locations) và trả kết quả cho từng phần tử.
+    """
+    if len(items) > settings.HEARTBEAT_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Tối đa {settings.HEARTBEAT_BATCH_MAX_ITEMS} heartbeat mỗi lô.")
+    results, hop_le = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({"index": index, "status": "rejected", "error": "Phần tử phải là object heartbeat"})
+            continue
+        try:
+            hop_le.append((device_id, DeviceHeartbeatModel(**item)))
+            results.append({"index": index, "status": "accepted"})
+        except ValidationError as e:
+            loi = "; ".join(f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors())
+            results.append({"index": index, "status": "rejected", "error": loi})
+    if hop_le:
+        try:
+            vi_tri = await ghi_lo_heartbeat(db, hop_le, gop_canh_bao=True)
+            await db.commit()
+        except Exception as e: await db.rollback(); raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi ghi lô heartbeat: {e}")
+        HEARTBEATS_TOTAL.labels("batch").inc(len(hop_le))
+        alert_workers.notify()
+        phat_vi_tri(vi_tri)
+    return {"accepted": len(hop_le), "rejected": len(items) - len(hop_le), "results": results}
+
 @app.get("/device/location/last", response_model=DeviceLocationResponse)
-async def get_last_device_location(device_id: str = Depends(get_current_device), db: Session = Depends(get_db)):
-    # ... (Giữ nguyên)
+async def get_last_device_location(device_id: str = Depends(get_current_device), db: AsyncSession = Depends(get_async_db)):
     stmt = text("SELECT * FROM device_locations WHERE device_id = :device_id")
-    try: result = db.execute(stmt, {"device_id": device_id}).fetchone()
+    try: result = (await db.execute(stmt, {"device_id": device_id})).fetchone()
     except Exception as e: raise HTTPException(status_code=500, detail=f"Lỗi truy vấn CSDL: {e}")
     if not result: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Không tìm thấy dữ liệu vị trí cho thiết bị này.")
     return dict(result._mapping)
 
-@app.get("/device/alerts", response_model=List[UserAlertResponse])
-def get_device_alerts(device_id: str = Depends(get_current_device), db: Session = Depends(get_db)):
-    # ... (Giữ nguyên)
-    stmt = text("SELECT * FROM user_alerts WHERE device_id = :device_id AND is_read = false ORDER BY timestamp DESC")
-    try: result = db.execute(stmt, {"device_id": device_id}).fetchall(); return [dict(row._mapping) for row in result]
-    except Exception as e: raise HTTPException(status_code=500, detail=f"Lỗi truy vấn CSDL: {e}")
+@app.get("/device/alerts", response_model=List[UserAlertResponse], responses={304: {"description": "Không có thay đổi kể từ ETag đã gửi"}})
+async def get_device_alerts(
+    request: Request,
+    response: Response,
+    wait: float = Query(0, ge=0, description="Giây tối đa giữ request khi ETag chưa đổi (long-poll)"),
+    cursor: Optional[str] = Query(None, description="Giá trị X-Next-Cursor của trang trước"),
+    limit: int = Query(settings.ALERT_PAGE_SIZE_DEFAULT, ge=1, le=settings.ALERT_PAGE_SIZE_MAX),
+    if_none_match: Optional[str] = Header(None),
+    device_id: str = Depends(get_current_device),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Cảnh báo chưa đọc của thiết bị, mới nhất trước, tối đa `limit` mỗi trang; còn trang sau thì
+    response có header X-Next-Cursor (truyền lại qua `cursor`).
+    Gửi lại ETag trong If-None-Match để nhận 304 khi không có gì thay đổi;
+    thêm `wait` để máy chủ giữ request tới khi có thay đổi (hoặc hết thời gian) thay vì poll liên tục.
+    """
+    return await _tra_canh_bao_chua_doc(db, device_id, request, response, if_none_match, wait, cursor, limit)
+
+@app.put("/device/alerts/read", response_model=AlertBulkReadResponse)
+async def mark_alerts_as_read_bulk(data: DeviceAlertBulkReadModel, device_id: str = Depends(get_current_device), db: AsyncSession = Depends(get_async_db)):
+    """
+    Đánh dấu đã đọc nhiều cảnh báo của thiết bị trong một request: theo danh sách alert_ids,
+    loại cảnh báo và/hoặc cũ hơn older_than. Body rỗng ({}) = tất cả cảnh báo chưa đọc của thiết bị.
+    """
+    return {"updated": await _danh_dau_da_doc_hang_loat(db, data, device_id)}
 
 @app.put("/device/alerts/{alert_id}/read", status_code=status.HTTP_204_NO_CONTENT)
-async def mark_alert_as_read(alert_id: uuid.UUID = Path(...), device_id: str = Depends(get_current_device), db: Session = Depends(get_db)):
-    # ... (Giữ nguyên)
+async def mark_alert_as_read(alert_id: uuid.UUID = Path(...), device_id: str = Depends(get_current_device), db: AsyncSession = Depends(get_async_db)):
     stmt = text("UPDATE user_alerts SET is_read = true WHERE alert_id = :alert_id AND device_id = :device_id AND is_read = false")
     try:
-        result = db.execute(stmt, {"alert_id": alert_id, "device_id": device_id}); db.commit()
+        result = await db.execute(stmt, {"alert_id": alert_id, "device_id": device_id})
+        if result.rowcount: await db.execute(SQL_TANG_PHIEN_BAN_CANH_BAO, {"device_id": device_id})
+        await db.commit()
         if result.rowcount == 0: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Không tìm thấy cảnh báo chưa đọc hoặc bạn không có quyền.")
-    except Exception as e: db.rollback(); raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi cập nhật cảnh báo: {e}")
+    except Exception as e: await db.rollback(); raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi cập nhật cảnh báo: {e}")
+    phat_su_kien(device_id, {"type": "alert_read", "alert_id": alert_id})
     return None
 
 # --- 13. API ENDPOINTS (ADMIN v0.15.0) ---
@@ -312,28 +1501,42 @@ async def mark_alert_as_read(alert_id: uuid.UUID = Path(...), device_id: str = D
 @app.get("/admin/devices", 
          response_model=List[DeviceAdminListModel],
          dependencies=[Depends(get_admin_access)])
-async def admin_get_all_devices(db: Session = Depends(get_db)):
+async def admin_get_all_devices(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(settings.DEVICE_PAGE_SIZE_DEFAULT, ge=1, le=settings.DEVICE_PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    [Admin] Lấy danh sách tất cả các thiết bị đã đăng ký trong hạm đội.
+    [Admin] Lấy danh sách các thiết bị đã đăng ký trong hạm đội, theo id tăng dần.
+    Tối đa `limit` mỗi trang; còn trang sau thì response có header X-Next-Cursor.
     """
-    stmt = text("SELECT id, vehicle_make, vehicle_model FROM devices ORDER BY id ASC")
+    params = {"limit": limit + 1}
+    dieu_kien_cursor = ""
+    if cursor:
+        (params["cursor_id"],) = _giai_ma_cursor(cursor, str)
+        dieu_kien_cursor = "WHERE id > :cursor_id"
+    stmt = text(f"SELECT id, vehicle_make, vehicle_model FROM devices {dieu_kien_cursor} ORDER BY id ASC LIMIT :limit")
     try:
-        result = db.execute(stmt).fetchall()
-        return [dict(row._mapping) for row in result]
+        result = (await db.execute(stmt, params)).fetchall()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi CSDL: {e}")
+    trang = result[:limit]
+    _dat_trang_ke_tiep(request, response, _ma_hoa_cursor(trang[-1].id) if len(result) > limit else None)
+    return tra_json([row._asdict() for row in trang], response)
 
 @app.get("/admin/devices/{device_id}/location", 
          response_model=DeviceLocationResponse,
          dependencies=[Depends(get_admin_access)])
-async def admin_get_device_location(device_id: str = Path(...), db: Session = Depends(get_db)):
+async def admin_get_device_location(device_id: str = Path(...), db: AsyncSession = Depends(get_async_db)):
     """
     [Admin] Lấy vị trí cuối cùng của một thiết bị cụ thể.
     (Logic tương tự get_last_device_location nhưng không cần xác thực device)
     """
     stmt = text("SELECT * FROM device_locations WHERE device_id = :device_id")
     try:
-        result = db.execute(stmt, {"device_id": device_id}).fetchone()
+        result = (await db.execute(stmt, {"device_id": device_id})).fetchone()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi truy vấn CSDL: {e}")
     
@@ -344,41 +1547,331 @@ async def admin_get_device_location(device_id: str = Path(...), db: Session = De
 @app.get("/admin/devices/{device_id}/alerts", 
          response_model=List[UserAlertResponse],
          dependencies=[Depends(get_admin_access)])
-def admin_get_device_alerts(device_id: str = Path(...), db: Session = Depends(get_db)):
+async def admin_get_device_alerts(
+    request: Request,
+    response: Response,
+    device_id: str = Path(...),
+    wait: float = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(settings.ALERT_PAGE_SIZE_DEFAULT, ge=1, le=settings.ALERT_PAGE_SIZE_MAX),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    [Admin] Lấy các cảnh báo chưa đọc của một thiết bị cụ thể
+    (phân trang bằng cursor, hỗ trợ ETag/304 và `wait` như /device/alerts).
+    """
+    return await _tra_canh_bao_chua_doc(db, device_id, request, response, if_none_match, wait, cursor, limit)
+
+# Cảnh báo chưa đọc mới nhất của mỗi thiết bị (bí danh a): Postgres dùng LATERAL + LIMIT 1 trên chỉ mục,
+# SQLite không có LATERAL nên đánh số theo thiết bị bằng ROW_NUMBER
+_SQL_CANH_BAO_MOI_NHAT = """
+    LEFT JOIN (
+        SELECT device_id, alert_id, timestamp, alert_type, message, occurrence_count, last_seen,
+               ROW_NUMBER() OVER (PARTITION BY device_id ORDER BY timestamp DESC) AS thu_tu
+        FROM user_alerts WHERE is_read = false
+    ) a ON a.device_id = d.id AND a.thu_tu = 1""" if LA_SQLITE else """
+    LEFT JOIN LATERAL (
+        SELECT alert_id, timestamp, alert_type, message, occurrence_count, last_seen FROM user_alerts
+        WHERE device_id = d.id AND is_read = false ORDER BY timestamp DESC LIMIT 1
+    ) a ON true"""
+
+@app.get("/admin/fleet/snapshot",
+         response_model=FleetSnapshotResponse,
+         dependencies=[Depends(get_admin_access)])
+async def admin_get_fleet_snapshot(
+    device_id_prefix: Optional[str] = Query(None),
+    vehicle_make: Optional[str] = Query(None),
+    has_unread_alerts: Optional[bool] = Query(None),
+    has_location: Optional[bool] = Query(None),
+    limit: int = Query(1000, ge=1),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    [Admin] Lấy các cảnh báo chưa đọc của một thiết bị cụ thể.
+    [Admin] Toàn cảnh hạm đội trong MỘT truy vấn: mỗi thiết bị kèm vị trí cuối,
+    số cảnh báo chưa đọc và cảnh báo chưa đọc mới nhất.
+    Thay cho việc gọi /admin/devices rồi /location + /alerts cho từng thiết bị.
     """
-    stmt = text("SELECT * FROM user_alerts WHERE device_id = :device_id AND is_read = false ORDER BY timestamp DESC")
+    limit = min(limit, settings.FLEET_SNAPSHOT_MAX_LIMIT)
+    dieu_kien = []
+    params = {"limit": limit, "offset": offset}
+    if device_id_prefix:
+        dieu_kien.append("d.id LIKE :device_id_prefix ESCAPE '\\'")
+        params["device_id_prefix"] = device_id_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    if vehicle_make:
+        dieu_kien.append("d.vehicle_make = :vehicle_make"); params["vehicle_make"] = vehicle_make
+    if has_unread_alerts is not None:
+        dieu_kien.append("COALESCE(c.unread_alert_count, 0) > 0" if has_unread_alerts else "COALESCE(c.unread_alert_count, 0) = 0")
+    if has_location is not None:
+        dieu_kien.append("l.device_id IS NOT NULL" if has_location else "l.device_id IS NULL")
+    where = ("WHERE " + " AND ".join(dieu_kien)) if dieu_kien else ""
+    stmt = text(f"""
+    SELECT d.id, d.vehicle_make, d.vehicle_model, l.last_lat, l.last_lon, l.last_seen,
+           COALESCE(c.unread_alert_count, 0) AS unread_alert_count,
+           a.alert_id, a.timestamp, a.alert_type, a.message, a.occurrence_count, a.last_seen AS alert_last_seen,
+           COUNT(*) OVER () AS total
+    FROM devices d
+    LEFT JOIN device_locations l ON l.device_id = d.id
+    LEFT JOIN (SELECT device_id, COUNT(*) AS unread_alert_count FROM user_alerts WHERE is_read = false GROUP BY device_id) c ON c.device_id = d.id
+    {_SQL_CANH_BAO_MOI_NHAT}
+    {where}
+    ORDER BY d.id ASC
+    LIMIT :limit OFFSET :offset
+    """)
     try:
-        result = db.execute(stmt, {"device_id": device_id}).fetchall()
-        return [dict(row._mapping) for row in result]
+        rows = (await db.execute(stmt, params)).fetchall()
+        if not rows and offset:
+            # Trang vượt quá cuối danh sách: vẫn trả về tổng số đúng
+            total = (await db.execute(text(f"""
+            SELECT COUNT(*) FROM devices d
+            LEFT JOIN device_locations l ON l.device_id = d.id
+            LEFT JOIN (SELECT device_id, COUNT(*) AS unread_alert_count FROM user_alerts WHERE is_read = false GROUP BY device_id) c ON c.device_id = d.id
+            {where}
+            """), params)).scalar()
+        else:
+            total = rows[0].total if rows else 0
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi truy vấn CSDL: {e}")
+    devices = []
+    for row in rows:
+        latest_alert = None
+        if row.alert_id:
+            latest_alert = {"alert_id": row.alert_id, "device_id": row.id, "timestamp": row.timestamp, "alert_type": row.alert_type,
+                            "message": row.message, "is_read": False, "occurrence_count": row.occurrence_count, "last_seen": row.alert_last_seen}
+        devices.append({"id": row.id, "vehicle_make": row.vehicle_make, "vehicle_model": row.vehicle_model,
+                        "last_lat": row.last_lat, "last_lon": row.last_lon, "last_seen": row.last_seen,
+                        "unread_alert_count": row.unread_alert_count, "latest_alert": latest_alert})
+    return tra_json({"total": total, "limit": limit, "offset": offset, "devices": devices})
+
+@app.put("/admin/alerts/read",
+         response_model=AlertBulkReadResponse,
+         dependencies=[Depends(get_admin_access)])
+async def admin_mark_alerts_as_read_bulk(data: AdminAlertBulkReadModel, db: AsyncSession = Depends(get_async_db)):
+    """
+    [Admin] Đánh dấu đã đọc hàng loạt theo alert_ids, device_id, alert_type và/hoặc older_than.
+    Phải có ít nhất một điều kiện để tránh vô tình đánh dấu toàn bộ hạm đội.
+    """
+    if data.alert_ids is None and data.device_id is None and data.alert_type is None and data.older_than is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cần ít nhất một điều kiện: alert_ids, device_id, alert_type hoặc older_than.")
+    return {"updated": await _danh_dau_da_doc_hang_loat(db, data, data.device_id)}
 
 @app.put("/admin/alerts/{alert_id}/read", 
          status_code=status.HTTP_204_NO_CONTENT,
          dependencies=[Depends(get_admin_access)])
-async def admin_mark_alert_as_read(alert_id: uuid.UUID = Path(...), db: Session = Depends(get_db)):
+async def admin_mark_alert_as_read(alert_id: uuid.UUID = Path(...), db: AsyncSession = Depends(get_async_db)):
     """
     [Admin] Đánh dấu một cảnh báo bất kỳ là đã đọc.
     (Khác với endpoint của device, hàm này không cần device_id)
     """
-    stmt = text("UPDATE user_alerts SET is_read = true WHERE alert_id = :alert_id AND is_read = false")
+    stmt = text("UPDATE user_alerts SET is_read = true WHERE alert_id = :alert_id AND is_read = false RETURNING device_id")
     try:
-        result = db.execute(stmt, {"alert_id": alert_id})
-        db.commit()
-        if result.rowcount == 0:
+        row = (await db.execute(stmt, {"alert_id": alert_id})).fetchone()
+        if row is not None: await db.execute(SQL_TANG_PHIEN_BAN_CANH_BAO, {"device_id": row.device_id})
+        await db.commit()
+        if row is None:
             # Điều này xảy ra nếu alert_id không tồn tại HOẶC nó đã được đọc
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Không tìm thấy cảnh báo chưa đọc với ID này.")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi cập nhật cảnh báo: {e}")
+    phat_su_kien(row.device_id, {"type": "alert_read", "alert_id": alert_id})
     return None
 
+async def _chep_vao_bang_tam(db: AsyncSession, bang_tam: str, rows: List[tuple]) -> None:
+    """Nạp một khúc vào bảng tạm bằng COPY (asyncpg) thay vì INSERT từng dòng; SQLite: một lần executemany."""
+    cot = ("seq",) + _COT_DIEM_DICH_VU
+    if LA_SQLITE:
+        stmt = text(f"INSERT INTO {bang_tam} ({', '.join(cot)}) VALUES ({', '.join(':' + c for c in cot)})")
+        await db.execute(stmt, [dict(zip(cot, row)) for row in rows])
+        return
+    raw = await (await db.connection()).get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(bang_tam, records=rows, columns=cot)
+
+async def _gop_bang_tam_sqlite(db: AsyncSession, bang_tam: str):
+    """
+    Như câu upsert Postgres của admin_import_diem_dich_vu, cho SQLite (không có DISTINCT ON, xmax,
+    hay INSERT trong WITH): đếm số dòng sẽ thêm/sửa trước, rồi upsert, rồi xoá bảng tạm.
+    """
+    moi_nhat = f"SELECT {_SQL_COT_DIEM_DICH_VU} FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY id ORDER BY seq DESC) AS thu_tu FROM {bang_tam}) AS t WHERE thu_tu = 1"
+    row = (await db.execute(text(f"""
+    SELECT COUNT(*) FILTER (WHERE d.id IS NULL) AS inserted,
+           COUNT(*) FILTER (WHERE d.id IS NOT NULL AND (d.ten, d.loai, d.dia_chi, d.vi_do, d.kinh_do) IS NOT (m.ten, m.loai, m.dia_chi, m.vi_do, m.kinh_do)) AS updated
+    FROM ({moi_nhat}) AS m LEFT JOIN diem_dich_vu d ON d.id = m.id
+    """))).fetchone()
+    await db.execute(text(f"""
+    INSERT INTO diem_dich_vu ({_SQL_COT_DIEM_DICH_VU}) {moi_nhat}
+    ON CONFLICT (id) DO UPDATE SET ten = excluded.ten, loai = excluded.loai, dia_chi = excluded.dia_chi, vi_do = excluded.vi_do, kinh_do = excluded.kinh_do
+    WHERE (diem_dich_vu.ten, diem_dich_vu.loai, diem_dich_vu.dia_chi, diem_dich_vu.vi_do, diem_dich_vu.kinh_do)
+          IS NOT (excluded.ten, excluded.loai, excluded.dia_chi, excluded.vi_do, excluded.kinh_do)
+    """))
+    # Bảng tạm SQLite sống theo kết nối (không có ON COMMIT DROP)
+    await db.execute(text(f"DROP TABLE {bang_tam}"))
+    return row
+
+@app.post("/admin/diem-dich-vu/import",
+          response_model=DiemDichVuImportResponse,
+          dependencies=[Depends(get_admin_access)])
+async def admin_import_diem_dich_vu(request: Request, format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"), db: AsyncSession = Depends(get_async_db)):
+    """
+    [Admin] Nhập hàng loạt điểm dịch vụ từ body CSV (có dòng tiêu đề id,ten,loai,dia_chi,vi_do,kinh_do)
+    hoặc NDJSON. Định dạng lấy từ `format`, hoặc Content-Type (text/csv, application/x-ndjson).
+    Body được đọc theo luồng; từng khúc được kiểm tra bằng DiemDichVuInputModel rồi COPY vào bảng tạm,
+    cuối cùng gộp vào diem_dich_vu bằng MỘT câu upsert trong MỘT transaction.
+    Dòng lỗi được báo lại (kèm số dòng) mà không huỷ cả lô. Chỉ mục không gian được nạp lại một lần ở cuối.
+    """
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "ndjson" if ("ndjson" in content_type or "jsonl" in content_type) else "csv"
+    bang_tam = "diem_dich_vu_nhap"
+    ket_qua = {"received": 0, "accepted": 0, "rejected": 0, "errors": [], "errors_truncated": False}
+
+    def ghi_loi(line: int, error: str):
+        ket_qua["rejected"] += 1
+        if len(ket_qua["errors"]) < settings.DIEM_DICH_VU_IMPORT_MAX_ERRORS: ket_qua["errors"].append({"line": line, "error": error})
+        else: ket_qua["errors_truncated"] = True
+
+    try:
+        # SQLite: khoá ghi ngay từ đầu, bước gộp đọc-rồi-ghi không bị SQLITE_BUSY giữa chừng
+        await db.connection(execution_options={sqlite_bolt.GHI_NGAY: True})
+        await db.execute(text(f"""
+        CREATE TEMP TABLE {bang_tam} (seq BIGINT NOT NULL, id VARCHAR NOT NULL, ten VARCHAR NOT NULL, loai VARCHAR NOT NULL,
+                                      dia_chi VARCHAR, vi_do DOUBLE PRECISION NOT NULL, kinh_do DOUBLE PRECISION NOT NULL) {"" if LA_SQLITE else "ON COMMIT DROP"}
+        """))
+        khuc = []
+        async for line, ban_ghi, loi in import_bolt.doc_ban_ghi(format, request.stream()):
+            ket_qua["received"] += 1
+            if loi: ghi_loi(line, loi); continue
+            try: diem = DiemDichVuInputModel(**ban_ghi)
+            except ValidationError as e:
+                ghi_loi(line, "; ".join(f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors())); continue
+            khuc.append((line, diem.id, diem.ten, diem.loai, diem.dia_chi, diem.vi_do, diem.kinh_do))
+            if len(khuc) >= settings.DIEM_DICH_VU_IMPORT_CHUNK_ROWS:
+                await _chep_vao_bang_tam(db, bang_tam, khuc); ket_qua["accepted"] += len(khuc); khuc = []
+        if khuc: await _chep_vao_bang_tam(db, bang_tam, khuc); ket_qua["accepted"] += len(khuc)
+        # id lặp lại trong file: bản ghi xuất hiện sau cùng được dùng. Dòng không đổi thì không ghi lại.
+        if LA_SQLITE: row = await _gop_bang_tam_sqlite(db, bang_tam)
+        else: row = (await db.execute(text(f"""
+        WITH gop AS (
+            INSERT INTO diem_dich_vu (id, ten, loai, dia_chi, vi_do, kinh_do)
+            SELECT DISTINCT ON (id) id, ten, loai, dia_chi, vi_do, kinh_do FROM {bang_tam} ORDER BY id, seq DESC
+            ON CONFLICT (id) DO UPDATE SET ten = EXCLUDED.ten, loai = EXCLUDED.loai, dia_chi = EXCLUDED.dia_chi, vi_do = EXCLUDED.vi_do, kinh_do = EXCLUDED.kinh_do
+            WHERE (diem_dich_vu.ten, diem_dich_vu.loai, diem_dich_vu.dia_chi, diem_dich_vu.vi_do, diem_dich_vu.kinh_do)
+                  IS DISTINCT FROM (EXCLUDED.ten, EXCLUDED.loai, EXCLUDED.dia_chi, EXCLUDED.vi_do, EXCLUDED.kinh_do)
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted) AS inserted, COUNT(*) FILTER (WHERE NOT inserted) AS updated FROM gop
+        """))).fetchone()
+        await db.commit()
+    except UnicodeDecodeError as e:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"File phải được mã hoá UTF-8: {e}")
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi nhập điểm dịch vụ: {e}")
+    ket_qua.update(inserted=row.inserted, updated=row.updated, unchanged=ket_qua["accepted"] - row.inserted - row.updated)
+    if row.inserted or row.updated: diem_search_cache.bump()
+    if (row.inserted or row.updated) and diem_dich_vu_index.ready:
+        try: await asyncio.to_thread(nap_chi_muc_khong_gian)
+        except Exception as e: logger.error("Không thể nạp lại chỉ mục sau khi nhập: %s", e)
+    return ket_qua
+
+@app.put("/admin/devices/{device_id}/api-key",
+         response_model=DeviceApiKeyResponse,
+         dependencies=[Depends(get_admin_access)])
+def admin_rotate_device_api_key(data: DeviceApiKeyRotateModel, device_id: str = Path(...), db: Session = Depends(get_db)):
+    """
+    [Admin] Đổi API key của một thiết bị và huỷ cache xác thực của nó.
+    Key dạng rõ chỉ được trả về MỘT lần trong response này.
+    """
+    new_key = data.api_key or secrets.token_urlsafe(32)
+    stmt = text("UPDATE devices SET api_key_hash = :api_key_hash WHERE id = :device_id")
+    try:
+        result = db.execute(stmt, {"device_id": device_id, "api_key_hash": pwd_context.hash(new_key)})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi đổi API key: {e}")
+    if result.rowcount == 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Không tìm thấy thiết bị {device_id}.")
+    invalidate_device_credentials(device_id)
+    return {"device_id": device_id, "api_key": new_key}
+
+@app.get("/admin/cache/stats", dependencies=[Depends(get_admin_access)])
+async def admin_get_cache_stats():
+    """
+    [Admin] Thống kê hit/miss của các bộ nhớ đệm trong tiến trình.
+    """
+    return {"device_auth": device_auth_cache.stats(), "alert_suppression": alert_suppression.stats(), "diem_dich_vu_search": diem_search_cache.stats()}
+
+@app.get("/admin/ingest/stats", dependencies=[Depends(get_admin_access)])
+async def admin_get_ingest_stats():
+    """
+    [Admin] Độ sâu hàng đợi và độ trễ ghi lô của bộ đệm heartbeat.
+    """
+    return {"enabled": heartbeat_buffer.running, **heartbeat_buffer.stats()}
+
+@app.post("/admin/obd/maintenance", dependencies=[Depends(get_admin_access)])
+def admin_run_obd_maintenance():
+    """
+    [Admin] Chạy ngay việc bảo trì obd_logs (tạo phân vùng mới, rollup + xoá phân vùng hết hạn).
+    """
+    try: return bao_tri_obd_logs()
+    except Exception as e: raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi bảo trì obd_logs: {e}")
+
+@app.get("/admin/obd/export",
+         dependencies=[Depends(get_admin_access)],
+         response_class=StreamingResponse,
+         responses={200: {"content": {"application/x-ndjson": {}, "text/csv": {}, "application/vnd.apache.parquet": {}}}})
+async def admin_export_obd_logs(
+    start: datetime.datetime = Query(..., description="Từ thời điểm (gồm)"),
+    end: Optional[datetime.datetime] = Query(None, description="Tới thời điểm (không gồm); bỏ trống = tới hiện tại"),
+    device_id: Optional[str] = Query(None, description="Bỏ trống = cả hạm đội"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    compression: str = Query("none", pattern="^(none|gzip)$", description="gzip: nén cả luồng NDJSON/CSV; Parquet: codec nén cột"),
+):
+    """
+    [Admin] Xuất obd_logs theo thiết bị và khoảng thời gian, trả theo luồng (bộ nhớ không phụ thuộc số dòng).
+    Thứ tự: device_id, timestamp, id. Lỗi CSDL giữa chừng làm luồng bị ngắt (client nhận response không trọn vẹn).
+    """
+    if not export_bolt.ho_tro(format):
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Máy chủ chưa cài pyarrow: không xuất được Parquet.")
+    if end is not None and _thoi_diem_csdl(end) <= _thoi_diem_csdl(start):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end phải sau start.")
+    dem = OBD_EXPORT_ROWS_TOTAL.labels(format)
+
+    async def khuc_dong():
+        async for khuc in _doc_obd_logs(start, end, device_id):
+            dem.inc(len(khuc))
+            yield khuc
+
+    async def luong():
+        try:
+            async for chunk in export_bolt.ghi_luong(format, compression, _COT_XUAT_OBD, khuc_dong(), settings.OBD_EXPORT_PARQUET_ROW_GROUP):
+                yield chunk
+        except Exception as e:
+            logger.error("Lỗi khi xuất obd_logs (%s, %s): %s", device_id or "cả hạm đội", format, e)
+            raise
+
+    # Tên file chỉ gồm ký tự an toàn cho header Content-Disposition
+    ten_thiet_bi = re.sub(r"[^A-Za-z0-9_.-]", "_", device_id) if device_id else "fleet"
+    ten_file = export_bolt.ten_file(f"obd_logs_{ten_thiet_bi}_{start:%Y%m%dT%H%M%S}", format, compression)
+    media_type = "application/gzip" if ten_file.endswith(".gz") else export_bolt.MEDIA_TYPE[format]
+    return StreamingResponse(luong(), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{ten_file}"'})
+
+@app.get("/admin/alerts/worker/stats", dependencies=[Depends(get_admin_access)])
+async def admin_get_alert_worker_stats(db: AsyncSession = Depends(get_async_db)):
+    """
+    [Admin] Trạng thái worker xét cảnh báo và số việc đang chờ / đã hết lượt thử trong alert_jobs.
+    """
+    stmt = text("SELECT COUNT(*) FILTER (WHERE attempts < :max_attempts) AS pending, COUNT(*) FILTER (WHERE attempts >= :max_attempts) AS failed FROM alert_jobs")
+    try: row = (await db.execute(stmt, {"max_attempts": settings.ALERT_JOB_MAX_ATTEMPTS})).fetchone()
+    except Exception as e: raise HTTPException(status_code=500, detail=f"Lỗi truy vấn CSDL: {e}")
+    return {**alert_workers.stats(), "pending_jobs": row.pending, "failed_jobs": row.failed}
+
 # --- 14. ENDPOINT MỚI: MOCK LOCATION (Giữ nguyên) ---
 @app.post("/mock/location", status_code=status.HTTP_204_NO_CONTENT)
-async def mock_location_update(data: MockLocationInput, db: Session = Depends(get_db)):
-    # ... (Toàn bộ logic mock_location_update giữ nguyên)
+async def mock_location_update(data: MockLocationInput, db: AsyncSession = Depends(get_async_db)):
     stmt_location = text("""
     INSERT INTO device_locations (device_id, last_lat, last_lon, last_seen)
     VALUES (:device_id, :lat, :lon, NOW())
@@ -386,17 +1879,84 @@ async def mock_location_update(data: MockLocationInput, db: Session = Depends(ge
         last_lat = EXCLUDED.last_lat,
         last_lon = EXCLUDED.last_lon,
         last_seen = EXCLUDED.last_seen
+    RETURNING device_id, last_lat, last_lon, last_seen
     """)
     
     try:
-        db.execute(stmt_location, {
+        row = (await db.execute(stmt_location, {
             "device_id": data.device_id,
             "lat": data.lat,
             "lon": data.lon
-        })
-        db.commit()
+        })).fetchone()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Lỗi CSDL khi ghi vị trí giả lập: {e}")
     
+    phat_vi_tri([dict(row._mapping)])
     return None
+
+# --- 15. LUỒNG SỰ KIỆN REALTIME (SSE / WebSocket) ---
+# Thay cho việc poll: client giữ một kết nối và nhận sự kiện "location", "alert", "alert_read"
+# ngay khi dữ liệu được commit. Sự kiện "lagged" báo client đọc chậm đã bị bỏ bớt sự kiện
+# (nên tải lại bằng /admin/fleet/snapshot hoặc /device/alerts).
+# Trình duyệt không gửi được header tuỳ ý khi mở WebSocket nên các endpoint WebSocket
+# nhận thêm thông tin xác thực qua query string.
+
+@app.get("/device/stream")
+async def device_stream(x_device_id: str = Header(...), x_api_key: str = Header(...)):
+    """
+    Luồng SSE các sự kiện (vị trí, cảnh báo) của chính thiết bị đang xác thực.
+    """
+    device_id = await xac_thuc_thiet_bi_ngan(x_device_id, x_api_key)
+    return _phan_hoi_sse(_dang_ky_nghe(_topics_theo_doi(device_id)))
+
+@app.websocket("/device/ws")
+async def device_websocket(websocket: WebSocket, device_id: Optional[str] = Query(None), api_key: Optional[str] = Query(None)):
+    """
+    Như /device/stream nhưng qua WebSocket. Xác thực bằng header X-Device-ID / X-API-Key
+    hoặc query `device_id` / `api_key`.
+    """
+    device_id = websocket.headers.get("x-device-id") or device_id
+    api_key = websocket.headers.get("x-api-key") or api_key
+    if not device_id or not api_key: raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Thiếu thông tin xác thực thiết bị.")
+    try: await xac_thuc_thiet_bi_ngan(device_id, api_key)
+    except HTTPException as e: raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+    sub = event_hub.subscribe(_topics_theo_doi(device_id))
+    if sub is None: raise WebSocketException(code=status.WS_1013_TRY_AGAIN_LATER, reason="Đã đủ số kết nối realtime tối đa.")
+    await websocket.accept()
+    await _phat_websocket(websocket, sub)
+
+@app.get("/admin/stream", dependencies=[Depends(get_admin_access)])
+async def admin_stream(device_id: Optional[str] = Query(None)):
+    """
+    [Admin] Luồng SSE sự kiện của toàn hạm đội, hoặc của một thiết bị nếu truyền `device_id`.
+    """
+    return _phan_hoi_sse(_dang_ky_nghe(_topics_theo_doi(device_id)))
+
+@app.websocket("/admin/ws")
+async def admin_websocket(websocket: WebSocket, device_id: Optional[str] = Query(None), admin_api_key: Optional[str] = Query(None)):
+    """
+    [Admin] Như /admin/stream nhưng qua WebSocket. Xác thực bằng header X-Admin-Api-Key hoặc query `admin_api_key`.
+    """
+    admin_api_key = websocket.headers.get("x-admin-api-key") or admin_api_key or ""
+    if not secrets.compare_digest(admin_api_key, settings.ADMIN_API_KEY):
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid Admin API Key. Access Denied.")
+    sub = event_hub.subscribe(_topics_theo_doi(device_id))
+    if sub is None: raise WebSocketException(code=status.WS_1013_TRY_AGAIN_LATER, reason="Đã đủ số kết nối realtime tối đa.")
+    await websocket.accept()
+    await _phat_websocket(websocket, sub)
+
+@app.get("/admin/stream/stats", dependencies=[Depends(get_admin_access)])
+async def admin_get_stream_stats():
+    """
+    [Admin] Số người nghe realtime, số sự kiện đã phát / đã bỏ do client đọc chậm.
+    """
+    return event_hub.stats()
+
+# --- 16. SỐ LIỆU ĐO (Prometheus) ---
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Số liệu đo định dạng Prometheus (chỉ số tổng hợp, không có dữ liệu của từng thiết bị)."""
+    if not settings.METRICS_ENABLED: raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics đang tắt.")
+    return Response(content=metrics.render(), media_type=METRICS_CONTENT_TYPE)
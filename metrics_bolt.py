@@ -0,0 +1,224 @@
+# === metrics_bolt.py (Số liệu đo dạng Prometheus, không cần thư viện ngoài) ===
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Mốc histogram mặc định (giây): từ 1 ms tới 10 s
+MOC_THOI_GIAN_MAC_DINH = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _dinh_dang_so(gia_tri: float) -> str:
+    if gia_tri == math.inf: return "+Inf"
+    if gia_tri == -math.inf: return "-Inf"
+    if isinstance(gia_tri, float) and gia_tri.is_integer(): return str(int(gia_tri))
+    return repr(float(gia_tri)) if isinstance(gia_tri, float) else str(gia_tri)
+
+
+def _thoat_nhan(gia_tri: str) -> str:
+    return str(gia_tri).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _chuoi_nhan(ten_nhan: Sequence[str], gia_tri_nhan: Sequence[str], them: Optional[Tuple[str, str]] = None) -> str:
+    cap = list(zip(ten_nhan, gia_tri_nhan)) + ([them] if them else [])
+    if not cap: return ""
+    return "{" + ",".join(f'{ten}="{_thoat_nhan(gt)}"' for ten, gt in cap) + "}"
+
+
+class _Metric:
+    kieu = ""
+
+    def __init__(self, ten: str, mo_ta: str, nhan: Sequence[str] = ()):
+        self.ten = ten
+        self.mo_ta = mo_ta
+        self.nhan = tuple(nhan)
+        self._lock = threading.Lock()
+        self._con: Dict[tuple, object] = {}
+        if not self.nhan: self._con[()] = self._tao_con()
+
+    def _tao_con(self):
+        raise NotImplementedError
+
+    def labels(self, *gia_tri, **theo_ten):
+        """Chuỗi số liệu con theo giá trị nhãn (giống prometheus_client)."""
+        if theo_ten: gia_tri = tuple(theo_ten[ten] for ten in self.nhan)
+        khoa = tuple(str(x) for x in gia_tri)
+        if len(khoa) != len(self.nhan): raise ValueError(f"{self.ten} cần nhãn {self.nhan}")
+        con = self._con.get(khoa)
+        if con is None:
+            with self._lock: con = self._con.setdefault(khoa, self._tao_con())
+        return con
+
+    def _mac_dinh(self):
+        if self.nhan: raise ValueError(f"{self.ten} có nhãn, dùng .labels(...)")
+        return self._con[()]
+
+    def _cac_dong(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.ten} {self.mo_ta}", f"# TYPE {self.ten} {self.kieu}"] + self._cac_dong())
+
+
+class _GiaTri:
+    __slots__ = ("gia_tri", "_lock")
+
+    def __init__(self):
+        self.gia_tri = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, luong: float = 1.0) -> None:
+        with self._lock: self.gia_tri += luong
+
+    def dec(self, luong: float = 1.0) -> None:
+        with self._lock: self.gia_tri -= luong
+
+    def set(self, gia_tri: float) -> None:
+        self.gia_tri = float(gia_tri)
+
+
+class Counter(_Metric):
+    kieu = "counter"
+
+    def _tao_con(self): return _GiaTri()
+    def inc(self, luong: float = 1.0) -> None: self._mac_dinh().inc(luong)
+
+    def _cac_dong(self) -> List[str]:
+        return [f"{self.ten}{_chuoi_nhan(self.nhan, k)} {_dinh_dang_so(c.gia_tri)}" for k, c in list(self._con.items())]
+
+
+class Gauge(Counter):
+    kieu = "gauge"
+
+    def set(self, gia_tri: float) -> None: self._mac_dinh().set(gia_tri)
+    def dec(self, luong: float = 1.0) -> None: self._mac_dinh().dec(luong)
+
+
+class _PhanPhoi:
+    __slots__ = ("moc", "dem", "tong", "_lock")
+
+    def __init__(self, moc: Tuple[float, ...]):
+        self.moc = moc
+        self.dem = [0] * (len(moc) + 1)  # Ô cuối: > mốc lớn nhất (+Inf)
+        self.tong = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, gia_tri: float) -> None:
+        i = bisect.bisect_left(self.moc, gia_tri)
+        with self._lock:
+            self.dem[i] += 1
+            self.tong += gia_tri
+
+
+class Histogram(_Metric):
+    kieu = "histogram"
+
+    def __init__(self, ten: str, mo_ta: str, nhan: Sequence[str] = (), moc: Iterable[float] = MOC_THOI_GIAN_MAC_DINH):
+        self.moc = tuple(sorted(moc))
+        super().__init__(ten, mo_ta, nhan)
+
+    def _tao_con(self): return _PhanPhoi(self.moc)
+    def observe(self, gia_tri: float) -> None: self._mac_dinh().observe(gia_tri)
+
+    def _cac_dong(self) -> List[str]:
+        dong = []
+        for khoa, con in list(self._con.items()):
+            with con._lock: dem, tong = list(con.dem), con.tong
+            cong_don = 0
+            for moc, so in zip(self.moc + (math.inf,), dem):
+                cong_don += so
+                dong.append(f"{self.ten}_bucket{_chuoi_nhan(self.nhan, khoa, ('le', _dinh_dang_so(moc)))} {cong_don}")
+            dong.append(f"{self.ten}_sum{_chuoi_nhan(self.nhan, khoa)} {_dinh_dang_so(tong)}")
+            dong.append(f"{self.ten}_count{_chuoi_nhan(self.nhan, khoa)} {cong_don}")
+        return dong
+
+
+class CallbackMetric(_Metric):
+    """
+    Số liệu đọc lúc scrape từ hàm `doc()` trả về [(giá trị nhãn..., giá trị), ...]:
+    dùng cho các bộ đếm/trạng thái sẵn có (stats() của bộ đệm, pool kết nối, ...) để không phải đếm hai lần.
+    """
+
+    def __init__(self, ten: str, mo_ta: str, kieu: str, doc: Callable[[], Iterable[tuple]], nhan: Sequence[str] = ()):
+        self.kieu = kieu
+        self.doc = doc
+        super().__init__(ten, mo_ta, nhan)
+
+    def _tao_con(self): return None
+
+    def _cac_dong(self) -> List[str]:
+        dong = []
+        for *gia_tri_nhan, gia_tri in self.doc():
+            if gia_tri is None: continue
+            dong.append(f"{self.ten}{_chuoi_nhan(self.nhan, [str(x) for x in gia_tri_nhan])} {_dinh_dang_so(gia_tri)}")
+        return dong
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _dang_ky(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.ten in self._metrics: raise ValueError(f"Số liệu {metric.ten} đã đăng ký")
+            self._metrics[metric.ten] = metric
+        return metric
+
+    def counter(self, ten: str, mo_ta: str, nhan: Sequence[str] = ()) -> Counter:
+        return self._dang_ky(Counter(ten, mo_ta, nhan))
+
+    def gauge(self, ten: str, mo_ta: str, nhan: Sequence[str] = ()) -> Gauge:
+        return self._dang_ky(Gauge(ten, mo_ta, nhan))
+
+    def histogram(self, ten: str, mo_ta: str, nhan: Sequence[str] = (), moc: Iterable[float] = MOC_THOI_GIAN_MAC_DINH) -> Histogram:
+        return self._dang_ky(Histogram(ten, mo_ta, nhan, moc))
+
+    def callback(self, ten: str, mo_ta: str, kieu: str, doc: Callable[[], Iterable[tuple]], nhan: Sequence[str] = ()) -> CallbackMetric:
+        return self._dang_ky(CallbackMetric(ten, mo_ta, kieu, doc, nhan))
+
+    def render(self) -> str:
+        """Văn bản theo định dạng exposition 0.0.4 của Prometheus."""
+        with self._lock: cac_metric = list(self._metrics.values())
+        phan = []
+        for metric in cac_metric:
+            try: phan.append(metric.render())
+            except Exception as e: phan.append(f"# LỖI {metric.ten}: {_thoat_nhan(e)}")
+        return "\n".join(phan) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class PrometheusMiddleware:
+    """
+    Middleware ASGI đo thời gian xử lý mỗi request HTTP theo (method, mẫu route, mã trạng thái).
+    Nhãn là MẪU route (VD: /admin/devices/{device_id}/alerts) chứ không phải URL thật để số chuỗi không bùng nổ;
+    request không khớp route nào gộp vào nhãn "<khong_khop>". Request stream (SSE) được đo tới khi kết thúc.
+    """
+
+    def __init__(self, app, histogram: Histogram, dang_xu_ly: Optional[Gauge] = None, bo_qua: Iterable[str] = ()):
+        self.app = app
+        self.histogram = histogram
+        self.dang_xu_ly = dang_xu_ly
+        self.bo_qua = set(bo_qua)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.bo_qua:
+            return await self.app(scope, receive, send)
+        ma_trang_thai = [500]
+
+        async def send_ghi_nhan(message):
+            if message["type"] == "http.response.start": ma_trang_thai[0] = message["status"]
+            await send(message)
+
+        bat_dau = time.perf_counter()
+        if self.dang_xu_ly: self.dang_xu_ly.inc()
+        try:
+            await self.app(scope, receive, send_ghi_nhan)
+        finally:
+            if self.dang_xu_ly: self.dang_xu_ly.dec()
+            route = scope.get("route")
+            mau = getattr(route, "path", None) or "<khong_khop>"
+            self.histogram.labels(scope["method"], mau, str(ma_trang_thai[0])).observe(time.perf_counter() - bat_dau)
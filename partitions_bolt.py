@@ -0,0 +1,142 @@
+# === partitions_bolt.py (Quản lý phân vùng theo thời gian cho PostgreSQL) ===
+import datetime
+import re
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+KY_HOP_LE = ("day", "month")
+_BIEN_PHAN_VUNG = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def dau_ky(ts: datetime.datetime, ky: str) -> datetime.datetime:
+    if ky == "day": return datetime.datetime(ts.year, ts.month, ts.day)
+    return datetime.datetime(ts.year, ts.month, 1)
+
+
+def ky_sau(ts: datetime.datetime, ky: str) -> datetime.datetime:
+    dau = dau_ky(ts, ky)
+    if ky == "day": return dau + datetime.timedelta(days=1)
+    return datetime.datetime(dau.year + (dau.month == 12), dau.month % 12 + 1, 1)
+
+
+def ten_phan_vung(bang: str, tu: datetime.datetime, ky: str) -> str:
+    return f"{bang}_p{tu.strftime('%Y%m%d' if ky == 'day' else '%Y%m')}"
+
+
+def loai_bang(conn, bang: str) -> Optional[str]:
+    """'p' = bảng phân vùng, 'r' = bảng thường, None = chưa tồn tại."""
+    return conn.execute(text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:bang)"), {"bang": bang}).scalar()
+
+
+def _gia_tri_bien(gia_tri: str) -> Optional[datetime.datetime]:
+    gia_tri = gia_tri.strip()
+    if gia_tri.upper() in ("MINVALUE", "MAXVALUE"): return None
+    return datetime.datetime.fromisoformat(gia_tri.strip("'"))
+
+
+def liet_ke_phan_vung(conn, bang: str) -> List[Tuple[str, Optional[datetime.datetime], Optional[datetime.datetime], bool]]:
+    """Danh sách (tên, từ, đến, là_default) của các phân vùng; None = MINVALUE/MAXVALUE."""
+    rows = conn.execute(text("""
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(:bang)
+    """), {"bang": bang}).fetchall()
+    ket_qua = []
+    for ten, bien in rows:
+        if bien.strip().upper() == "DEFAULT":
+            ket_qua.append((ten, None, None, True)); continue
+        khop = _BIEN_PHAN_VUNG.search(bien)
+        if khop: ket_qua.append((ten, _gia_tri_bien(khop.group(1)), _gia_tri_bien(khop.group(2)), False))
+    return ket_qua
+
+
+def _giao_nhau(tu, den, pv_tu, pv_den) -> bool:
+    return (pv_tu is None or pv_tu < den) and (pv_den is None or tu < pv_den)
+
+
+def tao_phan_vung(conn, bang: str, cot: str, tu: datetime.datetime, den: datetime.datetime, ten: str) -> None:
+    """
+    Tạo phân vùng [tu, den). Nếu phân vùng DEFAULT đang giữ dòng thuộc khoảng này
+    (VD: heartbeat có timestamp ở tương lai), chuyển chúng sang phân vùng mới trước khi gắn lại DEFAULT.
+    """
+    params = {"tu": tu, "den": den}
+    ten_default = f"{bang}_default"
+    co_default = loai_bang(conn, ten_default) is not None
+    lech = co_default and conn.execute(text(f'SELECT EXISTS (SELECT 1 FROM {ten_default} WHERE "{cot}" >= :tu AND "{cot}" < :den)'), params).scalar()
+    if lech: conn.execute(text(f"ALTER TABLE {bang} DETACH PARTITION {ten_default}"))
+    conn.execute(text(f"CREATE TABLE {ten} PARTITION OF {bang} FOR VALUES FROM ('{tu.isoformat(sep=' ')}') TO ('{den.isoformat(sep=' ')}')"))
+    if lech:
+        conn.execute(text(f'INSERT INTO {bang} SELECT * FROM {ten_default} WHERE "{cot}" >= :tu AND "{cot}" < :den'), params)
+        conn.execute(text(f'DELETE FROM {ten_default} WHERE "{cot}" >= :tu AND "{cot}" < :den'), params)
+        conn.execute(text(f"ALTER TABLE {bang} ATTACH PARTITION {ten_default} DEFAULT"))
+
+
+def dam_bao_phan_vung(conn, bang: str, cot: str, ky: str, hien_tai: datetime.datetime, so_ky_toi: int) -> List[str]:
+    """Đảm bảo có phân vùng DEFAULT và phân vùng cho kỳ hiện tại + `so_ky_toi` kỳ kế tiếp."""
+    if ky not in KY_HOP_LE: raise ValueError(f"Kỳ phân vùng không hợp lệ: {ky}")
+    da_tao = []
+    ten_default = f"{bang}_default"
+    if loai_bang(conn, ten_default) is None:
+        conn.execute(text(f"CREATE TABLE {ten_default} PARTITION OF {bang} DEFAULT"))
+        da_tao.append(ten_default)
+    hien_co = [(tu, den) for _, tu, den, la_default in liet_ke_phan_vung(conn, bang) if not la_default]
+    tu = dau_ky(hien_tai, ky)
+    for _ in range(so_ky_toi + 1):
+        den = ky_sau(tu, ky)
+        if not any(_giao_nhau(tu, den, a, b) for a, b in hien_co):
+            ten = ten_phan_vung(bang, tu, ky)
+            tao_phan_vung(conn, bang, cot, tu, den, ten)
+            hien_co.append((tu, den))
+            da_tao.append(ten)
+        tu = den
+    return da_tao
+
+
+def chuyen_sang_phan_vung(conn, bang: str, cot: str, ky: str, hien_tai: datetime.datetime,
+                          tao_bang_cha: Callable, cot_id: Optional[str] = "id") -> bool:
+    """
+    Chuyển một bảng thường đã có dữ liệu thành bảng phân vùng (chạy một lần):
+    bảng cũ được đổi tên thành `<bang>_legacy` và gắn làm phân vùng [MINVALUE, đầu kỳ hiện tại);
+    các dòng từ đầu kỳ hiện tại trở đi được chuyển sang bảng mới. Trả về True nếu đã chuyển.
+    """
+    if loai_bang(conn, bang) != "r": return False
+    cu = f"{bang}_legacy"
+    moc = dau_ky(hien_tai, ky)
+    conn.execute(text(f"ALTER TABLE {bang} RENAME TO {cu}"))
+    # Khoá chính cũ không chứa cột phân vùng; ATTACH sẽ tự tạo khoá tương ứng với bảng cha
+    conn.execute(text(f"ALTER TABLE {cu} DROP CONSTRAINT IF EXISTS {bang}_pkey"))
+    if cot_id and loai_bang(conn, f"{bang}_{cot_id}_seq") is not None:
+        conn.execute(text(f"ALTER SEQUENCE {bang}_{cot_id}_seq RENAME TO {cu}_{cot_id}_seq"))
+    for (ten_index,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :cu AND indexname LIKE :mau"), {"cu": cu, "mau": f"ix_{bang}_%"}).fetchall():
+        conn.execute(text(f"ALTER INDEX {ten_index} RENAME TO {ten_index.replace(f'ix_{bang}_', f'ix_{cu}_', 1)}"))
+    tao_bang_cha(conn)
+    if cot_id:
+        # Tiếp tục dãy id của bảng cũ để không trùng khoá chính
+        conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{bang}', '{cot_id}'), COALESCE((SELECT MAX({cot_id}) FROM {cu}), 0) + 1, false)"))
+    tam = f"{cu}_moi"
+    conn.execute(text(f'CREATE TEMP TABLE {tam} ON COMMIT DROP AS SELECT * FROM {cu} WHERE "{cot}" >= :moc'), {"moc": moc})
+    conn.execute(text(f'DELETE FROM {cu} WHERE "{cot}" >= :moc'), {"moc": moc})
+    conn.execute(text(f"ALTER TABLE {bang} ATTACH PARTITION {cu} FOR VALUES FROM (MINVALUE) TO ('{moc.isoformat(sep=' ')}')"))
+    dam_bao_phan_vung(conn, bang, cot, ky, hien_tai, 0)
+    conn.execute(text(f"INSERT INTO {bang} SELECT * FROM {tam}"))
+    return True
+
+
+def het_han_phan_vung(conn, bang: str, cot: str, moc_het_han: datetime.datetime, truoc_khi_xoa: Callable) -> List[str]:
+    """
+    Xoá các phân vùng có cận trên <= `moc_het_han` và các dòng cũ hơn mốc trong phân vùng DEFAULT.
+    `truoc_khi_xoa(conn, nguon, dieu_kien, params)` được gọi trước mỗi lần xoá (VD: để tổng hợp rollup)
+    trong CÙNG transaction, nên dữ liệu thô chỉ mất khi bản tổng hợp đã được ghi.
+    """
+    da_xoa = []
+    for ten, tu, den, la_default in liet_ke_phan_vung(conn, bang):
+        if la_default:
+            params = {"moc": moc_het_han}
+            if conn.execute(text(f'SELECT EXISTS (SELECT 1 FROM {ten} WHERE "{cot}" < :moc)'), params).scalar():
+                truoc_khi_xoa(conn, ten, f'"{cot}" < :moc', params)
+                conn.execute(text(f'DELETE FROM {ten} WHERE "{cot}" < :moc'), params)
+        elif den is not None and den <= moc_het_han:
+            truoc_khi_xoa(conn, ten, "TRUE", {})
+            conn.execute(text(f"DROP TABLE {ten}"))
+            da_xoa.append(ten)
+    return da_xoa
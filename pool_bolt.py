@@ -0,0 +1,95 @@
+# === pool_bolt.py (Pool kết nối Postgres: kích thước theo số worker, đo thời gian chờ, cache prepared statement) ===
+# Mỗi tiến trình uvicorn có 2 engine (đồng bộ psycopg2 + bất đồng bộ asyncpg), mỗi engine một pool riêng.
+# Tổng số kết nối mọi tiến trình có thể mở = WEB_CONCURRENCY x (pool_size + max_overflow) của cả hai engine:
+# chia_ngan_sach() giữ tổng này không vượt DB_MAX_CONNECTIONS.
+import time
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import URL
+
+
+def chia_ngan_sach(tong_ket_noi: int, so_tien_trinh: int, *nhu_cau: int) -> List[Tuple[int, int]]:
+    """
+    Chia `tong_ket_noi` cho `so_tien_trinh` tiến trình rồi cho các engine theo tỷ lệ `nhu_cau`
+    (số kết nối engine cần thường xuyên). Trả về (pool_size, max_overflow) cho từng engine:
+    pool_size = nhu cầu (kết nối giữ sẵn, không mở/đóng lại), phần ngân sách còn lại là overflow cho lúc cao điểm.
+    """
+    ngan_sach = max(len(nhu_cau), tong_ket_noi // max(1, so_tien_trinh))
+    tong_nhu_cau = sum(nhu_cau)
+    ket_qua = []
+    for i, can in enumerate(nhu_cau):
+        # Engine cuối nhận phần dư của phép chia
+        phan = ngan_sach - sum(a + b for a, b in ket_qua) if i == len(nhu_cau) - 1 else max(1, ngan_sach * can // tong_nhu_cau)
+        pool_size = max(1, min(can, phan))
+        ket_qua.append((pool_size, max(0, phan - pool_size)))
+    return ket_qua
+
+
+def lop_pool_do_cho(lop_goc):
+    """
+    Lớp con của `lop_goc` (QueuePool / AsyncAdaptedQueuePool) đo thời gian chờ lấy kết nối ra khỏi pool.
+    `khi_cho(giay, het_han)` được gán ở mức lớp (pool tạo lại sau dispose() vẫn giữ), gọi sau mỗi lần lấy;
+    het_han=True khi hết pool_timeout mà không có kết nối rảnh.
+    """
+    class PoolDoCho(lop_goc):
+        khi_cho: Optional[Callable[[float, bool], None]] = None
+
+        def _do_get(self):
+            bat_dau = time.perf_counter()
+            het_han = False
+            try: return super()._do_get()
+            except exc.TimeoutError:
+                het_han = True
+                raise
+            finally:
+                if PoolDoCho.khi_cho: PoolDoCho.khi_cho(time.perf_counter() - bat_dau, het_han)
+
+    PoolDoCho.__name__ = f"{lop_goc.__name__}DoCho"
+    # Log của pool vẫn nằm dưới logger "sqlalchemy.pool" (mặc định WARNING) như pool gốc
+    PoolDoCho._sqla_logger_namespace = f"{lop_goc.__module__}.{lop_goc.__name__}"
+    return PoolDoCho
+
+
+def tham_so_engine(lop_pool, pool_size: int, max_overflow: int, timeout: float, recycle: int, ping_ranh: float) -> dict:
+    """Tham số create_engine/create_async_engine cho Postgres. `ping_ranh` xem ping_khi_ranh_lau()."""
+    return {"poolclass": lop_pool_do_cho(lop_pool), "pool_size": pool_size, "max_overflow": max_overflow,
+            "pool_timeout": timeout, "pool_recycle": recycle, "pool_pre_ping": ping_ranh == 0,
+            # Trả kết nối về pool theo LIFO: kết nối ít dùng nằm yên ở đáy và bị recycle, pool tự co lại sau cao điểm
+            "pool_use_lifo": True}
+
+
+def ping_khi_ranh_lau(eng, giay: float) -> None:
+    """
+    Như pool_pre_ping nhưng chỉ ping kết nối đã nằm rảnh trong pool quá `giay` giây: kết nối vừa được dùng
+    (luồng heartbeat liên tục) không tốn thêm một vòng gọi tới CSDL mỗi lần lấy. Kết nối ping lỗi bị bỏ,
+    pool tự mở kết nối mới thay thế (DisconnectionError).
+    """
+    @event.listens_for(eng, "checkin")
+    def _khi_tra(dbapi_conn, connection_record):
+        connection_record.info["bolt_tra_luc"] = time.monotonic()
+
+    @event.listens_for(eng, "checkout")
+    def _khi_lay(dbapi_conn, connection_record, connection_proxy):
+        tra_luc = connection_record.info.get("bolt_tra_luc")
+        if tra_luc is None or time.monotonic() - tra_luc < giay: return
+        try: con_song = eng.dialect.do_ping(dbapi_conn)
+        except Exception: con_song = False
+        if not con_song: raise exc.DisconnectionError("Kết nối rảnh đã bị đóng phía CSDL")
+
+
+def cau_hinh_asyncpg(url: URL, cache_statement: int, pgbouncer: bool) -> Tuple[URL, dict]:
+    """
+    URL + connect_args cho asyncpg. asyncpg prepare mọi câu lệnh; SQLAlchemy giữ tối đa `cache_statement`
+    prepared statement mỗi kết nối (mặc định của SQLAlchemy là 100), câu lệnh lặp lại không phải parse/plan lại.
+    PgBouncer chế độ transaction/statement: prepared statement không sống qua các transaction trên cùng
+    kết nối server nên tắt cả hai tầng cache và đặt tên ngẫu nhiên để không trùng giữa các client.
+    """
+    if pgbouncer:
+        return (url.update_query_dict({"prepared_statement_cache_size": "0"}),
+                {"statement_cache_size": 0, "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__"})
+    # Giá trị đặt sẵn trong DATABASE_URL được ưu tiên
+    if "prepared_statement_cache_size" not in url.query:
+        url = url.update_query_dict({"prepared_statement_cache_size": str(cache_statement)})
+    return url, {}
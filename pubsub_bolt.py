@@ -0,0 +1,115 @@
+# === pubsub_bolt.py (Hub publish/subscribe trong tiến trình cho luồng sự kiện realtime) ===
+import asyncio
+import itertools
+from typing import Iterable, Optional, Set
+
+
+class Subscription:
+    """
+    Một người nghe với hàng đợi giới hạn `max_queue` sự kiện.
+    Người nghe chậm không làm chậm bên phát: khi hàng đợi đầy, sự kiện CŨ NHẤT bị bỏ
+    và lần get() kế tiếp trả về sự kiện {"type": "lagged", "dropped": n} để client tự đồng bộ lại.
+    """
+
+    def __init__(self, hub: "PubSubHub", topics: Set[str], max_queue: int):
+        self.hub = hub
+        self.topics = topics
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, int(max_queue)))
+        self.dropped = 0
+        self._chua_bao_mat = 0
+
+    def _put(self, event: dict) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            self._chua_bao_mat += 1
+            self.hub.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Sự kiện kế tiếp, hoặc None nếu hết `timeout` giây mà không có gì (dùng để gửi keep-alive)."""
+        if self._chua_bao_mat:
+            so_mat, self._chua_bao_mat = self._chua_bao_mat, 0
+            return {"type": "lagged", "dropped": so_mat}
+        try: return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError: return None
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+
+
+class PubSubHub:
+    """
+    Phân phối sự kiện theo topic (VD: "fleet", "device:<id>") tới các Subscription.
+    Chỉ phục vụ người nghe trong CÙNG tiến trình: chạy nhiều worker uvicorn thì mỗi worker
+    chỉ thấy sự kiện do chính nó ghi (cần broker ngoài như Redis/NOTIFY để chia sẻ).
+    Không có người nghe thì publish() gần như không tốn gì.
+    """
+
+    def __init__(self, max_queue: int = 256, max_subscribers: int = 10000):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._topics: dict = {}  # topic -> set(Subscription)
+        self._so_nguoi_nghe = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._seq = itertools.count(1)
+        # Số liệu thống kê
+        self.published = 0
+        self.delivered = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    @property
+    def subscribers(self) -> int:
+        return self._so_nguoi_nghe
+
+    def subscribe(self, topics: Iterable[str], max_queue: Optional[int] = None) -> Optional[Subscription]:
+        """Đăng ký nghe; trả về None khi đã đủ `max_subscribers` (người gọi nên trả 503)."""
+        if self._so_nguoi_nghe >= self.max_subscribers:
+            self.rejected += 1
+            return None
+        self._loop = asyncio.get_running_loop()
+        sub = Subscription(self, set(topics), max_queue or self.max_queue)
+        for topic in sub.topics: self._topics.setdefault(topic, set()).add(sub)
+        self._so_nguoi_nghe += 1
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        da_xoa = False
+        for topic in sub.topics:
+            nhom = self._topics.get(topic)
+            if nhom and sub in nhom:
+                nhom.discard(sub); da_xoa = True
+                if not nhom: del self._topics[topic]
+        if da_xoa: self._so_nguoi_nghe -= 1
+
+    def publish(self, topics: Iterable[str], event: dict) -> None:
+        """
+        Phát `event` tới mọi người nghe của các topic (mỗi người nhận tối đa một lần).
+        Gọi được từ thread khác (VD: route `def` trong threadpool): khi đó việc phát được chuyển về event loop.
+        """
+        if not self._topics: return
+        try: dang_o_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError: dang_o_loop = False
+        if dang_o_loop: self._publish(list(topics), event)
+        elif self._loop is not None and not self._loop.is_closed(): self._loop.call_soon_threadsafe(self._publish, list(topics), event)
+
+    def _publish(self, topics: list, event: dict) -> None:
+        nguoi_nghe = set()
+        for topic in topics: nguoi_nghe.update(self._topics.get(topic, ()))
+        if not nguoi_nghe: return
+        event = {**event, "seq": next(self._seq)}
+        for sub in nguoi_nghe: sub._put(event)
+        self.published += 1
+        self.delivered += len(nguoi_nghe)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self._so_nguoi_nghe,
+            "max_subscribers": self.max_subscribers,
+            "topics": len(self._topics),
+            "published": self.published,
+            "delivered": self.delivered,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+        }
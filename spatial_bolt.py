@@ -0,0 +1,199 @@
+# === spatial_bolt.py (Chỉ mục không gian trong bộ nhớ cho diem_dich_vu) ===
+import math
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+R_TRAI_DAT_KM = 6371.0
+# Khoảng cách xa nhất có thể giữa hai điểm trên mặt cầu
+NUA_CHU_VI_KM = math.pi * R_TRAI_DAT_KM
+# Nới biên hộp một chút để sai số dấu phẩy động không loại nhầm điểm nằm đúng trên biên
+_BIEN_SAI_SO_DO = 1e-9
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Khoảng cách Haversine (km). Dùng đúng dạng ASIN của HAVERSINE_SQL trong main.py
+    để kết quả từ chỉ mục khớp với kết quả từ PostgreSQL.
+    """
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    a = (math.sin((lat2_rad - lat1_rad) / 2) ** 2 +
+         math.cos(lat1_rad) * math.cos(lat2_rad) *
+         math.sin((math.radians(lon2) - math.radians(lon1)) / 2) ** 2)
+    return R_TRAI_DAT_KM * 2 * math.asin(math.sqrt(min(1.0, a)))
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, List[Tuple[float, float]]]:
+    """
+    Hộp vĩ độ/kinh độ chứa trọn vòng tròn bán kính `radius_km` quanh (lat, lon).
+    Trả về (lat_min, lat_max, [(lon_min, lon_max), ...]); danh sách kinh độ có
+    2 khoảng khi hộp vắt qua kinh tuyến 180.
+    """
+    goc = max(0.0, radius_km) / R_TRAI_DAT_KM
+    dlat = math.degrees(goc) + _BIEN_SAI_SO_DO
+    lat_min, lat_max = lat - dlat, lat + dlat
+    cos_lat = math.cos(math.radians(lat))
+    # Hộp chạm cực hoặc vòng tròn quá lớn: mọi kinh độ đều có thể nằm trong bán kính
+    if lat_min <= -90.0 or lat_max >= 90.0 or cos_lat <= 0.0 or math.sin(goc) >= cos_lat:
+        return max(lat_min, -90.0), min(lat_max, 90.0), [(-180.0, 180.0)]
+    dlon = math.degrees(math.asin(math.sin(goc) / cos_lat)) + _BIEN_SAI_SO_DO
+    lon_min, lon_max = lon - dlon, lon + dlon
+    if lon_min < -180.0:
+        return lat_min, lat_max, [(lon_min + 360.0, 180.0), (-180.0, lon_max)]
+    if lon_max > 180.0:
+        return lat_min, lat_max, [(lon_min, 180.0), (-180.0, lon_max - 360.0)]
+    return lat_min, lat_max, [(lon_min, lon_max)]
+
+
+_BASE32_GEOHASH = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def o_geohash(lat: float, lon: float, precision: int = 6) -> Tuple[str, float, float, float]:
+    """
+    Ô geohash chứa (lat, lon). Trả về (mã geohash, vĩ độ tâm, kinh độ tâm, bán kính ô km):
+    mọi điểm trong ô cách tâm không quá `bán kính ô` (khoảng cách tới góc xa nhất, nới thêm chút sai số).
+    """
+    lat_min, lat_max, lon_min, lon_max = -90.0, 90.0, -180.0, 180.0
+    ma, so_bit, ky_tu, bit_kinh_do = [], 0, 0, True
+    while len(ma) < precision:
+        # Bit chẵn chia đôi kinh độ, bit lẻ chia đôi vĩ độ
+        if bit_kinh_do:
+            giua = (lon_min + lon_max) / 2
+            if lon >= giua: ky_tu, lon_min = ky_tu * 2 + 1, giua
+            else: ky_tu, lon_max = ky_tu * 2, giua
+        else:
+            giua = (lat_min + lat_max) / 2
+            if lat >= giua: ky_tu, lat_min = ky_tu * 2 + 1, giua
+            else: ky_tu, lat_max = ky_tu * 2, giua
+        bit_kinh_do = not bit_kinh_do
+        so_bit += 1
+        if so_bit == 5:
+            ma.append(_BASE32_GEOHASH[ky_tu])
+            so_bit, ky_tu = 0, 0
+    tam_lat, tam_lon = (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+    ban_kinh = max(haversine_km(tam_lat, tam_lon, a, b) for a in (lat_min, lat_max) for b in (lon_min, lon_max))
+    return "".join(ma), tam_lat, tam_lon, ban_kinh * 1.001 + 1e-6
+
+
+class DiemDichVuIndex:
+    """
+    Chỉ mục lưới (grid bucket) theo từng `loai` cho các điểm dịch vụ.
+    Truy vấn bán kính chỉ duyệt các ô giao với hộp bao quanh vòng tròn;
+    truy vấn gần nhất mở rộng bán kính gấp đôi cho tới khi đủ k điểm.
+    Khoảng cách cuối cùng luôn được tính lại chính xác bằng Haversine.
+    """
+
+    def __init__(self, cell_deg: float = 0.1):
+        self.cell_deg = float(cell_deg)
+        self._lock = threading.RLock()
+        self._grids: dict = {}   # loai -> {(o_lat, o_lon): {id: diem}}
+        self._points: dict = {}  # id -> (loai, (o_lat, o_lon))
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _insert(self, diem: dict) -> None:
+        o = self._cell(diem["vi_do"], diem["kinh_do"])
+        self._grids.setdefault(diem["loai"], {}).setdefault(o, {})[diem["id"]] = dict(diem)
+        self._points[diem["id"]] = (diem["loai"], o)
+
+    def _delete(self, diem_id: str) -> None:
+        vi_tri = self._points.pop(diem_id, None)
+        if not vi_tri: return
+        loai, o = vi_tri
+        grid = self._grids[loai]
+        grid[o].pop(diem_id, None)
+        if not grid[o]: del grid[o]
+        if not grid: del self._grids[loai]
+
+    def load(self, rows: Iterable[dict]) -> None:
+        """Nạp lại toàn bộ chỉ mục (thay thế nguyên khối, không để lộ trạng thái dở dang)."""
+        moi = DiemDichVuIndex(self.cell_deg)
+        for diem in rows: moi._insert(diem)
+        with self._lock:
+            self._grids, self._points = moi._grids, moi._points
+            self.ready = True
+
+    def upsert(self, diem: dict) -> None:
+        with self._lock:
+            self._delete(diem["id"])
+            self._insert(diem)
+
+    def remove(self, diem_id: str) -> None:
+        with self._lock:
+            self._delete(diem_id)
+
+    def _hop_o(self, lat: float, lon: float, radius_km: float) -> tuple:
+        """Khoảng ô lưới (o_lat_min, o_lat_max, [(o_lon_min, o_lon_max), ...]) phủ hộp bao quanh vòng tròn."""
+        lat_min, lat_max, cac_khoang_lon = bounding_box(lat, lon, radius_km)
+        return (math.floor(lat_min / self.cell_deg), math.floor(lat_max / self.cell_deg),
+                [(math.floor(a / self.cell_deg), math.floor(b / self.cell_deg)) for a, b in cac_khoang_lon])
+
+    def _ung_vien(self, lat: float, lon: float, radius_km: float, loai: Optional[str], hop_o: Optional[tuple] = None) -> List[Tuple[float, dict]]:
+        o_lat_min, o_lat_max, cac_khoang_o_lon = hop_o or self._hop_o(lat, lon, radius_km)
+        grids = [self._grids.get(loai, {})] if loai else list(self._grids.values())
+        so_o_trong_hop = (o_lat_max - o_lat_min + 1) * sum(b - a + 1 for a, b in cac_khoang_o_lon)
+
+        ket_qua = []
+        for grid in grids:
+            if so_o_trong_hop <= len(grid):
+                cac_o = (grid.get((i, j)) for i in range(o_lat_min, o_lat_max + 1)
+                         for a, b in cac_khoang_o_lon for j in range(a, b + 1))
+            else:
+                # Hộp lớn hơn số ô thực có dữ liệu: duyệt trực tiếp các ô có dữ liệu
+                cac_o = (o for (i, j), o in grid.items()
+                         if o_lat_min <= i <= o_lat_max and any(a <= j <= b for a, b in cac_khoang_o_lon))
+            for o in cac_o:
+                if not o: continue
+                for diem in o.values():
+                    kc = haversine_km(lat, lon, diem["vi_do"], diem["kinh_do"])
+                    if kc <= radius_km: ket_qua.append((kc, diem))
+        ket_qua.sort(key=lambda x: (x[0], x[1]["id"]))
+        return ket_qua
+
+    @staticmethod
+    def _dinh_dang(ung_vien: List[Tuple[float, dict]]) -> List[dict]:
+        return [{**diem, "khoang_cach_km": round(kc, 2)} for kc, diem in ung_vien]
+
+    def radius(self, lat: float, lon: float, radius_km: float, loai: Optional[str] = None) -> List[dict]:
+        """Các điểm trong bán kính, sắp xếp theo khoảng cách tăng dần."""
+        with self._lock:
+            return self._dinh_dang(self._ung_vien(lat, lon, radius_km, loai))
+
+    def nearest(self, lat: float, lon: float, loai: Optional[str] = None, k: int = 1) -> List[dict]:
+        """k điểm gần nhất. Mọi điểm ngoài bán kính r đều xa hơn r nên kết quả là chính xác."""
+        with self._lock:
+            if not self._points or (loai and loai not in self._grids): return []
+            ban_kinh = max(self.cell_deg * 111.2, 0.5)
+            while True:
+                ung_vien = self._ung_vien(lat, lon, ban_kinh, loai)
+                if len(ung_vien) >= k or ban_kinh >= NUA_CHU_VI_KM:
+                    return self._dinh_dang(ung_vien[:k])
+                ban_kinh = min(ban_kinh * 2, NUA_CHU_VI_KM)
+
+    def nearest_by_loai(self, lat: float, lon: float, cac_loai: Iterable[str]) -> dict:
+        """
+        Điểm gần nhất cho TỪNG loại trong `cac_loai`, trong một lần tìm mở rộng bán kính:
+        mỗi vòng chỉ tính hộp ô lưới một lần và chỉ quét các loại chưa tìm thấy.
+        Trả về {loai: diem hoặc None}; kết quả từng loại giống hệt nearest(loai=...).
+        """
+        cac_loai = list(dict.fromkeys(cac_loai))
+        ket_qua = dict.fromkeys(cac_loai)
+        with self._lock:
+            con_lai = [loai for loai in cac_loai if loai in self._grids]
+            ban_kinh = max(self.cell_deg * 111.2, 0.5)
+            while con_lai:
+                hop_o = self._hop_o(lat, lon, ban_kinh)
+                vong_cuoi = ban_kinh >= NUA_CHU_VI_KM
+                chua_thay = []
+                for loai in con_lai:
+                    ung_vien = self._ung_vien(lat, lon, ban_kinh, loai, hop_o)
+                    if ung_vien: ket_qua[loai] = self._dinh_dang(ung_vien[:1])[0]
+                    elif not vong_cuoi: chua_thay.append(loai)
+                con_lai = chua_thay
+                ban_kinh = min(ban_kinh * 2, NUA_CHU_VI_KM)
+        return ket_qua
@@ -0,0 +1,133 @@
+# === sqlite_bolt.py (Chế độ SQLite nhúng: gateway một máy, benchmark không cần Postgres) ===
+# DATABASE_URL=sqlite:///duong/dan/bolt.db  -> file, journal WAL
+# DATABASE_URL=sqlite://                    -> CSDL trong bộ nhớ (mất khi tiến trình dừng)
+# Mỗi kết nối mới được đăng ký các hàm SQL mà truy vấn của main.py dùng nhưng SQLite không có
+# (RADIANS, ASIN, POWER, GREATEST, NOW, date_trunc, ...). Thời điểm được lưu dạng văn bản ISO
+# "YYYY-MM-DD HH:MM:SS.ffffff" nên so sánh/sắp xếp theo chuỗi đúng như theo thời gian.
+import datetime
+import math
+import os
+import sqlite3
+import uuid
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import URL, make_url
+
+# Ghi/đọc giá trị Python <-> SQLite. Converter áp dụng theo kiểu khai báo của cột
+# (cần detect_types=PARSE_DECLTYPES), kể cả khi cột đi qua subquery, JOIN hay RETURNING.
+sqlite3.register_adapter(datetime.datetime, lambda ts: ts.isoformat(" ", "microseconds"))
+sqlite3.register_adapter(uuid.UUID, str)
+sqlite3.register_converter("DATETIME", lambda b: datetime.datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("BOOLEAN", lambda b: b not in (b"0", b""))
+
+# Execution option: transaction mở bằng BEGIN IMMEDIATE (xem cau_hinh_engine)
+GHI_NGAY = "sqlite_ghi_ngay"
+
+# Kết nối giữ CSDL bộ nhớ sống suốt tiến trình (VFS memdb xoá CSDL khi kết nối cuối cùng đóng)
+_giu_bo_nho: Optional[sqlite3.Connection] = None
+
+
+def la_sqlite(url) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def cau_hinh_url(url) -> URL:
+    """
+    URL đồng bộ (pysqlite) cho DATABASE_URL dạng sqlite. CSDL bộ nhớ dùng VFS memdb có tên riêng
+    theo tiến trình: engine đồng bộ và bất đồng bộ (nhiều kết nối) cùng thấy một CSDL, với khoá
+    như file thường (busy_timeout có tác dụng), khác với shared-cache.
+    """
+    global _giu_bo_nho
+    u = make_url(url)
+    if u.database in (None, "", ":memory:"):
+        ten = f"file:/bolt-{os.getpid()}"
+        if _giu_bo_nho is None: _giu_bo_nho = sqlite3.connect(f"{ten}?vfs=memdb", uri=True, check_same_thread=False)
+        u = u.set(database=ten).update_query_dict({"vfs": "memdb", "uri": "true"})
+    return u.set(drivername="sqlite+pysqlite")
+
+
+def la_bo_nho(url) -> bool:
+    return make_url(url).query.get("vfs") == "memdb"
+
+
+def tham_so_engine() -> dict:
+    """Tham số create_engine chung cho cả engine đồng bộ và bất đồng bộ."""
+    # native_datetime: giá trị đã là datetime nhờ converter, SQLAlchemy không parse lại
+    return {"connect_args": {"detect_types": sqlite3.PARSE_DECLTYPES, "check_same_thread": False}, "native_datetime": True}
+
+
+def _null_an_toan(ham):
+    return lambda *x: None if None in x else ham(*x)
+
+
+def _greatest(*gia_tri):
+    # Như Postgres: bỏ qua NULL, chỉ trả NULL khi mọi đối số đều NULL
+    con_lai = [x for x in gia_tri if x is not None]
+    return max(con_lai) if con_lai else None
+
+
+def _least(*gia_tri):
+    con_lai = [x for x in gia_tri if x is not None]
+    return min(con_lai) if con_lai else None
+
+
+def _now() -> str:
+    # Giờ UTC, cùng chuẩn với CURRENT_TIMESTAMP (giá trị mặc định server_default=func.now())
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None).isoformat(" ", "microseconds")
+
+
+_DO_CHI_TIET = {"minute": dict(second=0, microsecond=0), "hour": dict(minute=0, second=0, microsecond=0),
+                "day": dict(hour=0, minute=0, second=0, microsecond=0), "month": dict(day=1, hour=0, minute=0, second=0, microsecond=0)}
+
+
+def _date_trunc(do_chi_tiet: str, ts) -> Optional[str]:
+    if ts is None: return None
+    ts = ts if isinstance(ts, datetime.datetime) else datetime.datetime.fromisoformat(ts)
+    return ts.replace(**_DO_CHI_TIET[do_chi_tiet.lower()]).isoformat(" ", "microseconds")
+
+
+_HAM_SQL = (
+    ("RADIANS", 1, _null_an_toan(math.radians), True),
+    ("DEGREES", 1, _null_an_toan(math.degrees), True),
+    ("SIN", 1, _null_an_toan(math.sin), True),
+    ("COS", 1, _null_an_toan(math.cos), True),
+    # Kẹp vào [-1, 1]: sai số làm tròn có thể đẩy sqrt(a) của Haversine vượt 1 một chút
+    ("ASIN", 1, _null_an_toan(lambda x: math.asin(max(-1.0, min(1.0, x)))), True),
+    ("SQRT", 1, _null_an_toan(math.sqrt), True),
+    ("POWER", 2, _null_an_toan(math.pow), True),
+    ("GREATEST", -1, _greatest, True),
+    ("LEAST", -1, _least, True),
+    ("NOW", 0, _now, False),
+    ("date_trunc", 2, _date_trunc, True),
+)
+
+
+def cau_hinh_engine(eng, busy_timeout_ms: int = 5000, wal: bool = True) -> None:
+    """
+    Gắn cấu hình cho mọi kết nối của `eng` (engine đồng bộ hoặc async_engine.sync_engine):
+    đăng ký hàm SQL, PRAGMA, và cách mở transaction.
+    Mặc định BEGIN (deferred): transaction chỉ đọc không giữ khoá ghi. Transaction đọc-rồi-ghi (nhận việc
+    alert_jobs, gộp bảng tạm) mở bằng `session.connection(execution_options={GHI_NGAY: True})` để dùng
+    BEGIN IMMEDIATE: khoá ghi nhận ngay đầu transaction nên không bị SQLITE_BUSY khi nâng khoá giữa chừng,
+    chỉ chờ tối đa busy_timeout.
+    """
+    @event.listens_for(eng, "connect")
+    def _khi_ket_noi(dbapi_conn, connection_record):
+        # Tắt transaction ngầm của driver: SAVEPOINT (begin_nested) mới hoạt động đúng
+        dbapi_conn.isolation_level = None
+        for ten, so_doi_so, ham, tat_dinh in _HAM_SQL: dbapi_conn.create_function(ten, so_doi_so, ham, deterministic=tat_dinh)
+        cursor = dbapi_conn.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        cursor.execute("PRAGMA foreign_keys = ON")
+        # LIKE phân biệt hoa thường như Postgres
+        cursor.execute("PRAGMA case_sensitive_like = ON")
+        if wal:
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.close()
+
+    @event.listens_for(eng, "begin")
+    def _khi_bat_dau(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get(GHI_NGAY) else "BEGIN")
@@ -0,0 +1,51 @@
+import requests
+import json
+import datetime
+
+API_URL = "http://127.0.0.1:8000/device/heartbeat/batch"
+
+# Thông tin xác thực (giống hệt)
+headers = {
+    "Content-Type": "application/json",
+    "X-Device-ID": "BOLT-TEST-001",
+    "X-API-Key": "bolt_secret_key_for_testing"
+}
+
+# Giả lập thiết bị mất kết nối 5 phút rồi gửi lại 10 lần đọc đã lưu tạm (mỗi 30 giây)
+bat_dau = datetime.datetime.now() - datetime.timedelta(minutes=5)
+payload = []
+for i in range(10):
+    payload.append({
+        "timestamp": (bat_dau + datetime.timedelta(seconds=30 * i)).isoformat(),
+        "location": {
+            "lat": 10.7798 + i * 0.0005,
+            "lon": 106.7020
+        },
+        "obd_data": {
+            "fuel_level": 25.0 - i, # <-- Giảm dần, xuống dưới 20 ở các lần đọc cuối
+            "engine_status": "ON",
+            "rpm": 900,
+            "speed": 15,
+            "error_codes": []
+        }
+    })
+# Một phần tử hỏng: sẽ bị từ chối riêng, các phần tử khác vẫn được ghi
+payload.append({"timestamp": "khong-phai-thoi-gian", "location": {"lat": 10.78, "lon": 106.70}, "obd_data": {}})
+
+print(f"Đang gửi lô {len(payload)} Heartbeat tới: {API_URL}")
+
+try:
+    response = requests.post(API_URL, json=payload, headers=headers)
+
+    if response.status_code == 200:
+        data = response.json()
+        print("\n--- THÀNH CÔNG (200) ---")
+        print(f"Chấp nhận: {data['accepted']} | Từ chối: {data['rejected']}")
+        print(json.dumps([r for r in data["results"] if r["status"] == "rejected"], indent=2, ensure_ascii=False))
+        print("Chỉ MỘT cảnh báo Nhiên liệu thấp được tạo cho cả lô. Hãy kiểm tra bằng test_get_alerts.py.")
+    else:
+        print(f"\n--- LỖI ({response.status_code}) ---")
+        print(response.text)
+
+except requests.exceptions.ConnectionError:
+    print("\n--- LỖI KẾT NỐI ---")
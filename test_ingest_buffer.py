@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from sqlalchemy import exc
+
+from ingest_bolt import WriteBehindBuffer
+
+# Kiểm tra bộ đệm ghi trễ (không cần máy chủ / CSDL): hàm ghi giả lập CSDL ngừng hoạt động,
+# mất kết nối và bản ghi hỏng. Chạy: python test_ingest_buffer.py
+
+
+class CSDLGiaLap:
+    """Hàm ghi lô giả: lỗi tạm thời khi `hong_den` chưa qua, lỗi dữ liệu khi lô chứa bản ghi "HONG"."""
+
+    def __init__(self):
+        self.da_ghi = []
+        self.so_lan_goi = 0
+        self.hong_den = 0.0
+        self.loi_tam_thoi = exc.OperationalError("INSERT INTO obd_logs ...", {}, Exception("server closed the connection unexpectedly"))
+
+    async def ghi(self, lo):
+        self.so_lan_goi += 1
+        if time.monotonic() < self.hong_den: raise self.loi_tam_thoi
+        if "HONG" in lo: raise exc.DataError("INSERT INTO obd_logs ...", {}, Exception("bigint out of range"))
+        self.da_ghi.extend(lo)
+
+
+async def csdl_ngung_roi_hoi_phuc():
+    csdl = CSDLGiaLap()
+    buffer = WriteBehindBuffer(csdl.ghi, max_batch=50, flush_interval=0.01, backoff_min=0.05, backoff_max=0.4)
+    buffer.start()
+    csdl.hong_den = time.monotonic() + 1.5
+    for i in range(3000):
+        assert buffer.submit(i)
+        if i % 100 == 0: await asyncio.sleep(0.05)
+    lan_goi_khi_hong = csdl.so_lan_goi
+    await asyncio.sleep(0.5)
+    con_lai = await buffer.drain(timeout=5)
+    assert con_lai == 0 and buffer.dropped == 0, buffer.stats()
+    assert csdl.da_ghi == list(range(3000)), "Thiếu hoặc sai thứ tự bản ghi"
+    # Lùi dần (0.05 -> 0.4 giây): vài chục lần gọi trong 1.5 giây, không phải vòng lặp liên tục
+    assert lan_goi_khi_hong < 20, lan_goi_khi_hong
+    print(f"CSDL ngừng 1.5 giây: ghi đủ {len(csdl.da_ghi)} bản ghi, bỏ {buffer.dropped}, {lan_goi_khi_hong} lần gọi khi CSDL ngừng")
+
+
+async def mat_ket_noi():
+    csdl = CSDLGiaLap()
+    csdl.loi_tam_thoi = exc.DBAPIError("INSERT INTO obd_logs ...", {}, Exception("connection reset"), connection_invalidated=True)
+    buffer = WriteBehindBuffer(csdl.ghi, max_batch=10, flush_interval=0.01, backoff_min=0.01, backoff_max=0.05)
+    buffer.start()
+    csdl.hong_den = time.monotonic() + 0.5
+    for i in range(100): buffer.submit(i)
+    await asyncio.sleep(0.7)
+    await buffer.drain(timeout=5)
+    assert buffer.dropped == 0 and csdl.da_ghi == list(range(100)), buffer.stats()
+    print(f"Mất kết nối 0.5 giây: ghi đủ {len(csdl.da_ghi)} bản ghi, bỏ {buffer.dropped}")
+
+
+async def ban_ghi_hong():
+    csdl = CSDLGiaLap()
+    buffer = WriteBehindBuffer(csdl.ghi, max_batch=64, flush_interval=0.01)
+    buffer.start()
+    cac_ban_ghi = list(range(100)) + ["HONG"] + list(range(100, 200))
+    for x in cac_ban_ghi: buffer.submit(x)
+    await buffer.drain(timeout=5)
+    # Chỉ bản ghi hỏng bị bỏ
+    assert buffer.dropped == 1 and csdl.da_ghi == list(range(200)), buffer.stats()
+    print(f"Một bản ghi hỏng trong lô: ghi {len(csdl.da_ghi)} bản ghi, bỏ {buffer.dropped}")
+
+
+async def tat_khi_csdl_ngung():
+    csdl = CSDLGiaLap()
+    buffer = WriteBehindBuffer(csdl.ghi, max_batch=10, flush_interval=0.01, backoff_min=0.05, backoff_max=0.2)
+    buffer.start()
+    csdl.hong_den = time.monotonic() + 60
+    for i in range(25): buffer.submit(i)
+    bat_dau = time.monotonic()
+    con_lai = await buffer.drain(timeout=0.5)
+    # Hết hạn thì dừng, bản ghi vẫn nằm trong bộ đệm (không bị tính là đã bỏ)
+    assert con_lai == 25 and buffer.dropped == 0 and time.monotonic() - bat_dau < 1.5, buffer.stats()
+    print(f"Tắt máy chủ khi CSDL ngừng: dừng sau {time.monotonic() - bat_dau:.1f} giây, {con_lai} bản ghi chưa ghi, bỏ {buffer.dropped}")
+
+
+async def main():
+    await csdl_ngung_roi_hoi_phuc()
+    await mat_ket_noi()
+    await ban_ghi_hong()
+    await tat_khi_csdl_ngung()
+    print("\n--- THÀNH CÔNG --- Bộ đệm không bỏ heartbeat khi CSDL lỗi tạm thời.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+import requests
+import json
+
+API_URL = "http://127.0.0.1:8000/device/stream"
+
+# Thông tin xác thực (giống hệt)
+headers = {
+    "X-Device-ID": "BOLT-TEST-001",
+    "X-API-Key": "bolt_secret_key_for_testing"
+}
+
+print(f"Đang mở luồng sự kiện tại: {API_URL}...")
+print("Chạy test_low_fuel.py hoặc test_error_code.py ở Terminal khác để thấy sự kiện. Nhấn Ctrl+C để dừng.\n")
+
+try:
+    # stream=True: đọc từng dòng Server-Sent Events thay vì chờ hết response
+    with requests.get(API_URL, headers=headers, stream=True, timeout=(5, None)) as response:
+        if response.status_code != 200:
+            print(f"--- MỞ LUỒNG THẤT BẠI ---")
+            print(f"Mã trạng thái: {response.status_code}")
+            print(f"Nội dung lỗi: {response.text}")
+        else:
+            print("--- ĐÃ KẾT NỐI, ĐANG CHỜ SỰ KIỆN ---")
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("data: "):
+                    event = json.loads(line[len("data: "):])
+                    print(f"\n[{event['type']}]")
+                    print(json.dumps(event, indent=4, ensure_ascii=False))
+
+except KeyboardInterrupt:
+    print("\nĐã dừng.")
+except requests.exceptions.ConnectionError:
+    print("--- LỖI KẾT NỐI ---")
+    print("Không thể kết nối tới API. Hãy đảm bảo máy chủ 'uvicorn' đang chạy trong Terminal 1.")